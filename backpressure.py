@@ -0,0 +1,63 @@
+import typing
+
+import pydantic
+
+
+class SendLimits(pydantic.BaseModel):
+    min_interval: float = 1  # seconds between messages to fast browser
+    max_interval: float = 10  # seconds between messages to slow browser
+    send_timeout: float = 10  # browser is disconnected if its messages are not sent in this time
+    max_send_share: float = 0.5  # share of interval which sending of messages may take
+    slow_sends_limit: int = 3  # browser is disconnected after this number of sends in a row too slow for max_interval
+
+
+class SendRate:
+    """
+    Interval of messages to one browser, which adapts to measured throughput of its connection.
+
+    Send to browser waits while socket buffer is full, so its time shows how fast browser gets messages.
+    Interval is chosen so sending takes not more than max_send_share of it, browser which is too slow
+    even for max_interval is slow and should be disconnected.
+    """
+
+    smoothing = 0.3  # weight of last send in average throughput
+
+    def __init__(self, limits: SendLimits):
+        self.limits = limits
+        self.interval = limits.min_interval
+        # average of seconds per byte instead of bytes per second, so few stalled sends are not hidden by fast ones
+        self.seconds_per_byte: typing.Optional[float] = None
+        self.slow_sends_count = 0
+
+    @property
+    def throughput(self) -> typing.Optional[float]:
+        """Bytes per second."""
+        if not self.seconds_per_byte:
+            return None
+        return 1 / self.seconds_per_byte
+
+    @property
+    def is_slow(self) -> bool:
+        return self.slow_sends_count >= self.limits.slow_sends_limit
+
+    def on_sent(self, seconds: float, size: int) -> None:
+        """
+        Update interval by time of last send.
+
+        :param seconds: time of sending of messages
+        :param size: size of messages in bytes or characters
+        """
+        if size <= 0:
+            return
+        seconds_per_byte = seconds / size
+        if self.seconds_per_byte is None:
+            self.seconds_per_byte = seconds_per_byte
+        else:
+            self.seconds_per_byte += self.smoothing * (seconds_per_byte - self.seconds_per_byte)
+
+        needed_interval = size * self.seconds_per_byte / self.limits.max_send_share
+        self.interval = min(max(needed_interval, self.limits.min_interval), self.limits.max_interval)
+        if needed_interval > self.limits.max_interval:
+            self.slow_sends_count += 1
+        else:
+            self.slow_sends_count = 0
@@ -0,0 +1,55 @@
+import argparse
+import random
+import time
+
+import bus_engine
+import fake_bus
+import wire
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='Emulator engine benchmark',
+        description='Compare computing of bus positions one by one with vectorized numpy engine',
+    )
+    parser.add_argument('-rn', '--routes_number', type=int, default=1000,
+                        help='number of generated routes, default 1000')
+    parser.add_argument('-b', '--buses_per_route', type=int, default=100,
+                        help='number of buses per route, default 100')
+    args = parser.parse_args()
+
+    routes = [
+        {
+            'name': str(route_index),
+            'coordinates': [[random.uniform(55.55, 55.95), random.uniform(37.35, 37.85)] for _ in range(300)],
+        }
+        for route_index in range(args.routes_number)
+    ]
+    buses = [
+        (f'emulator-{route["name"]}-{bus_index}', route, bus_index * 100)
+        for route in routes
+        for bus_index in range(args.buses_per_route)
+    ]
+    timestamp = time.time()
+
+    frame_writer = wire.FrameWriter()
+    frame_writer.encode([fake_bus.get_bus_info(bus_id, route, delta, 1) for bus_id, route, delta in buses])
+    started_at = time.perf_counter()  # ids are interned already, only positions are measured
+    frame_writer.encode([fake_bus.get_bus_info(bus_id, route, delta, 1) for bus_id, route, delta in buses])
+    python_seconds = time.perf_counter() - started_at
+
+    fleet = bus_engine.BusFleet(
+        bus_engine.RouteTable(routes),
+        [(bus_id, route['name'], delta) for bus_id, route, delta in buses],
+    )
+    started_at = time.perf_counter()
+    fleet.pack_frame(timestamp, 1)
+    numpy_seconds = time.perf_counter() - started_at
+
+    print(f'{len(buses)} buses, one tick to binary frame')
+    print(f'python: {python_seconds * 1000:>10.1f} ms')
+    print(f'numpy:  {numpy_seconds * 1000:>10.1f} ms ({python_seconds / numpy_seconds:.0f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+import argparse
+import json
+import random
+import time
+import typing
+
+import models
+
+
+def generate_messages(messages_number: int) -> typing.List[str]:
+    """Generate JSON messages of microservice like fake_bus sends."""
+    return [
+        json.dumps({
+            'busId': f'emulator-{message_index % 1000}-{message_index % 100}',
+            'route': str(message_index % 1000),
+            'lat': random.uniform(55.55, 55.95),
+            'lng': random.uniform(37.35, 37.85),
+        }, ensure_ascii=False)
+        for message_index in range(messages_number)
+    ]
+
+
+def measure(parse: typing.Callable, messages: typing.List[str]) -> float:
+    """Return ingested messages per second."""
+    buses = {}
+    started_at = time.perf_counter()
+    for message in messages:
+        bus = parse(json.loads(message))
+        buses[bus.busId] = bus
+    return len(messages) / (time.perf_counter() - started_at)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='Ingest benchmark',
+        description='Compare validation of microservice messages by pydantic Bus with fast validation path',
+    )
+    parser.add_argument('-mn', '--messages_number', type=int, default=100000,
+                        help='number of messages, default 100000')
+    args = parser.parse_args()
+
+    messages = generate_messages(args.messages_number)
+    pydantic_rate = measure(lambda decoded_message: models.Bus(**decoded_message), messages)
+    fast_rate = measure(models.parse_bus, messages)
+    print(f'pydantic Bus: {pydantic_rate:>12.0f} messages/sec')
+    print(f'parse_bus:    {fast_rate:>12.0f} messages/sec ({fast_rate / pydantic_rate:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+import argparse
+import contextlib
+import json
+import pathlib
+import random
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import time
+import typing
+
+import numpy
+import trio
+from trio_websocket import open_websocket_url, ConnectionClosed
+
+ROOT_DIRECTORY = pathlib.Path(__file__).resolve().parent.parent
+MOSCOW_SOUTH_LAT, MOSCOW_NORTH_LAT = 55.55, 55.95
+MOSCOW_WEST_LNG, MOSCOW_EAST_LNG = 37.35, 37.85
+
+
+class LoadStats:
+    """Measurements of one load test, producers and browsers run in one process, so they share clock."""
+
+    def __init__(self):
+        # (bus id, lat, lng) -> (tick index, time of sending), positions are random, so they identify ping
+        self.sent_pings: typing.Dict[typing.Tuple[str, float, float], typing.Tuple[int, float]] = {}
+        self.sent_messages_count = 0
+        self.browser_messages_count = 0
+        self.browser_bytes_count = 0
+        self.latencies: typing.List[float] = []
+        self.tick_fanouts: typing.Dict[int, float] = {}
+
+    def deliver(self, bus: dict, received_at: float) -> bool:
+        """
+        Save latency of bus position which browser got first time.
+
+        :return: position was sent by producer
+        """
+        ping = self.sent_pings.get((bus['busId'], bus['lat'], bus['lng']))
+        if ping is None:
+            return False
+        tick_index, sent_at = ping
+        latency = received_at - sent_at
+        self.latencies.append(latency)
+        self.tick_fanouts[tick_index] = max(self.tick_fanouts.get(tick_index, 0), latency)
+        return True
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def get_commit() -> typing.Optional[str]:
+    with contextlib.suppress(OSError, subprocess.CalledProcessError):
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=ROOT_DIRECTORY,
+            text=True,
+            stderr=subprocess.DEVNULL,
+        ).strip()
+    return None
+
+
+def get_percentiles(values: typing.List[float]) -> typing.Dict[str, typing.Optional[float]]:
+    """Percentiles in milliseconds."""
+    if not values:
+        return {'p50': None, 'p99': None, 'max': None}
+    p50, p99, maximum = numpy.percentile(values, [50, 99, 100]) * 1000
+    return {'p50': round(p50, 2), 'p99': round(p99, 2), 'max': round(maximum, 2)}
+
+
+def get_random_bounds(max_size: float) -> dict:
+    lat_size = random.uniform(max_size / 4, max_size)
+    lng_size = lat_size * 1.7  # window is wider than it is high
+    south_lat = random.uniform(MOSCOW_SOUTH_LAT, MOSCOW_NORTH_LAT - lat_size)
+    west_lng = random.uniform(MOSCOW_WEST_LNG, MOSCOW_EAST_LNG - lng_size)
+    return {
+        'south_lat': south_lat,
+        'north_lat': south_lat + lat_size,
+        'west_lng': west_lng,
+        'east_lng': west_lng + lng_size,
+    }
+
+
+async def wait_for_port(port: int, timeout: float) -> None:
+    with trio.fail_after(timeout):
+        while True:
+            with contextlib.suppress(OSError):
+                stream = await trio.open_tcp_stream('127.0.0.1', port)
+                await stream.aclose()
+                return
+            await trio.sleep(0.1)
+
+
+async def produce_buses(
+    url: str,
+    bus_ids: typing.List[str],
+    refresh_timeout: float,
+    started_at: float,
+    finish_at: float,
+    stats: LoadStats,
+):
+    """Send new random position of every bus every refresh_timeout seconds like fake_bus does."""
+    async with open_websocket_url(url) as ws:
+        while trio.current_time() < finish_at:
+            tick_started_at = trio.current_time()
+            tick_index = int((tick_started_at - started_at) / refresh_timeout)
+            for bus_id in bus_ids:
+                bus = {
+                    'busId': bus_id,
+                    'route': bus_id.split('-')[1],
+                    'lat': random.uniform(MOSCOW_SOUTH_LAT, MOSCOW_NORTH_LAT),
+                    'lng': random.uniform(MOSCOW_WEST_LNG, MOSCOW_EAST_LNG),
+                }
+                stats.sent_pings[(bus['busId'], bus['lat'], bus['lng'])] = (tick_index, time.perf_counter())
+                await ws.send_message(json.dumps(bus))
+                stats.sent_messages_count += 1
+            await trio.sleep_until(tick_started_at + refresh_timeout)
+
+
+async def watch_buses(url: str, bounds: dict, options: dict, finish_at: float, stats: LoadStats):
+    """Browser which looks at random window and measures delay of bus positions."""
+    seen_positions = {}
+    async with open_websocket_url(url) as ws:
+        await ws.send_message(json.dumps({'msgType': 'setOptions', 'data': options}))
+        await ws.send_message(json.dumps({'msgType': 'newBounds', 'data': bounds}))
+        with trio.move_on_at(finish_at):
+            while True:
+                message = await ws.get_message()
+                received_at = time.perf_counter()
+                stats.browser_messages_count += 1
+                stats.browser_bytes_count += len(message)
+                for bus in json.loads(message).get('buses', []):
+                    position = bus['lat'], bus['lng']
+                    if seen_positions.get(bus['busId']) != position:  # full messages repeat unchanged buses
+                        seen_positions[bus['busId']] = position
+                        stats.deliver(bus, received_at)
+
+
+async def run_load(args: argparse.Namespace, bus_port: int, browser_port: int) -> LoadStats:
+    stats = LoadStats()
+    started_at = trio.current_time()
+    finish_at = started_at + args.duration
+    options = {'deltas': args.deltas}
+    buses_per_producer = args.buses_number // args.producers_number
+    with contextlib.suppress(ConnectionClosed):
+        async with trio.open_nursery() as nursery:
+            for _ in range(args.browsers_number):
+                bounds = get_random_bounds(args.window_size)
+                nursery.start_soon(watch_buses, f'ws://127.0.0.1:{browser_port}', bounds, options, finish_at, stats)
+            await trio.sleep(0.5)  # browsers are connected before first buses
+            for producer_index in range(args.producers_number):
+                bus_ids = [f'load-{index % 100}-{producer_index}-{index}' for index in range(buses_per_producer)]
+                nursery.start_soon(
+                    produce_buses,
+                    f'ws://127.0.0.1:{bus_port}',
+                    bus_ids,
+                    args.refresh_timeout,
+                    started_at,
+                    finish_at,
+                    stats,
+                )
+    return stats
+
+
+def build_report(args: argparse.Namespace, stats: LoadStats) -> dict:
+    return {
+        'commit': get_commit(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'parameters': vars(args),
+        'ingest_messages_per_second': round(stats.sent_messages_count / args.duration, 1),
+        'browser_messages_per_second': round(stats.browser_messages_count / args.duration, 1),
+        'browser_bytes_per_second': round(stats.browser_bytes_count / args.duration, 1),
+        'delivered_positions': len(stats.latencies),
+        'latency_ms': get_percentiles(stats.latencies),
+        'tick_fanout_ms': get_percentiles(list(stats.tick_fanouts.values())),
+    }
+
+
+def print_report(report: dict, previous_report: typing.Optional[dict] = None) -> None:
+    rows = [
+        ('ingest messages/sec', report['ingest_messages_per_second'], ('ingest_messages_per_second',)),
+        ('browser messages/sec', report['browser_messages_per_second'], ('browser_messages_per_second',)),
+        ('browser bytes/sec', report['browser_bytes_per_second'], ('browser_bytes_per_second',)),
+        ('latency p50, ms', report['latency_ms']['p50'], ('latency_ms', 'p50')),
+        ('latency p99, ms', report['latency_ms']['p99'], ('latency_ms', 'p99')),
+        ('tick fan-out p50, ms', report['tick_fanout_ms']['p50'], ('tick_fanout_ms', 'p50')),
+        ('tick fan-out p99, ms', report['tick_fanout_ms']['p99'], ('tick_fanout_ms', 'p99')),
+    ]
+    for title, value, path in rows:
+        line = f'{title:<22}{value!s:>14}'
+        if previous_report is not None:
+            previous_value = previous_report
+            for key in path:
+                previous_value = previous_value.get(key) if previous_value else None
+            line += f'{previous_value!s:>14}  ({previous_report.get("commit")})'
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='Load test',
+        description='Start server.py, load it with bus producers and browsers, measure throughput and latency',
+    )
+    parser.add_argument('-pn', '--producers_number', type=int, default=5,
+                        help='number of bus producer websockets, default 5')
+    parser.add_argument('-bn', '--buses_number', type=int, default=2000,
+                        help='number of buses of all producers, default 2000')
+    parser.add_argument('-brn', '--browsers_number', type=int, default=50,
+                        help='number of browsers with random windows, default 50')
+    parser.add_argument('-t', '--refresh_timeout', type=float, default=1,
+                        help='producers send new positions of all buses every "refresh_timeout" seconds, default 1')
+    parser.add_argument('-ws', '--window_size', type=float, default=0.1,
+                        help='max height of browser window in degrees, default 0.1')
+    parser.add_argument('-d', '--deltas', action='store_true',
+                        help='browsers get BusesDelta messages instead of Buses')
+    parser.add_argument('-du', '--duration', type=float, default=20,
+                        help='seconds of load, default 20')
+    parser.add_argument('-sa', '--server_args', type=str, default='',
+                        help='additional arguments of server.py, example --server_args="-bw 2"')
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='save results to JSON file')
+    parser.add_argument('-c', '--compare', type=str, default=None,
+                        help='JSON file with results of previous run to compare with')
+    args = parser.parse_args()
+
+    bus_port, browser_port = get_free_port(), get_free_port()
+    server = subprocess.Popen(
+        [sys.executable, 'server.py', '-host', '127.0.0.1', '-lp', str(bus_port), '-sp', str(browser_port),
+         '-v', '30', *shlex.split(args.server_args)],
+        cwd=ROOT_DIRECTORY,
+    )
+    try:
+        trio.run(wait_for_port, bus_port, 10)
+        trio.run(wait_for_port, browser_port, 10)
+        stats = trio.run(run_load, args, bus_port, browser_port)
+    finally:
+        server.send_signal(signal.SIGINT)
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    report = build_report(args, stats)
+    previous_report = None
+    if args.compare:
+        previous_report = json.loads(pathlib.Path(args.compare).read_text())
+    print_report(report, previous_report)
+    if args.output:
+        pathlib.Path(args.output).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+import argparse
+import random
+import time
+import typing
+
+import models
+import spatial
+
+MOSCOW_SOUTH_LAT, MOSCOW_NORTH_LAT = 55.55, 55.95
+MOSCOW_WEST_LNG, MOSCOW_EAST_LNG = 37.35, 37.85
+# window of browser with zoom 14 (minimal zoom in index.html)
+WINDOW_LAT_SIZE, WINDOW_LNG_SIZE = 0.05, 0.11
+
+
+def generate_buses(buses_number: int) -> typing.Dict[str, models.Bus]:
+    """Generate random buses in Moscow, validation is skipped because it is not measured."""
+    buses = {}
+    for bus_index in range(buses_number):
+        bus = models.Bus.construct(
+            busId=str(bus_index),
+            route=str(bus_index % 1000),
+            lat=random.uniform(MOSCOW_SOUTH_LAT, MOSCOW_NORTH_LAT),
+            lng=random.uniform(MOSCOW_WEST_LNG, MOSCOW_EAST_LNG),
+        )
+        buses[bus.busId] = bus
+    return buses
+
+
+def generate_windows(windows_number: int) -> typing.List[models.WindowBounds]:
+    """Generate random browser windows in Moscow."""
+    windows = []
+    for _ in range(windows_number):
+        south_lat = random.uniform(MOSCOW_SOUTH_LAT, MOSCOW_NORTH_LAT - WINDOW_LAT_SIZE)
+        west_lng = random.uniform(MOSCOW_WEST_LNG, MOSCOW_EAST_LNG - WINDOW_LNG_SIZE)
+        windows.append(models.WindowBounds(
+            south_lat=south_lat,
+            north_lat=south_lat + WINDOW_LAT_SIZE,
+            west_lng=west_lng,
+            east_lng=west_lng + WINDOW_LNG_SIZE,
+        ))
+    return windows
+
+
+def measure(function: typing.Callable, windows: typing.List[models.WindowBounds]) -> float:
+    """Return mean seconds of one window query."""
+    started_at = time.perf_counter()
+    for bounds in windows:
+        function(bounds)
+    return (time.perf_counter() - started_at) / len(windows)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='Spatial index benchmark',
+        description='Compare linear scan of buses with grid index for browser window queries',
+    )
+    parser.add_argument('-bn', '--buses_numbers', type=int, nargs='+', default=[1000, 10000, 50000, 100000],
+                        help='fleet sizes for benchmark, default 1000 10000 50000 100000')
+    parser.add_argument('-wn', '--windows_number', type=int, default=100,
+                        help='number of random windows per fleet size, default 100')
+    parser.add_argument('-cs', '--cell_size', type=float, default=0.01,
+                        help='size of grid cell in degrees, default 0.01')
+    args = parser.parse_args()
+
+    windows = generate_windows(args.windows_number)
+    print(f'{"buses":>10} {"linear, ms":>12} {"grid, ms":>12} {"speedup":>9}')
+    for buses_number in args.buses_numbers:
+        buses = generate_buses(buses_number)
+        grid = spatial.BusGrid(args.cell_size)
+        for bus in buses.values():
+            grid.update(bus)
+
+        linear_seconds = measure(
+            lambda bounds: [bus for bus in buses.values() if bounds.is_inside(bus)],
+            windows,
+        )
+        grid_seconds = measure(lambda bounds: list(grid.query(bounds)), windows)
+        speedup = linear_seconds / grid_seconds
+        print(f'{buses_number:>10} {linear_seconds * 1000:>12.3f} {grid_seconds * 1000:>12.3f} {speedup:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+import typing
+
+import numpy
+
+import route_store
+import wire
+
+# record of binary frame, see wire.BUS_RECORD
+BUS_RECORD_DTYPE = numpy.dtype([
+    ('bus_index', '<u4'),
+    ('route_index', '<u4'),
+    ('lat', '<i4'),
+    ('lng', '<i4'),
+])
+
+
+class RouteTable:
+    """Coordinates of all routes concatenated in one array, route points are found by offsets and lengths."""
+
+    def __init__(self, routes: typing.Iterable[dict]):
+        self.names: typing.List[str] = []
+        self.indexes: typing.Dict[str, int] = {}
+        coordinates = []
+        lengths = []
+        for route in routes:
+            self.indexes[route['name']] = len(self.names)
+            self.names.append(route['name'])
+            coordinates.append(numpy.asarray(route['coordinates'], dtype=numpy.float64).reshape(-1, 2))
+            lengths.append(len(route['coordinates']))
+
+        self.lengths = numpy.array(lengths, dtype=numpy.int64)
+        self.offsets = numpy.zeros(len(lengths), dtype=numpy.int64)
+        numpy.cumsum(self.lengths[:-1], out=self.offsets[1:])
+        self.coordinates = numpy.concatenate(coordinates) if coordinates else numpy.empty((0, 2))
+
+    @classmethod
+    def from_store(cls, store: route_store.RouteStore) -> 'RouteTable':
+        """Create table which uses memory-mapped coordinates of compiled routes without copying."""
+        route_table = cls([])
+        route_table.names = list(store.names)
+        route_table.indexes = {name: route_index for route_index, name in enumerate(route_table.names)}
+        route_table.offsets = store.offsets
+        route_table.lengths = store.lengths
+        route_table.coordinates = store.coordinates
+        return route_table
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+class BusFleet:
+    """
+    Buses which are emulated together, positions of all buses are computed by one vectorized operation.
+
+    Bus moves to next point of route every :sleep: seconds like in `fake_bus.get_bus_info`.
+    """
+
+    def __init__(
+        self,
+        route_table: RouteTable,
+        buses: typing.Sequence[typing.Tuple[str, str, int]],
+        first_bus_index: int = 0,
+    ):
+        """
+        Create fleet.
+
+        :param route_table: routes of buses
+        :param buses: tuples (bus id, route name, delta), see `fake_bus.get_bus_info`
+        :param first_bus_index: index of the first bus in binary frames, fleets which are sent by one websocket
+        need different indexes of buses
+        """
+        self.first_bus_index = first_bus_index
+        self.route_table = route_table
+        self.bus_ids = [bus_id for bus_id, _, _ in buses]
+        self.route_indexes = numpy.array(
+            [route_table.indexes[route_name] for _, route_name, _ in buses],
+            dtype=numpy.int64,
+        )
+        self.deltas = numpy.array([delta for _, _, delta in buses], dtype=numpy.int64)
+        self.offsets = route_table.offsets[self.route_indexes]
+        self.lengths = route_table.lengths[self.route_indexes]
+
+        self.records = numpy.zeros(len(self.bus_ids), dtype=BUS_RECORD_DTYPE)
+        self.records['bus_index'] = numpy.arange(first_bus_index, first_bus_index + len(self.bus_ids))
+        self.records['route_index'] = self.route_indexes
+
+    def __len__(self) -> int:
+        return len(self.bus_ids)
+
+    def get_positions(self, timestamp: float, sleep: float) -> numpy.ndarray:
+        """Get array of (lat, lng) of all buses."""
+        step = 1 / sleep
+        points_indexes = self.offsets + (self.deltas + int(timestamp * step)) % self.lengths
+        return self.route_table.coordinates[points_indexes]
+
+    def get_buses(self, timestamp: float, sleep: float) -> typing.List[dict]:
+        """Get info of all buses like `fake_bus.get_bus_info`."""
+        route_names = self.route_table.names
+        return [
+            {'busId': bus_id, 'route': route_names[route_index], 'lat': lat, 'lng': lng}
+            for bus_id, route_index, (lat, lng)
+            in zip(self.bus_ids, self.route_indexes.tolist(), self.get_positions(timestamp, sleep).tolist())
+        ]
+
+    def build_dictionary_message(self) -> str:
+        """Build dictionary of indexes of binary frames, buses are indexed in order from the first bus index."""
+        route_names = self.route_table.names
+        return wire.build_dictionary_message(
+            enumerate(self.bus_ids, self.first_bus_index),
+            ((route_index, route_names[route_index]) for route_index in numpy.unique(self.route_indexes).tolist()),
+        )
+
+    def pack_frame(self, timestamp: float, sleep: float) -> bytes:
+        """Pack positions of all buses to binary frame without python loop over buses."""
+        positions = self.get_positions(timestamp, sleep)
+        self.records['lat'] = numpy.rint(positions[:, 0] * wire.COORDINATE_SCALE)
+        self.records['lng'] = numpy.rint(positions[:, 1] * wire.COORDINATE_SCALE)
+        return wire.BUSES_FRAME_HEADER.pack(wire.FRAME_BUSES) + self.records.tobytes()
@@ -0,0 +1,206 @@
+import json
+import logging
+import os
+import pathlib
+import struct
+import typing
+import zlib
+
+import numpy
+import trio
+
+import models
+
+logger = logging.getLogger(__name__)
+
+# size of payload, crc32 of payload, number of updated buses, number of removed buses
+BATCH_HEADER = struct.Struct('<IIII')
+SNAPSHOT_MAGIC = b'BUSSNAP1'
+SEGMENT_TEMPLATE = 'segment-{:010d}.log'
+SNAPSHOT_TEMPLATE = 'snapshot-{:010d}.bin'
+# snapshot is written before its interval if log after it has more updates than buses and this number,
+# so restore reads not much more than two snapshots of data
+MIN_SNAPSHOT_TAIL = 10000
+
+
+def pack_batch(buses: typing.Sequence[models.BusRecord], removed_bus_ids: typing.Sequence[str] = ()) -> bytes:
+    """
+    Pack buses to columnar batch: coordinates as float64 arrays and strings as JSON.
+
+    Columns are decoded by numpy and json without Python code per bus, so restore of 100k buses is fast.
+    """
+    lats = numpy.fromiter((bus.lat for bus in buses), dtype='<f8', count=len(buses))
+    lngs = numpy.fromiter((bus.lng for bus in buses), dtype='<f8', count=len(buses))
+    strings = json.dumps(
+        [[bus.busId for bus in buses], [bus.route for bus in buses], list(removed_bus_ids)],
+        ensure_ascii=False,
+    ).encode('utf8')
+    payload = lats.tobytes() + lngs.tobytes() + strings
+    return BATCH_HEADER.pack(len(payload), zlib.crc32(payload), len(buses), len(removed_bus_ids)) + payload
+
+
+def unpack_batches(data: bytes) -> typing.Iterator[typing.Tuple[list, list, list, list, list]]:
+    """
+    Unpack batches one by one, torn or broken batch at the end of data stops reading.
+
+    :return: tuples (bus ids, routes, lats, lngs, removed bus ids)
+    """
+    offset = 0
+    while offset + BATCH_HEADER.size <= len(data):
+        payload_size, crc, buses_count, removed_count = BATCH_HEADER.unpack_from(data, offset)
+        payload = data[offset + BATCH_HEADER.size:offset + BATCH_HEADER.size + payload_size]
+        if len(payload) < payload_size or zlib.crc32(payload) != crc:
+            logger.warning(f'broken batch at offset {offset} of log, rest of it is skipped')
+            return
+        coordinates = numpy.frombuffer(payload, dtype='<f8', count=buses_count * 2)
+        bus_ids, routes, removed_bus_ids = json.loads(payload[buses_count * 16:].decode('utf8'))
+        yield bus_ids, routes, coordinates[:buses_count].tolist(), coordinates[buses_count:].tolist(), removed_bus_ids
+        offset += BATCH_HEADER.size + payload_size
+
+
+class BusLog:
+    """
+    Append-only log of bus updates in segment files with periodic snapshots, server restores buses from it on start.
+
+    Updates are only collected in memory on event loop, latest state of every bus since previous flush is written
+    by batch in a thread. Snapshot of all buses closes current segment, older segments and snapshots are deleted.
+    """
+
+    def __init__(self, directory: typing.Union[str, pathlib.Path], segment_size: int = 64 * 1024 * 1024):
+        """
+        :param directory: directory of log files, it is created if it doesn't exist
+        :param segment_size: segment is closed when it is bigger than segment_size bytes
+        """
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_size = segment_size
+        # latest state of buses since previous flush, None means removed bus
+        self.pending: typing.Dict[str, typing.Optional[models.BusRecord]] = {}
+        self.segment_number = max(self._get_numbers('segment-*.log', 'snapshot-*.bin'), default=0) + 1
+        self.segment_file: typing.Optional[typing.BinaryIO] = None
+        self.tail_buses_count = 0  # number of updates and removals in log after the latest snapshot
+
+    def _get_numbers(self, *patterns: str) -> typing.List[int]:
+        return sorted(
+            int(path.stem.split('-')[1])
+            for pattern in patterns
+            for path in self.directory.glob(pattern)
+        )
+
+    def append(self, bus: models.BusRecord) -> None:
+        self.pending[bus.busId] = bus
+
+    def remove(self, bus_id: str) -> None:
+        self.pending[bus_id] = None
+
+    def restore(self) -> typing.List[models.BusRecord]:
+        """Read the latest snapshot and segments after it."""
+        state: typing.Dict[str, typing.Tuple[str, float, float]] = {}
+        snapshot_number = 0
+        for number in reversed(self._get_numbers('snapshot-*.bin')):
+            data = (self.directory / SNAPSHOT_TEMPLATE.format(number)).read_bytes()
+            if not data.startswith(SNAPSHOT_MAGIC):
+                continue
+            batches = list(unpack_batches(data[len(SNAPSHOT_MAGIC):]))
+            if batches:
+                bus_ids, routes, lats, lngs, _ = batches[0]
+                state.update(zip(bus_ids, zip(routes, lats, lngs)))
+                snapshot_number = number
+                break
+            logger.warning(f'snapshot {number} is broken, try previous one')
+
+        for number in self._get_numbers('segment-*.log'):
+            if number < snapshot_number:
+                continue
+            for bus_ids, routes, lats, lngs, removed_bus_ids in unpack_batches(
+                (self.directory / SEGMENT_TEMPLATE.format(number)).read_bytes()
+            ):
+                self.tail_buses_count += len(bus_ids) + len(removed_bus_ids)
+                state.update(zip(bus_ids, zip(routes, lats, lngs)))
+                for bus_id in removed_bus_ids:
+                    state.pop(bus_id, None)
+        return [models.BusRecord(bus_id, route, lat, lng) for bus_id, (route, lat, lng) in state.items()]
+
+    def take_pending(self) -> typing.Dict[str, typing.Optional[models.BusRecord]]:
+        pending, self.pending = self.pending, {}
+        return pending
+
+    def write(self, pending: typing.Dict[str, typing.Optional[models.BusRecord]]) -> None:
+        """Write batch of pending changes to current segment, it is called in a thread."""
+        if not pending:
+            return
+        if self.segment_file is None:
+            self.segment_file = open(self.directory / SEGMENT_TEMPLATE.format(self.segment_number), 'ab')
+        buses = [bus for bus in pending.values() if bus is not None]
+        removed_bus_ids = [bus_id for bus_id, bus in pending.items() if bus is None]
+        self.segment_file.write(pack_batch(buses, removed_bus_ids))
+        self.tail_buses_count += len(pending)
+        self.segment_file.flush()
+        if self.segment_file.tell() >= self.segment_size:
+            self._close_segment()
+
+    def _close_segment(self) -> None:
+        if self.segment_file is not None:
+            os.fsync(self.segment_file.fileno())
+            self.segment_file.close()
+            self.segment_file = None
+        self.segment_number += 1
+
+    def write_snapshot(
+        self,
+        pending: typing.Dict[str, typing.Optional[models.BusRecord]],
+        buses: typing.Sequence[models.BusRecord],
+    ) -> None:
+        """
+        Write pending changes, close segment and write snapshot of buses, it is called in a thread.
+
+        :param buses: all buses after pending changes
+        """
+        self.write(pending)
+        self._close_segment()
+        snapshot_path = self.directory / SNAPSHOT_TEMPLATE.format(self.segment_number)
+        temporary_path = snapshot_path.with_suffix('.tmp')
+        with open(temporary_path, 'wb') as snapshot_file:
+            snapshot_file.write(SNAPSHOT_MAGIC + pack_batch(buses))
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(temporary_path, snapshot_path)
+        self.tail_buses_count = 0
+        # snapshot contains everything of older files
+        for number in self._get_numbers('segment-*.log'):
+            if number < self.segment_number:
+                (self.directory / SEGMENT_TEMPLATE.format(number)).unlink()
+        for number in self._get_numbers('snapshot-*.bin'):
+            if number < self.segment_number:
+                (self.directory / SNAPSHOT_TEMPLATE.format(number)).unlink()
+
+    def close(self) -> None:
+        self.write(self.take_pending())
+        if self.segment_file is not None:
+            self.segment_file.close()
+            self.segment_file = None
+
+    async def run(
+        self,
+        buses: typing.Mapping[str, models.BusRecord],
+        flush_every_seconds: float,
+        snapshot_every_seconds: float,
+    ):
+        """
+        Write batches and snapshots in a thread, so disk doesn't block event loop.
+
+        :param buses: all buses of server, they are copied for snapshot
+        """
+        snapshot_at = trio.current_time() + snapshot_every_seconds
+        while True:
+            await trio.sleep(flush_every_seconds)
+            # pending changes and buses are taken together, so snapshot is consistent with segments after it
+            pending = self.take_pending()
+            is_tail_long = self.tail_buses_count + len(pending) > max(len(buses), MIN_SNAPSHOT_TAIL)
+            if trio.current_time() >= snapshot_at or is_tail_long:
+                snapshot_buses = list(buses.values())
+                await trio.to_thread.run_sync(self.write_snapshot, pending, snapshot_buses)
+                snapshot_at = trio.current_time() + snapshot_every_seconds
+                logger.debug('write snapshot of %s buses', len(snapshot_buses))
+            else:
+                await trio.to_thread.run_sync(self.write, pending)
@@ -0,0 +1,361 @@
+import collections
+import json
+import typing
+
+import models
+import route_index
+import spatial
+import wire
+
+# indexes of bus ids aren't renumbered while there are less of them, so churn of few buses doesn't renumber often
+MIN_BUS_INDEXES_TO_RENUMBER = 100000
+
+
+class BusesEncoder:
+    """
+    Cache of encoded JSON fragments of buses shared by all browsers.
+
+    Every bus is encoded once after its update and every grid cell is joined once after update of any of its buses,
+    so a message for a browser is assembled from ready fragments and encoding cost doesn't grow with browsers number.
+    """
+
+    def __init__(self, grid: spatial.BusGrid, routes_index: typing.Optional[route_index.RouteIndex] = None):
+        """
+        :param grid: buses of all windows
+        :param routes_index: buses by routes, it's needed to build messages only with buses of some routes
+        """
+        self.grid = grid
+        self.routes_index = routes_index
+        self.bus_fragments: typing.Dict[str, str] = {}
+        self.cell_fragments: typing.Dict[spatial.Cell, str] = {}
+        self.bus_records: typing.Dict[str, bytes] = {}
+        # indexes are common for all browsers, every browser gets only indexes of buses which it sees,
+        # indexes of removed buses are freed all together by renumbering, when they are the most of indexes
+        self.bus_ids = wire.Interner()
+        self.routes = wire.Interner()
+        self.bus_ids_generation = 0
+
+    def invalidate(self, bus_id: str, *cells: typing.Optional[spatial.Cell]) -> None:
+        """Forget fragments of changed bus and of cells where it was and where it is now."""
+        self.bus_fragments.pop(bus_id, None)
+        self.bus_records.pop(bus_id, None)
+        for cell in cells:
+            self.cell_fragments.pop(cell, None)
+
+    def remove(self, bus_id: str, cell: typing.Optional[spatial.Cell]) -> None:
+        """Forget removed bus, indexes of bus ids are renumbered if there are twice more of them than buses."""
+        self.invalidate(bus_id, cell)
+        if len(self.bus_ids) > max(MIN_BUS_INDEXES_TO_RENUMBER, 2 * len(self.grid)):
+            self.renumber_bus_ids()
+
+    def renumber_bus_ids(self) -> None:
+        """Drop indexes of all bus ids, browsers get new indexes of buses they see in dictionary messages."""
+        self.bus_ids = wire.Interner()
+        self.bus_records.clear()
+        self.bus_ids_generation += 1
+
+    def clear(self) -> None:
+        self.bus_fragments.clear()
+        self.cell_fragments.clear()
+        self.bus_records.clear()
+
+    def query(
+        self,
+        bounds: models.WindowBounds,
+        routes: typing.Collection[str] = (),
+    ) -> typing.Iterator[models.BusRecord]:
+        """Get buses inside window bounds, only buses of routes if they are passed."""
+        if routes:
+            return self.routes_index.query(routes, bounds)
+        return self.grid.query(bounds)
+
+    def encode_bus(self, bus: models.BusRecord) -> str:
+        fragment = self.bus_fragments.get(bus.busId)
+        if fragment is None:
+            fragment = json.dumps(bus.dict(), ensure_ascii=False)
+            self.bus_fragments[bus.busId] = fragment
+        return fragment
+
+    def encode_bus_record(self, bus: models.BusRecord) -> bytes:
+        record = self.bus_records.get(bus.busId)
+        if record is None:
+            record = wire.pack_bus_record(
+                self.bus_ids.intern(bus.busId),
+                self.routes.intern(bus.route),
+                bus.lat,
+                bus.lng,
+            )
+            self.bus_records[bus.busId] = record
+        return record
+
+    def build_dictionary_messages(
+        self,
+        window_buses: typing.Iterable[models.BusRecord],
+        known: wire.Dictionary,
+        removed_bus_ids: typing.Iterable[str] = (),
+    ) -> typing.List[str]:
+        """Build BusDictionary message with indexes of buses and routes which browser doesn't know yet."""
+        if known.generation != self.bus_ids_generation:
+            known.bus_ids.clear()
+            known.generation = self.bus_ids_generation
+        new_bus_ids = []
+        new_routes = []
+        for bus_id in removed_bus_ids:
+            bus_index = self.bus_ids.intern(bus_id)
+            if bus_index not in known.bus_ids:
+                new_bus_ids.append((bus_index, bus_id))
+                known.bus_ids[bus_index] = bus_id
+        for bus in window_buses:
+            bus_index = self.bus_ids.intern(bus.busId)
+            if bus_index not in known.bus_ids:
+                new_bus_ids.append((bus_index, bus.busId))
+                known.bus_ids[bus_index] = bus.busId
+            route_index = self.routes.intern(bus.route)
+            if route_index not in known.routes:
+                new_routes.append((route_index, bus.route))
+                known.routes[route_index] = bus.route
+        if not new_bus_ids and not new_routes:
+            return []
+        return [wire.build_dictionary_message(new_bus_ids, new_routes)]
+
+    def encode_cell(self, cell: spatial.Cell, cell_buses: typing.Dict[str, models.BusRecord]) -> str:
+        fragment = self.cell_fragments.get(cell)
+        if fragment is None:
+            fragment = ', '.join(map(self.encode_bus, cell_buses.values()))
+            self.cell_fragments[cell] = fragment
+        return fragment
+
+    def encode_window(self, bounds: models.WindowBounds) -> typing.Tuple[typing.List[str], int]:
+        """
+        Get fragments of buses inside window bounds.
+
+        :return: fragments and number of buses in them
+        """
+        fragments = []
+        buses_count = 0
+        for cell, cell_buses, is_inside in self.grid.query_cells(bounds):
+            if is_inside:
+                fragments.append(self.encode_cell(cell, cell_buses))
+                buses_count += len(cell_buses)
+            else:
+                for bus in cell_buses.values():
+                    if bounds.is_inside(bus):
+                        fragments.append(self.encode_bus(bus))
+                        buses_count += 1
+        return fragments, buses_count
+
+    def build_buses_message(
+        self,
+        bounds: models.WindowBounds,
+        routes: typing.Collection[str] = (),
+    ) -> typing.Tuple[str, int]:
+        """
+        Build "Buses" message for browser from cached fragments.
+
+        :param routes: routes which browser watches, empty means all routes
+        :return: message and number of buses in it
+        """
+        if routes:
+            fragments = [self.encode_bus(bus) for bus in self.routes_index.query(routes, bounds)]
+            buses_count = len(fragments)
+        else:
+            fragments, buses_count = self.encode_window(bounds)
+        message = '{"msgType": "Buses", "buses": [' + ', '.join(fragments) + ']}'
+        return message, buses_count
+
+    def build_binary_buses_messages(
+        self,
+        bounds: models.WindowBounds,
+        known: wire.Dictionary,
+        routes: typing.Collection[str] = (),
+    ) -> typing.Tuple[typing.List[typing.Union[str, bytes]], int]:
+        """
+        Build binary frame with buses inside window bounds, it's preceded by dictionary message if it's needed.
+
+        :param known: indexes which browser already knows, it's updated by new indexes
+        :param routes: routes which browser watches, empty means all routes
+        :return: messages and number of buses in frame
+        """
+        window_buses = list(self.query(bounds, routes))
+        messages = self.build_dictionary_messages(window_buses, known)
+        messages.append(wire.pack_buses_frame(map(self.encode_bus_record, window_buses)))
+        return messages, len(window_buses)
+
+
+class MessageCompressor:
+    """
+    Deflate compression of messages for browsers which asked for it.
+
+    Browsers with equal windows get equal messages, so frames are cached by messages and equal message
+    is compressed once for all browsers. The least recently used frames are dropped when cache is full.
+    """
+
+    def __init__(self, level: int = 6, threshold: int = 1024, cache_size: int = 16 * 1024 * 1024):
+        """
+        :param level: zlib compression level from 1 (fast) to 9 (small)
+        :param threshold: smaller messages are sent without compression
+        :param cache_size: max size of cached messages and their frames in bytes or characters
+        """
+        self.level = level
+        self.threshold = threshold
+        self.cache_size = cache_size
+        self.frames: typing.OrderedDict[typing.Union[str, bytes], typing.Union[str, bytes]] = collections.OrderedDict()
+        self.cached_size = 0
+
+    def compress(self, message: typing.Union[str, bytes]) -> typing.Union[str, bytes]:
+        """Get deflate frame of message or message itself if it is small or doesn't compress."""
+        if len(message) < self.threshold:
+            return message
+        frame = self.frames.get(message)
+        if frame is not None:
+            self.frames.move_to_end(message)
+            return frame
+
+        frame = wire.pack_deflate_frame(message, self.level)
+        if len(frame) >= len(message):
+            frame = message
+        self.frames[message] = frame
+        self.cached_size += len(message) + len(frame)
+        while self.cached_size > self.cache_size and self.frames:
+            old_message, old_frame = self.frames.popitem(last=False)
+            self.cached_size -= len(old_message) + len(old_frame)
+        return frame
+
+
+def build_clusters_message(clusters: typing.Iterable[spatial.Cluster], cell_size: float) -> str:
+    """Build "Clusters" message with number of buses and their centroid for every cluster."""
+    return json.dumps({
+        'msgType': 'Clusters',
+        'cellSize': cell_size,
+        'clusters': [
+            {'lat': round(cluster.lat, 6), 'lng': round(cluster.lng, 6), 'count': cluster.count}
+            for cluster in clusters
+        ],
+    })
+
+
+def build_track_message(bus_id: str, track: typing.Iterable[typing.Tuple[float, float, float]]) -> str:
+    """Build "Track" message with saved positions of bus from old to new."""
+    return json.dumps({
+        'msgType': 'Track',
+        'busId': bus_id,
+        'track': [
+            {'timestamp': timestamp, 'lat': lat, 'lng': lng}
+            for timestamp, lat, lng in track
+        ],
+    }, ensure_ascii=False)
+
+
+def build_replay_message(buses: typing.Iterable[models.BusRecord], replay_time: float) -> str:
+    """Build "Buses" message with positions of buses at replay time, fragments of buses cache are not used."""
+    return json.dumps({
+        'msgType': 'Buses',
+        'replayTime': replay_time,
+        'buses': [bus.dict() for bus in buses],
+    }, ensure_ascii=False)
+
+
+class BusesDeltaTracker:
+    """
+    Buses which one browser already has, it's used to send only changes in "BusesDelta" messages.
+
+    Bus is changed if it is a new object, because server creates new bus on every update.
+    Every `keyframe_every` messages full state is sent to fix possible divergence with browser.
+    If reported buses are set, buses of window are sent with positions which they reported instead of
+    estimated ones, cached fragments of encoder aren't used for them, because they are estimated positions.
+    """
+
+    def __init__(self, encoder: BusesEncoder, keyframe_every: int = 30):
+        self.encoder = encoder
+        self.keyframe_every = keyframe_every
+        self.sent_buses: typing.Dict[str, models.BusRecord] = {}
+        self.messages_to_keyframe = 0
+        self.reported_buses: typing.Optional[typing.Dict[str, models.BusRecord]] = None
+
+    def reset(self) -> None:
+        """Forget sent buses, next message will be keyframe."""
+        self.sent_buses = {}
+        self.messages_to_keyframe = 0
+
+    def get_delta(
+        self,
+        bounds: models.WindowBounds,
+        routes: typing.Collection[str] = (),
+    ) -> typing.Tuple[bool, typing.List[models.BusRecord], typing.List[str]]:
+        """
+        Get changes of buses inside window bounds since previous call.
+
+        :param routes: routes which browser watches, empty means all routes
+        :return: keyframe flag, changed buses (all buses for keyframe) and ids of buses removed from window
+        """
+        window_buses = {bus.busId: bus for bus in self.encoder.query(bounds, routes)}
+        if self.reported_buses is not None:
+            window_buses = {bus_id: self.reported_buses.get(bus_id, bus) for bus_id, bus in window_buses.items()}
+        is_keyframe = self.messages_to_keyframe <= 0
+        if is_keyframe:
+            changed_buses = list(window_buses.values())
+            removed_bus_ids = []
+            self.messages_to_keyframe = self.keyframe_every
+        else:
+            sent_buses = self.sent_buses
+            changed_buses = [bus for bus_id, bus in window_buses.items() if sent_buses.get(bus_id) is not bus]
+            removed_bus_ids = [bus_id for bus_id in sent_buses if bus_id not in window_buses]
+        self.messages_to_keyframe -= 1
+        self.sent_buses = window_buses
+        return is_keyframe, changed_buses, removed_bus_ids
+
+    def build_delta_message(
+        self,
+        bounds: models.WindowBounds,
+        routes: typing.Collection[str] = (),
+    ) -> typing.Tuple[str, int]:
+        """
+        Build "BusesDelta" message with changed buses and ids of buses removed from window.
+
+        :param routes: routes which browser watches, empty means all routes
+        :return: message and number of buses in it
+        """
+        is_keyframe, changed_buses, removed_bus_ids = self.get_delta(bounds, routes)
+        message = (
+            '{"msgType": "BusesDelta", "keyframe": ' + json.dumps(is_keyframe)
+            + ', "buses": [' + ', '.join(map(self.encode_bus, changed_buses))
+            + '], "removed": ' + json.dumps(removed_bus_ids, ensure_ascii=False) + '}'
+        )
+        return message, len(changed_buses)
+
+    def build_binary_delta_messages(
+        self,
+        bounds: models.WindowBounds,
+        known: wire.Dictionary,
+        routes: typing.Collection[str] = (),
+    ) -> typing.Tuple[typing.List[typing.Union[str, bytes]], int]:
+        """
+        Build binary delta frame, it's preceded by dictionary message if it's needed.
+
+        :param known: indexes which browser already knows, it's updated by new indexes
+        :param routes: routes which browser watches, empty means all routes
+        :return: messages and number of buses in frame
+        """
+        is_keyframe, changed_buses, removed_bus_ids = self.get_delta(bounds, routes)
+        messages = self.encoder.build_dictionary_messages(changed_buses, known, removed_bus_ids)
+        messages.append(wire.pack_buses_delta_frame(
+            is_keyframe,
+            [self.encoder.bus_ids.intern(bus_id) for bus_id in removed_bus_ids],
+            map(self.encode_bus_record, changed_buses),
+        ))
+        return messages, len(changed_buses)
+
+    def encode_bus(self, bus: models.BusRecord) -> str:
+        if self.reported_buses is None:
+            return self.encoder.encode_bus(bus)
+        return json.dumps(bus.dict(), ensure_ascii=False)
+
+    def encode_bus_record(self, bus: models.BusRecord) -> bytes:
+        if self.reported_buses is None:
+            return self.encoder.encode_bus_record(bus)
+        return wire.pack_bus_record(
+            self.encoder.bus_ids.intern(bus.busId),
+            self.encoder.routes.intern(bus.route),
+            bus.lat,
+            bus.lng,
+        )
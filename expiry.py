@@ -0,0 +1,83 @@
+import math
+import typing
+
+
+class ExpiryWheel:
+    """
+    Timing wheel of buses last seen time, it finds buses which were not updated for ttl seconds.
+
+    Bus is put to slot of its deadline only when it is seen first time, updates just save last seen time.
+    When wheel reaches the slot, its buses are expired or moved to slot of new deadline,
+    so every tick costs O(buses of slot) instead of scan of all buses.
+    """
+
+    def __init__(self, ttl: float, tick: float = 1):
+        """
+        :param ttl: seconds after last update when bus is expired
+        :param tick: resolution of wheel in seconds, bus is expired not later than ttl + tick after last update
+        """
+        if ttl <= 0 or tick <= 0:
+            raise ValueError('ttl and tick should be positive')
+        self.ttl = ttl
+        self.tick = tick
+        # deadline of bus is never farther than ceil(ttl / tick) + 1 ticks from current tick
+        self.slots: typing.List[typing.Set[str]] = [set() for _ in range(math.ceil(ttl / tick) + 2)]
+        self.last_seen: typing.Dict[str, float] = {}
+        self.bus_slots: typing.Dict[str, int] = {}
+        self.processed_tick: typing.Optional[int] = None
+        self.expired_buses_count = 0
+
+    def __len__(self) -> int:
+        return len(self.last_seen)
+
+    def _schedule(self, bus_id: str, deadline: float) -> None:
+        slot_index = math.ceil(deadline / self.tick) % len(self.slots)
+        self.slots[slot_index].add(bus_id)
+        self.bus_slots[bus_id] = slot_index
+
+    def touch(self, bus_id: str, now: float) -> None:
+        """Save that bus was seen at now."""
+        self.last_seen[bus_id] = now
+        if bus_id not in self.bus_slots:
+            self._schedule(bus_id, now + self.ttl)
+
+    def discard(self, bus_id: str) -> None:
+        """Forget bus, which was removed by other way."""
+        self.last_seen.pop(bus_id, None)
+        slot_index = self.bus_slots.pop(bus_id, None)
+        if slot_index is not None:
+            self.slots[slot_index].discard(bus_id)
+
+    def clear(self) -> None:
+        for slot in self.slots:
+            slot.clear()
+        self.last_seen.clear()
+        self.bus_slots.clear()
+
+    def expire(self, now: float) -> typing.List[str]:
+        """
+        Turn wheel to now and forget buses, which were not seen for ttl seconds.
+
+        :return: ids of expired buses
+        """
+        target_tick = math.floor(now / self.tick)
+        if self.processed_tick is None:
+            self.processed_tick = target_tick - len(self.slots)
+        # after long pause every slot is processed once
+        first_tick = max(self.processed_tick + 1, target_tick - len(self.slots) + 1)
+        expired_bus_ids = []
+        for tick_index in range(first_tick, target_tick + 1):
+            slot_index = tick_index % len(self.slots)
+            slot = self.slots[slot_index]
+            self.slots[slot_index] = set()
+            for bus_id in slot:
+                del self.bus_slots[bus_id]
+                deadline = self.last_seen[bus_id] + self.ttl
+                if deadline <= now:
+                    del self.last_seen[bus_id]
+                    expired_bus_ids.append(bus_id)
+                else:
+                    self._schedule(bus_id, deadline)
+        self.processed_tick = max(self.processed_tick, target_tick)
+        self.expired_buses_count += len(expired_bus_ids)
+        return expired_bus_ids
@@ -1,12 +1,15 @@
 import argparse
+import collections
 import contextlib
 import functools
 import glob
 import os
 import json
+import multiprocessing
 import random
 import time
 import logging
+import math
 import typing
 
 import trio
@@ -14,81 +17,389 @@ import trio_websocket
 import wsproto.utilities
 from trio_websocket import open_websocket_url
 
+import bus_engine
+import route_store
+import wire
+
 logger = logging.getLogger(__name__)
 
 
-def load_routes(directory_path: str = 'routes', routes_number: int = 0):
+# max buses waiting for websocket, new buses are dropped if queue of websocket is full,
+# fleet which is bigger than the limit is queued only to empty queue
+CHANNEL_BUFFER_SIZE = 1024
+
+
+class SendStats:
+    """Counters of data sent by emulator process."""
+
+    def __init__(self):
+        self.buses = 0
+        self.messages = 0
+        self.bytes = 0
+        self.dropped_buses = 0
+
+    def add(self, buses_count: int, message: typing.Union[str, bytes]) -> None:
+        self.buses += buses_count
+        self.messages += 1
+        self.bytes += len(message)
+
+    def snapshot(self) -> typing.Tuple[int, int, int, int]:
+        return self.buses, self.messages, self.bytes, self.dropped_buses
+
+
+send_stats = SendStats()
+
+
+class PooledConnection:
+    """Websocket of connection pool with its queue of buses and fleets and stats."""
+
+    def __init__(self, index: int):
+        self.index = index
+        # items of queue are bus or fleet with number of its buses, size of queue is limited by number of buses
+        self.send_channel, self.receive_channel = trio.open_memory_channel(max_buffer_size=math.inf)
+        self.is_healthy = False  # websocket is connected
+        self.queue_depth = 0  # number of buses in queue
+        self.connects = 0
+        self.stats = SendStats()
+
+    def get_load(self) -> typing.Tuple[bool, int]:
+        return not self.is_healthy, self.queue_depth
+
+
+class ConnectionPool:
+    """
+    Websockets of emulator process, every bus or fleet of buses is sent by the least loaded healthy websocket.
+
+    Load of websocket is number of buses in its queue. Buses wait for reconnect only if all websockets
+    are down, buses from queue of disconnected websocket are moved to other websockets.
+    """
+
+    def __init__(self, connections_number: int):
+        self.connections = [PooledConnection(index) for index in range(connections_number)]
+
+    def send(self, item: typing.Union[dict, typing.Tuple[bus_engine.BusFleet, float]], buses_count: int = 1) -> None:
+        """
+        Put bus or fleet to queue of the least loaded websocket, it is dropped if the queue is full.
+
+        :param item: bus info or fleet with its refresh timeout
+        :param buses_count: number of buses of item
+        """
+        connection = min(self.connections, key=PooledConnection.get_load)
+        if connection.queue_depth and connection.queue_depth + buses_count > CHANNEL_BUFFER_SIZE:
+            send_stats.dropped_buses += buses_count
+            return
+        connection.send_channel.send_nowait((item, buses_count))
+        connection.queue_depth += buses_count
+
+    def reroute(self, connection: PooledConnection) -> None:
+        """Move buses from queue of disconnected websocket to other websockets."""
+        items = []
+        with contextlib.suppress(trio.WouldBlock):
+            while True:
+                items.append(connection.receive_channel.receive_nowait())
+        buses_count = connection.queue_depth
+        connection.queue_depth = 0
+        for item, item_buses_count in items:
+            self.send(item, item_buses_count)
+        if items:
+            logger.debug('moved %s buses from queue of disconnected websocket %s', buses_count, connection.index)
+
+    def rebalance(self) -> None:
+        """Move buses which wait for reconnect of their websockets to websocket which is up."""
+        for connection in self.connections:
+            if not connection.is_healthy and connection.queue_depth:
+                self.reroute(connection)
+
+    def format_stats(self, previous_buses_counts: typing.List[int], seconds: float) -> str:
+        """Format throughput, queue depth and state of every websocket."""
+        return ', '.join(
+            f'#{connection.index} {"up" if connection.is_healthy else "down"} '
+            f'{(connection.stats.buses - previous_buses_count) / seconds:.0f} buses/sec '
+            f'queue {connection.queue_depth} connects {connection.connects}'
+            for connection, previous_buses_count in zip(self.connections, previous_buses_counts)
+        )
+
+
+def load_routes(directory_path: str = 'routes', routes_number: int = 0, worker_index: int = 0, workers_number: int = 1):
     """
     Load routes with buses from file system generator.
 
     :param directory_path: path of files of routes
     :param routes_number: the number of routes to download if < 0 => all routes
+    :param worker_index: index of worker process, worker loads only every :workers_number: route from its index
+    :param workers_number: number of worker processes which share routes
     :return:
     """
     if routes_number <= 0:
         routes_number = 10 ** 9
 
-    for filename in glob.glob(os.path.join(directory_path, '*.json'))[:routes_number]:
+    filenames = sorted(glob.glob(os.path.join(directory_path, '*.json')))[:routes_number]
+    for filename in filenames[worker_index::workers_number]:
         with open(filename, 'r', encoding='utf8') as file:
             yield json.load(file)
 
 
-async def run_bus(send_channel: trio.MemorySendChannel, bus_id: str, route: dict, delta: int, sleep: int):
+def get_routes(args: argparse.Namespace, worker_index: int = 0) -> typing.Iterator[dict]:
+    """Load routes of worker from compiled routes file if it is set or from routes directory."""
+    if args.routes_file:
+        store = route_store.RouteStore(args.routes_file)
+        return store.iter_routes(args.routes_number, worker_index, args.workers)
+    return load_routes(routes_number=args.routes_number, worker_index=worker_index, workers_number=args.workers)
+
+
+def get_bus_info(bus_id: str, route: dict, delta: int, sleep: float) -> dict:
+    """Get current position of bus on route, bus moves to next point every :sleep: seconds."""
+    coordinates = route['coordinates']
+    step = 1 / sleep
+    coordinates_index = (delta + int(time.time() * step)) % len(coordinates)
+    lat, lng = coordinates[coordinates_index]
+    return {
+        'busId': bus_id,
+        'route': route['name'],
+        'lat': lat,
+        'lng': lng,
+    }
+
+
+class Emission:
+    """Periodic emission of scheduler, its item is emitted every interval seconds."""
+
+    __slots__ = ('item', 'interval', 'due_time', 'due_tick')
+
+    def __init__(self, item: typing.Any, interval: float, due_time: float):
+        self.item = item
+        self.interval = interval
+        self.due_time = due_time
+        self.due_tick = 0
+
+
+class EmissionScheduler:
     """
-    Coroutine which send info about one bus.
+    Timer wheel of periodic emissions of emulator, one task wakes up every tick and emits all due items.
 
-    :param send_channel: channel (queue) which accept buses
-    :param bus_id: id of bus
-    :param route: route with bus points on map
-    :param delta: shift from start of route for emulating, it can be many buses with this route
-    and they mustn't be in one point and because of that they must be different delta
-    :param sleep: send info every :sleep: seconds
+    Wheel has `slots_number` slots of `tick` seconds, emission which is due after full turn of wheel waits
+    in its slot for next turns. The first emissions are shifted by golden ratio sequence, so emissions
+    of any number of buses are spread evenly over their intervals and buses don't hit server in a burst.
+    Next emission is due one interval after due time of previous one, so late emissions don't lower rate,
+    emissions which are late for the whole interval are skipped.
     """
-    coordinates = route['coordinates']
-    name = route['name']
-    coordinate_points_count = len(coordinates)
-    while True:
-        step = 1 / sleep
-        coordinates_index = (delta + int(time.time() * step)) % coordinate_points_count
-        lat, lng = coordinates[coordinates_index]
-        message = json.dumps({
-            'busId': bus_id,
-            'route': name,
-            'lat': lat,
-            'lng': lng,
-        }, ensure_ascii=False)
-        logger.debug(f'send value to channel: {message}')
-        await send_channel.send(message)
-        await trio.sleep(sleep)
+
+    golden_ratio = (5 ** 0.5 - 1) / 2
+
+    def __init__(self, tick: float = 0.01, slots_number: int = 1024):
+        """
+        :param tick: seconds of slot of wheel, accuracy of emissions time
+        :param slots_number: number of slots, wheel turns every `tick * slots_number` seconds
+        """
+        self.tick = tick
+        self.slots: typing.List[typing.List[Emission]] = [[] for _ in range(slots_number)]
+        self.current_tick: typing.Optional[int] = None  # the first tick which isn't emitted yet
+        self.emissions_count = 0
+        self.skipped_count = 0
+        self.target_rate = 0.0  # emitted weight per second, buses per second for emulator
+
+    def __len__(self) -> int:
+        return self.emissions_count
+
+    def add(self, item: typing.Any, interval: float, timestamp: float, weight: float = 1) -> None:
+        """
+        Emit item every interval seconds from now.
+
+        :param weight: weight of emission in target rate, for example number of buses of item
+        """
+        if self.current_tick is None:
+            self.current_tick = int(timestamp / self.tick)
+        shift = interval * (self.emissions_count * self.golden_ratio % 1)
+        self.put(Emission(item, interval, timestamp + shift))
+        self.emissions_count += 1
+        self.target_rate += weight / interval
+
+    def put(self, emission: Emission) -> None:
+        emission.due_tick = max(int(emission.due_time / self.tick), self.current_tick)
+        self.slots[emission.due_tick % len(self.slots)].append(emission)
+
+    def pop_due(self, timestamp: float) -> typing.List[typing.Any]:
+        """Get items which are due at timestamp and schedule their next emissions."""
+        if self.current_tick is None:
+            return []
+        last_tick = int(timestamp / self.tick)
+        due_emissions = []
+        # after long pause every slot is visited once
+        for tick in range(self.current_tick, min(last_tick + 1, self.current_tick + len(self.slots))):
+            slot_index = tick % len(self.slots)
+            slot = self.slots[slot_index]
+            if not slot:
+                continue
+            self.slots[slot_index] = [emission for emission in slot if emission.due_tick > last_tick]
+            due_emissions += [emission for emission in slot if emission.due_tick <= last_tick]
+        self.current_tick = max(self.current_tick, last_tick + 1)
+
+        for emission in due_emissions:
+            skipped_count = int((timestamp - emission.due_time) / emission.interval)
+            self.skipped_count += skipped_count
+            emission.due_time += (skipped_count + 1) * emission.interval
+            self.put(emission)
+        return [emission.item for emission in due_emissions]
+
+    async def run(self, emit: typing.Callable[[typing.Any], None]):
+        """Emit due items every tick, emit should not block, because it delays all other items."""
+        while True:
+            timestamp = trio.current_time()
+            for item in self.pop_due(timestamp):
+                emit(item)
+            await trio.sleep_until((int(timestamp / self.tick) + 1) * self.tick)
+
+
+def emit_bus(pool: ConnectionPool, item: typing.Tuple[str, dict, int, float]) -> None:
+    """
+    Send current info of bus to pool of websockets.
+
+    :param item: bus id, route, delta and refresh timeout of bus, see `get_bus_info`
+    """
+    bus = get_bus_info(*item)
+    logger.debug('send value to pool: %s', bus)
+    pool.send(bus)
+
+
+def emit_fleet(pool: ConnectionPool, item: typing.Tuple[bus_engine.BusFleet, float]) -> None:
+    """
+    Send fleet to pool of websockets, positions of its buses are computed right before sending.
+
+    :param item: fleet and refresh timeout of its buses
+    """
+    fleet, _ = item
+    pool.send(item, len(fleet))
+
+
+class Backoff:
+    """
+    Jittered exponential delays of reconnects.
+
+    Delay doubles after every failed attempt up to max delay, random jitter keeps websockets of all emulators
+    from reconnecting at the same moment after server restart.
+    """
+
+    def __init__(self, min_delay: float = 0.5, max_delay: float = 30, stable_seconds: float = 10):
+        """
+        :param min_delay: max seconds before the first reconnect
+        :param max_delay: max seconds between reconnects
+        :param stable_seconds: delays start from min delay again after connection which lived so long
+        """
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.stable_seconds = stable_seconds
+        self.attempts = 0
+
+    def get_delay(self, connection_seconds: float) -> float:
+        """Get seconds before next reconnect after connection which lived connection_seconds."""
+        if connection_seconds >= self.stable_seconds:
+            self.attempts = 0
+        delay = min(self.min_delay * 2 ** self.attempts, self.max_delay)
+        self.attempts += 1
+        return random.uniform(delay / 2, delay)
 
 
 def relaunch_on_disconnect(async_function: typing.Callable) -> typing.Callable:
-    """Decorator which relaunch coroutine after network errors."""
+    """Decorator which relaunch coroutine after network errors with jittered exponential backoff."""
 
     @functools.wraps(async_function)
     async def wrapper(*args, **kwargs):
+        backoff = Backoff()
         while True:
+            started_at = trio.current_time()
             try:
                 await async_function(*args, **kwargs)
             except (
+                OSError,
                 trio_websocket.HandshakeError,
                 wsproto.utilities.LocalProtocolError,
                 trio_websocket.ConnectionClosed
             ):
-                wait_seconds = 5
-                logger.warning(f'Problems with connection, trying to reconnect through {wait_seconds} seconds')
+                wait_seconds = backoff.get_delay(trio.current_time() - started_at)
+                logger.warning(f'Problems with connection, trying to reconnect through {wait_seconds:.1f} seconds')
                 await trio.sleep(wait_seconds)
 
     return wrapper
 
 
+def encode_fleet(
+    fleet: bus_engine.BusFleet,
+    sleep: float,
+    binary: bool = False,
+    with_dictionary: bool = False,
+) -> typing.List[typing.Union[str, bytes]]:
+    """
+    Encode all buses of fleet to one message for server.
+
+    :param binary: encode buses to binary frame instead of JSON array
+    :param with_dictionary: send dictionary of indexes of fleet before binary frame
+    """
+    timestamp = time.time()
+    if not binary:
+        return encode_buses(fleet.get_buses(timestamp, sleep), batch=True)
+    messages = [fleet.build_dictionary_message()] if with_dictionary else []
+    return [*messages, fleet.pack_frame(timestamp, sleep)]
+
+
+def encode_buses(
+    buses: typing.List[dict],
+    frame_writer: typing.Optional[wire.FrameWriter] = None,
+    batch: bool = False,
+) -> typing.List[typing.Union[str, bytes]]:
+    """
+    Encode buses to messages for server.
+
+    :param buses: buses info
+    :param frame_writer: encoder of connection for binary frames, if it is None buses are encoded to JSON
+    :param batch: encode all buses to one JSON array message, binary frame always contains all buses
+    """
+    if frame_writer is not None:
+        return frame_writer.encode(buses)
+    if batch:
+        return [json.dumps(buses, ensure_ascii=False)]
+    return [json.dumps(bus, ensure_ascii=False) for bus in buses]
+
+
 @relaunch_on_disconnect
-async def send_updates(server_address: str, receive_channel: trio.MemoryReceiveChannel):
-    """Send updates about buses to server."""
+async def send_updates(
+    server_address: str,
+    pool: ConnectionPool,
+    connection: PooledConnection,
+    binary: bool = False,
+):
+    """
+    Send updates about buses and fleets from queue of pooled connection to server.
+
+    :param binary: send buses in binary frames, dictionaries of ids are sent again after reconnect
+    """
     async with open_websocket_url(server_address) as ws:
-        async for bus_update in receive_channel:
-            logger.debug(f'send message from channel: {bus_update}')
-            await ws.send_message(bus_update)
+        connection.is_healthy = True
+        connection.connects += 1
+        pool.rebalance()
+        frame_writer = wire.FrameWriter() if binary else None
+        fleets_with_dictionary: typing.Set[bus_engine.BusFleet] = set()
+        item = None  # bus or fleet which is taken from queue, but isn't sent yet
+        try:
+            async for item, buses_count in connection.receive_channel:
+                connection.queue_depth -= buses_count
+                if isinstance(item, dict):
+                    messages = encode_buses([item], frame_writer)
+                else:
+                    fleet, sleep = item
+                    messages = encode_fleet(fleet, sleep, binary, fleet not in fleets_with_dictionary)
+                    fleets_with_dictionary.add(fleet)
+                    logger.debug('send batch message of %s buses', buses_count)
+                for message in messages:
+                    logger.debug('send message from channel: %s', message)
+                    await ws.send_message(message)
+                item = None
+                connection.stats.add(buses_count, messages[-1])
+                send_stats.add(buses_count, messages[-1])
+        finally:
+            connection.is_healthy = False
+            if item is not None:
+                pool.send(item, buses_count)
+            pool.reroute(connection)
 
 
 def generate_bus_id(emulator_id: str, route_id: str, bus_index: int) -> str:
@@ -99,7 +410,13 @@ def generate_bus_id(emulator_id: str, route_id: str, bus_index: int) -> str:
 class LimitedInt:
     """Int with top and bottom limits, init only create caller, which accept numbers."""
 
-    def __init__(self, min_value: typing.Optional[int] = None, max_value: typing.Optional[int] = None):
+    number_type: typing.Type = int
+
+    def __init__(
+        self,
+        min_value: typing.Optional[float] = None,
+        max_value: typing.Optional[float] = None,
+    ):
         """
         Accept limits.
 
@@ -111,9 +428,9 @@ class LimitedInt:
         self.min_value = min_value
         self.max_value = max_value
 
-    def __call__(self, number: int) -> int:
+    def __call__(self, number: str) -> float:
         """Try to accept number and check limits."""
-        number = int(number)
+        number = self.number_type(number)
         if self.min_value is not None and number < self.min_value:
             raise ValueError(f'min value should be {self.min_value} ({number} < {self.min_value})')
         if self.max_value is not None and number > self.max_value:
@@ -126,12 +443,221 @@ class LimitedInt:
         if self.min_value is not None:
             limits.append(f'min={self.min_value}')
         if self.max_value is not None:
-            limits.append(f'min={self.max_value}')
+            limits.append(f'max={self.max_value}')
         return ', '.join(limits)
 
     def __repr__(self) -> str:
         """Readable representation."""
-        return f'LimitedInt ({self.get_readable_limits()})'
+        return f'{type(self).__name__} ({self.get_readable_limits()})'
+
+
+class LimitedFloat(LimitedInt):
+    """Float with top and bottom limits."""
+
+    number_type = float
+
+
+refresh_timeout_type = LimitedFloat(0.01, 60)
+
+
+def parse_route_timeout(value: str) -> typing.Tuple[str, float]:
+    """Parse refresh timeout of route from "route=seconds" argument."""
+    route, separator, seconds = value.rpartition('=')
+    if not separator or not route:
+        raise ValueError(f'route timeout should be "route=seconds" ({value})')
+    return route, refresh_timeout_type(seconds)
+
+
+def schedule_fleets(
+    args: argparse.Namespace,
+    scheduler: EmissionScheduler,
+    delta_start: int,
+    delta_multiplier: int,
+    worker_index: int = 0,
+) -> None:
+    """
+    Divide buses to "websockets_number" fleets for every refresh timeout and schedule them.
+
+    Fleets are sent by batches through pool of websockets, so they have different indexes of buses.
+    """
+    if args.routes_file:
+        # coordinates of compiled file are shared by all workers, they aren't copied to table
+        store = route_store.RouteStore(args.routes_file)
+        route_table = bus_engine.RouteTable.from_store(store)
+        routes = list(store.iter_routes(args.routes_number, worker_index, args.workers))
+    else:
+        routes = list(load_routes(
+            routes_number=args.routes_number,
+            worker_index=worker_index,
+            workers_number=args.workers,
+        ))
+        route_table = bus_engine.RouteTable(routes)
+    route_timeouts = dict(args.route_timeouts)
+    fleets_buses = collections.defaultdict(list)
+    for route in routes:
+        sleep = route_timeouts.get(route['name'], args.refresh_timeout)
+        for bus_index in range(args.buses_per_route):
+            bus_id = generate_bus_id(args.emulator_id, route['name'], bus_index)
+            delta = delta_start + bus_index * delta_multiplier
+            fleet_index = random.randrange(args.websockets_number)
+            fleets_buses[fleet_index, sleep].append((bus_id, route['name'], delta))
+
+    first_bus_index = 0
+    for (_, sleep), buses in fleets_buses.items():
+        fleet = bus_engine.BusFleet(route_table, buses, first_bus_index)
+        first_bus_index += len(fleet)
+        scheduler.add((fleet, sleep), sleep, trio.current_time(), len(fleet))
+
+
+def format_rates(
+    buses_rate: float,
+    messages_rate: float,
+    bytes_rate: float,
+    dropped_buses_rate: float,
+    target_rate: float,
+) -> str:
+    achieved_share = buses_rate / target_rate if target_rate else 1
+    return (
+        f'sent {buses_rate:.0f} of {target_rate:.0f} buses/sec ({achieved_share:.0%}), '
+        f'{messages_rate:.0f} messages/sec, {bytes_rate:.0f} bytes/sec, dropped {dropped_buses_rate:.0f} buses/sec'
+    )
+
+
+async def report_stats(
+    report_every_seconds: float,
+    scheduler: EmissionScheduler,
+    pool: typing.Optional[ConnectionPool] = None,
+    worker_index: int = 0,
+    stats_queue: typing.Optional[multiprocessing.Queue] = None,
+):
+    """
+    Log send rate of process and its target rate, worker process puts its stats to parent queue instead.
+
+    Stats of websockets of pool are logged by every process.
+    """
+    previous_snapshot = send_stats.snapshot()
+    previous_buses_counts = [connection.stats.buses for connection in pool.connections] if pool else []
+    while True:
+        await trio.sleep(report_every_seconds)
+        if pool is not None:
+            logger.info(f'websockets: {pool.format_stats(previous_buses_counts, report_every_seconds)}')
+            previous_buses_counts = [connection.stats.buses for connection in pool.connections]
+        snapshot = send_stats.snapshot()
+        if stats_queue is not None:
+            stats_queue.put((worker_index, snapshot, scheduler.target_rate))
+            continue
+        rates = ((current - previous) / report_every_seconds for current, previous in zip(snapshot, previous_snapshot))
+        logger.info(format_rates(*rates, scheduler.target_rate))
+        previous_snapshot = snapshot
+
+
+async def emulate(
+    args: argparse.Namespace,
+    worker_index: int = 0,
+    stats_queue: typing.Optional[multiprocessing.Queue] = None,
+):
+    """
+    Emulate buses of routes of one process.
+
+    :param args: arguments of emulator
+    :param worker_index: index of worker process, it gets part of routes
+    :param stats_queue: queue of parent process for stats of worker process
+    """
+    delta_multiplier = 100  # how many point between buses from same route, no need to set by user
+    delta_start = random.randint(0, 1000)  # random start delta if many emulators run
+    scheduler = EmissionScheduler()
+
+    pool = ConnectionPool(args.websockets_number)
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(report_stats, args.stats_timeout, scheduler, pool, worker_index, stats_queue)
+        for connection in pool.connections:
+            nursery.start_soon(send_updates, args.server, pool, connection, args.binary)
+
+        if args.batch:
+            schedule_fleets(args, scheduler, delta_start, delta_multiplier, worker_index)
+            nursery.start_soon(scheduler.run, functools.partial(emit_fleet, pool))
+            return
+
+        route_timeouts = dict(args.route_timeouts)
+        for route in get_routes(args, worker_index):
+            sleep = route_timeouts.get(route['name'], args.refresh_timeout)
+            for bus_index in range(args.buses_per_route):
+                bus_id = generate_bus_id(args.emulator_id, route['name'], bus_index)
+                delta = delta_start + bus_index * delta_multiplier
+                scheduler.add((bus_id, route, delta, sleep), sleep, trio.current_time())
+        nursery.start_soon(scheduler.run, functools.partial(emit_bus, pool))
+
+
+def run_worker(args: argparse.Namespace, worker_index: int, stats_queue: multiprocessing.Queue):
+    """Entry point of worker process, bus ids of worker contain its index to be unique."""
+    logging.basicConfig(level=args.verbosity)
+    args.emulator_id = f'{args.emulator_id}-w{worker_index}'
+    with contextlib.suppress(KeyboardInterrupt):
+        trio.run(emulate, args, worker_index, stats_queue)
+
+
+def start_worker(
+    context: multiprocessing.context.BaseContext,
+    args: argparse.Namespace,
+    worker_index: int,
+    stats_queue: multiprocessing.Queue,
+) -> multiprocessing.Process:
+    worker = context.Process(
+        target=run_worker,
+        args=(args, worker_index, stats_queue),
+        name=f'fake_bus-worker-{worker_index}',
+        daemon=True,
+    )
+    worker.start()
+    return worker
+
+
+def get_stats_delta(snapshot: tuple, previous_snapshot: tuple) -> tuple:
+    """Get stats of worker since previous snapshot, counters of restarted worker start from zero again."""
+    if any(current < previous for current, previous in zip(snapshot, previous_snapshot)):
+        return snapshot
+    return tuple(current - previous for current, previous in zip(snapshot, previous_snapshot))
+
+
+async def collect_workers_stats(stats_queue: multiprocessing.Queue, report_every_seconds: float):
+    """Log summary send rate and target rate of all workers."""
+    workers_snapshots = {}
+    workers_target_rates = {}
+    total = (0, 0, 0, 0)  # stats of all workers since previous report
+    previous_reported_at = time.monotonic()
+    while True:
+        worker_index, snapshot, target_rate = await trio.to_thread.run_sync(stats_queue.get, cancellable=True)
+        delta = get_stats_delta(snapshot, workers_snapshots.get(worker_index, (0,) * len(snapshot)))
+        total = tuple(map(sum, zip(total, delta)))
+        workers_snapshots[worker_index] = snapshot
+        workers_target_rates[worker_index] = target_rate
+        now = time.monotonic()
+        if now - previous_reported_at < report_every_seconds:
+            continue
+
+        seconds = now - previous_reported_at
+        rates = (value / seconds for value in total)
+        logger.info(f'{len(workers_snapshots)} workers {format_rates(*rates, sum(workers_target_rates.values()))}')
+        total = (0, 0, 0, 0)
+        previous_reported_at = now
+
+
+async def supervise_workers(args: argparse.Namespace):
+    """Run worker processes, restart them if they die and log their summary stats."""
+    # workers are spawned, because fork of process with running trio loop is unsafe
+    context = multiprocessing.get_context('spawn')
+    stats_queue = context.Queue()
+    workers = [start_worker(context, args, worker_index, stats_queue) for worker_index in range(args.workers)]
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(collect_workers_stats, stats_queue, args.stats_timeout)
+        while True:
+            await trio.sleep(1)
+            for worker_index, worker in enumerate(workers):
+                if not worker.is_alive():
+                    logger.warning(f'worker {worker_index} exited with code {worker.exitcode}, restart it')
+                    workers[worker_index] = start_worker(context, args, worker_index, stats_queue)
 
 
 async def main():
@@ -147,34 +673,38 @@ async def main():
                         help='number of buses in different points for every route')
     parser.add_argument('-id', '--emulator_id', type=str, required=True,
                         help='some unique combination to understand, which program send data, if it is many emulator instances')
+    parser.add_argument('-rf', '--routes_file', type=str, default=None,
+                        help='compiled routes file (see route_store.py) instead of "routes" directory, '
+                             'it is memory-mapped')
     parser.add_argument('-wn', '--websockets_number', type=LimitedInt(1, 20), default=5,
                         help='number of websockets connections, from 1 to 20, default 5')
-    parser.add_argument('-t', '--refresh_timeout', type=LimitedInt(0, 60), default=1,
-                        help='send data every "refresh_timeout" seconds')
+    parser.add_argument('-t', '--refresh_timeout', type=refresh_timeout_type, default=1,
+                        help='send data every "refresh_timeout" seconds, from 0.01 to 60, it can be fractional')
+    parser.add_argument('-rt', '--route_timeout', dest='route_timeouts', type=parse_route_timeout,
+                        action='append', default=[],
+                        help='refresh timeout of route instead of "refresh_timeout" in "route=seconds" format, '
+                             'it can be repeated for many routes')
+    parser.add_argument('-bin', '--binary', action='store_true',
+                        help='send buses in compact binary frames instead of JSON')
+    parser.add_argument('-bt', '--batch', action='store_true',
+                        help='send all buses of fleet by one message per refresh instead of message per bus, '
+                             'positions of buses are computed by vectorized numpy engine')
+    parser.add_argument('-w', '--workers', type=LimitedInt(1, 256), default=1,
+                        help='number of worker processes, routes are divided between them, '
+                             'every worker has "websockets_number" websockets, default 1')
+    parser.add_argument('-st', '--stats_timeout', type=LimitedInt(1, 3600), default=10,
+                        help='log send rate every "stats_timeout" seconds, default 10')
     parser.add_argument('-v', '--verbosity', type=int, default=0, choices=range(0, 51, 10),
                         help='level of log verbosity from 0 (notset) to 50 (only critical) through 10, default 0')
 
     args = parser.parse_args()
-    delta_multiplier = 100  # how many point between buses from same route, no need to set by user
-    delta_start = random.randint(0, 1000)  # random start delta if many emulators run
 
     logging.basicConfig(level=args.verbosity)
-    send_channels = []
-    receive_channels = []
 
-    async with trio.open_nursery() as nursery:
-        for websocket_number in range(args.websockets_number):
-            send_channel, receive_channel = trio.open_memory_channel(max_buffer_size=0)
-            send_channels.append(send_channel)
-            receive_channels.append(receive_channel)
-        for receive_channel in receive_channels:
-            nursery.start_soon(send_updates, args.server, receive_channel)
-        for route in load_routes(routes_number=args.routes_number):
-            for bus_index in range(args.buses_per_route):
-                bus_id = generate_bus_id(args.emulator_id, route['name'], bus_index)
-                delta = delta_start + bus_index * delta_multiplier
-                send_channel = random.choice(send_channels)
-                nursery.start_soon(run_bus, send_channel, bus_id, route, delta, args.refresh_timeout)
+    if args.workers > 1:
+        await supervise_workers(args)
+    else:
+        await emulate(args)
 
 
 if __name__ == '__main__':
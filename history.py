@@ -0,0 +1,209 @@
+import collections
+import logging
+import typing
+
+import numpy
+
+import models
+
+logger = logging.getLogger(__name__)
+
+# rows of history are read by chunks of this size, so snapshot reuses small buffers instead of copying whole history
+SNAPSHOT_CHUNK_ROWS = 4096
+
+
+class PositionHistory:
+    """
+    Last positions of every bus in ring buffers of preallocated arrays.
+
+    Every bus gets a row of `positions_per_bus` positions and timestamps, so memory is bounded by
+    `buses_capacity` rows and saving of position doesn't allocate anything. History of removed bus is kept
+    until its row is needed for new bus.
+    """
+
+    def __init__(self, buses_capacity: int = 100000, positions_per_bus: int = 60):
+        """
+        :param buses_capacity: max number of buses with history, new buses over it get no history
+        :param positions_per_bus: length of ring buffer of every bus
+        """
+        self.buses_capacity = buses_capacity
+        self.positions_per_bus = positions_per_bus
+        # float32 keeps coordinates with precision about a meter, they are rounded to 5 digits after point when read
+        self.lats = numpy.zeros((buses_capacity, positions_per_bus), dtype=numpy.float32)
+        self.lngs = numpy.zeros((buses_capacity, positions_per_bus), dtype=numpy.float32)
+        self.timestamps = numpy.full((buses_capacity, positions_per_bus), -numpy.inf)
+        self.heads: typing.List[int] = []  # index of next position in ring buffer of row
+        self.row_bus_ids: typing.List[str] = []
+        self.row_routes: typing.List[str] = []
+        self.bus_rows: typing.Dict[str, int] = {}
+        # rows of removed buses in order of removal, they are reused when all rows are taken
+        self.retired_rows: typing.Deque[int] = collections.deque()
+        self.retired_bus_ids: typing.Set[str] = set()
+        # warning about full history is logged once till a row is free again
+        self.is_full = False
+        chunk_rows = min(buses_capacity, SNAPSHOT_CHUNK_ROWS)
+        self.chunk_timestamps = numpy.empty((chunk_rows, positions_per_bus))
+        self.chunk_is_future = numpy.empty((chunk_rows, positions_per_bus), dtype=bool)
+
+    @property
+    def memory_size(self) -> int:
+        return (
+            self.lats.nbytes + self.lngs.nbytes + self.timestamps.nbytes
+            + self.chunk_timestamps.nbytes + self.chunk_is_future.nbytes
+        )
+
+    def _allocate_row(self, bus_id: str) -> typing.Optional[int]:
+        if len(self.row_bus_ids) < self.buses_capacity:
+            row = len(self.row_bus_ids)
+            self.row_bus_ids.append(bus_id)
+            self.row_routes.append('')
+            self.heads.append(0)
+        else:
+            while self.retired_rows:
+                row = self.retired_rows.popleft()
+                old_bus_id = self.row_bus_ids[row]
+                if old_bus_id in self.retired_bus_ids:  # bus could return after removal
+                    break
+            else:
+                if not self.is_full:
+                    self.is_full = True
+                    logger.warning(
+                        f'history is full ({self.buses_capacity} buses), new buses get no history '
+                        f'till buses are removed, the first skipped bus is {bus_id}'
+                    )
+                return None
+            self.retired_bus_ids.discard(old_bus_id)
+            del self.bus_rows[old_bus_id]
+            self.timestamps[row] = -numpy.inf
+            self.row_bus_ids[row] = bus_id
+            self.heads[row] = 0
+        self.bus_rows[bus_id] = row
+        return row
+
+    def append(self, bus: models.BusRecord, timestamp: float) -> bool:
+        """
+        Save position of bus.
+
+        :return: position is saved, it isn't if history is full
+        """
+        row = self.bus_rows.get(bus.busId)
+        if row is None:
+            row = self._allocate_row(bus.busId)
+            if row is None:
+                return False
+        elif self.retired_bus_ids:
+            self.retired_bus_ids.discard(bus.busId)
+        head = self.heads[row]
+        self.lats[row, head] = bus.lat
+        self.lngs[row, head] = bus.lng
+        self.timestamps[row, head] = timestamp
+        self.heads[row] = (head + 1) % self.positions_per_bus
+        self.row_routes[row] = bus.route
+        return True
+
+    def remove(self, bus_id: str) -> None:
+        """Allow to reuse row of removed bus, but keep its history till then."""
+        if bus_id in self.bus_rows and bus_id not in self.retired_bus_ids:
+            self.retired_bus_ids.add(bus_id)
+            self.retired_rows.append(self.bus_rows[bus_id])
+            self.is_full = False
+
+    def get_track(self, bus_id: str) -> typing.List[typing.Tuple[float, float, float]]:
+        """
+        Get saved positions of bus from old to new.
+
+        :return: tuples (timestamp, lat, lng)
+        """
+        row = self.bus_rows.get(bus_id)
+        if row is None:
+            return []
+        order = (numpy.arange(self.positions_per_bus) + self.heads[row]) % self.positions_per_bus
+        timestamps = self.timestamps[row, order]
+        is_saved = timestamps > -numpy.inf
+        return list(zip(
+            timestamps[is_saved].tolist(),
+            self.lats[row, order][is_saved].astype(float).round(5).tolist(),
+            self.lngs[row, order][is_saved].astype(float).round(5).tolist(),
+        ))
+
+    def get_snapshot(
+        self,
+        timestamp: float,
+        bounds: models.WindowBounds,
+        max_age: float = 60,
+    ) -> typing.List[models.BusRecord]:
+        """
+        Get positions which buses had at timestamp inside window bounds.
+
+        :param max_age: bus which had no positions for max_age seconds before timestamp is not in snapshot
+        """
+        rows_count = len(self.row_bus_ids)
+        snapshot = []
+        for chunk_start in range(0, rows_count, len(self.chunk_timestamps)):
+            chunk_end = min(chunk_start + len(self.chunk_timestamps), rows_count)
+            snapshot += self._get_chunk_snapshot(chunk_start, chunk_end, timestamp, bounds, max_age)
+        return snapshot
+
+    def _get_chunk_snapshot(
+        self,
+        chunk_start: int,
+        chunk_end: int,
+        timestamp: float,
+        bounds: models.WindowBounds,
+        max_age: float,
+    ) -> typing.List[models.BusRecord]:
+        """Get positions of snapshot from rows of chunk, newer positions than timestamp are masked in buffer."""
+        past_timestamps = self.chunk_timestamps[:chunk_end - chunk_start]
+        is_future = self.chunk_is_future[:chunk_end - chunk_start]
+        numpy.greater(self.timestamps[chunk_start:chunk_end], timestamp, out=is_future)
+        numpy.copyto(past_timestamps, self.timestamps[chunk_start:chunk_end])
+        numpy.putmask(past_timestamps, is_future, -numpy.inf)
+        columns = past_timestamps.argmax(axis=1)
+        chunk_rows = numpy.arange(chunk_end - chunk_start)
+        lats = self.lats[chunk_start:chunk_end][chunk_rows, columns].astype(float).round(5)
+        lngs = self.lngs[chunk_start:chunk_end][chunk_rows, columns].astype(float).round(5)
+        is_visible = (
+            (past_timestamps[chunk_rows, columns] >= timestamp - max_age)
+            & (lats >= bounds.south_lat) & (lats <= bounds.north_lat)
+            & (lngs >= bounds.west_lng) & (lngs <= bounds.east_lng)
+        )
+        visible_rows = numpy.flatnonzero(is_visible)
+        return [
+            models.BusRecord(self.row_bus_ids[row], self.row_routes[row], lat, lng)
+            for row, lat, lng in zip(
+                (visible_rows + chunk_start).tolist(),
+                lats[visible_rows].tolist(),
+                lngs[visible_rows].tolist(),
+            )
+        ]
+
+
+class Replay:
+    """Replay of one browser, its clock goes from some moment in the past with chosen speed."""
+
+    def __init__(self):
+        self.since: typing.Optional[float] = None
+        self.speed = 1.0
+        self.started_at = 0.0
+
+    @property
+    def is_active(self) -> bool:
+        return self.since is not None
+
+    def start(self, since: float, speed: float, now: float) -> None:
+        self.since = since
+        self.speed = speed
+        self.started_at = now
+
+    def stop(self) -> None:
+        self.since = None
+
+    def get_time(self, now: float) -> typing.Optional[float]:
+        """Get moment of replay or None if replay is not active or it has caught up with now."""
+        if self.since is None:
+            return None
+        replay_time = self.since + (now - self.started_at) * self.speed
+        if replay_time >= now:
+            self.stop()
+            return None
+        return replay_time
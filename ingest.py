@@ -0,0 +1,123 @@
+import itertools
+import json
+import typing
+
+import pydantic
+
+import models
+import wire
+
+# position of update or error in buffer: index of message and index of bus in message
+Position = typing.Tuple[int, int]
+# raw update of bus: its position, prefix of loc of its errors and its values which are not validated yet
+Update = typing.Tuple[Position, tuple, typing.Any]
+# bus id of update, updates with bus id of wrong type are keyed by their positions
+UpdateKey = typing.Union[str, Position]
+
+
+class IngestBuffer:
+    """
+    Raw messages of one microservice connection, they are parsed and saved together once per tick.
+
+    Bus which reports several times during tick is saved once with its latest position, its earlier updates
+    are superseded, so bus with invalid latest update keeps its position of previous tick. Superseded updates
+    are validated too, so microservice gets errors of every wrong message like without buffer. Errors are
+    grouped by messages, errors of bus from array of buses contain index of bus in their loc.
+    """
+
+    def __init__(self):
+        self.messages: typing.List[typing.Union[str, bytes]] = []
+        self.dictionary = wire.Dictionary()
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def add(self, message: typing.Union[str, bytes]) -> None:
+        self.messages.append(message)
+
+    def parse(self) -> typing.Tuple[typing.List[models.BusRecord], typing.List[list], int]:
+        """
+        Parse buffered messages and clear buffer.
+
+        :return: the latest valid positions of buses, errors of every wrong message and number of superseded updates
+        """
+        messages, self.messages = self.messages, []
+        updates: typing.List[typing.Tuple[UpdateKey, Update]] = []
+        errors: typing.List[typing.Tuple[Position, typing.Any]] = []
+        for message_index, message in enumerate(messages):
+            if isinstance(message, bytes):
+                self.parse_frame(message_index, message, updates, errors)
+            else:
+                self.parse_message(message_index, message, updates, errors)
+
+        latest_updates = {key: update for key, update in updates}
+        buses = []
+        for key, update in updates:
+            position, loc, values = update
+            try:
+                bus = models.validate_bus(*values) if isinstance(values, tuple) else models.parse_bus(values)
+            except pydantic.ValidationError as e:
+                errors += [(position, {**error, 'loc': (*loc, *error['loc'])}) for error in e.errors()]
+                continue
+            if latest_updates[key] is update:
+                buses.append(bus)
+        errors.sort(key=lambda position_error: position_error[0])
+        messages_errors = [
+            [error for _, error in message_errors]
+            for _, message_errors in itertools.groupby(errors, key=lambda position_error: position_error[0][0])
+        ]
+        return buses, messages_errors, len(updates) - len(latest_updates)
+
+    def parse_frame(
+        self,
+        message_index: int,
+        frame: bytes,
+        updates: typing.List[typing.Tuple[UpdateKey, Update]],
+        errors: typing.List[typing.Tuple[Position, typing.Any]],
+    ) -> None:
+        """Read buses of binary frame, their ids and routes are taken from dictionary which microservice sent before."""
+        try:
+            for record_index, (bus_index, route_index, lat, lng) in enumerate(wire.unpack_buses_frame(frame)):
+                bus_id = self.dictionary.bus_ids.get(bus_index)
+                route = self.dictionary.routes.get(route_index)
+                if bus_id is None or route is None:
+                    errors.append((
+                        (message_index, record_index),
+                        f'unknown bus index {bus_index} or route index {route_index}',
+                    ))
+                    continue
+                updates.append((bus_id, ((message_index, record_index), (), (bus_id, route, lat, lng))))
+        except wire.WireFormatError as e:
+            errors.append(((message_index, -1), str(e)))
+
+    def parse_message(
+        self,
+        message_index: int,
+        message: str,
+        updates: typing.List[typing.Tuple[UpdateKey, Update]],
+        errors: typing.List[typing.Tuple[Position, typing.Any]],
+    ) -> None:
+        """Read JSON message with one bus or array of buses or update dictionary of binary frames."""
+        try:
+            decoded_message = json.loads(message)
+        except json.JSONDecodeError:
+            errors.append(((message_index, -1), f'can not decode message "{message}" to JSON'))
+            return
+        if isinstance(decoded_message, dict) and decoded_message.get('msgType') == 'BusDictionary':
+            try:
+                dictionary_message = models.BusDictionaryMessage(**decoded_message)
+            except pydantic.ValidationError as e:
+                errors += [((message_index, -1), error) for error in e.errors()]
+                return
+            self.dictionary.update(dictionary_message.buses, dictionary_message.routes)
+            return
+
+        is_batch = isinstance(decoded_message, list)
+        for bus_index, decoded_bus in enumerate(decoded_message if is_batch else [decoded_message]):
+            position = (message_index, bus_index)
+            loc_prefix = (bus_index,) if is_batch else ()
+            if not isinstance(decoded_bus, dict):
+                errors.append((position, {'loc': loc_prefix, 'msg': 'bus should be JSON object', 'type': 'type_error'}))
+                continue
+            bus_id = decoded_bus.get('busId')
+            updates.append((bus_id if type(bus_id) is str else position, (position, loc_prefix, decoded_bus)))
@@ -0,0 +1,291 @@
+import collections
+import typing
+
+import numpy
+
+import bus_engine
+import models
+
+
+class RouteGeometry:
+    """
+    Polylines of routes with distances along them, they keep estimated positions of buses on their routes.
+
+    Points of all routes are one array like in `bus_engine.RouteTable`, distances grow through all routes
+    with a gap between routes, so position at distance of any route is found by one vectorized interpolation.
+    Distances are in degrees like coordinates. Segment is identified by index of its first point.
+    """
+
+    route_gap = 1.0
+
+    def __init__(self, route_table: bus_engine.RouteTable):
+        self.indexes = route_table.indexes
+        self.offsets = route_table.offsets
+        self.lengths = route_table.lengths
+        self.coordinates = numpy.asarray(route_table.coordinates, dtype=numpy.float64)
+        segment_lengths = numpy.hypot(*numpy.diff(self.coordinates, axis=0).T)
+        # segment from the last point of route to the first point of next route is replaced by the gap
+        segment_lengths[self.offsets[1:] - 1] = self.route_gap
+        self.distances = numpy.concatenate(([0.0], numpy.cumsum(segment_lengths)))
+
+    def get_route_index(self, route: str) -> typing.Optional[int]:
+        """Get index of route which has at least one segment."""
+        route_index = self.indexes.get(route)
+        if route_index is None or self.lengths[route_index] < 2:
+            return None
+        return route_index
+
+    def get_route_distances(self, route_index: int) -> typing.Tuple[float, float]:
+        """Get distances of the first and the last points of route."""
+        offset = self.offsets[route_index]
+        return self.distances[offset], self.distances[offset + self.lengths[route_index] - 1]
+
+    def project(
+        self,
+        segments: numpy.ndarray,
+        lats: numpy.ndarray,
+        lngs: numpy.ndarray,
+    ) -> typing.Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """
+        Find the nearest points of candidate segments for many positions at once.
+
+        :param segments: array (positions, candidates) of segments
+        :return: distances of the nearest points along routes, distances from them to positions and their segments
+        """
+        starts = self.coordinates[segments]
+        vectors = self.coordinates[segments + 1] - starts
+        offsets = numpy.stack((lats, lngs), axis=-1)[:, None, :] - starts
+        squared_lengths = (vectors ** 2).sum(axis=2)
+        shares = (offsets * vectors).sum(axis=2)
+        shares = numpy.clip(
+            numpy.divide(shares, squared_lengths, out=numpy.zeros_like(shares), where=squared_lengths > 0),
+            0,
+            1,
+        )
+        squared_offsets = ((offsets - vectors * shares[:, :, None]) ** 2).sum(axis=2)
+        rows = numpy.arange(len(segments))
+        columns = squared_offsets.argmin(axis=1)
+        nearest_segments = segments[rows, columns]
+        distances = self.distances[nearest_segments] + shares[rows, columns] * squared_lengths[rows, columns] ** 0.5
+        return distances, squared_offsets[rows, columns] ** 0.5, nearest_segments
+
+    def project_on_route(
+        self,
+        route_index: int,
+        lats: numpy.ndarray,
+        lngs: numpy.ndarray,
+    ) -> typing.Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """Find the nearest points of all segments of route for positions of its buses, see `project`."""
+        offset = self.offsets[route_index]
+        segments = numpy.arange(offset, offset + self.lengths[route_index] - 1)
+        return self.project(numpy.broadcast_to(segments, (len(lats), len(segments))), lats, lngs)
+
+    def project_near(
+        self,
+        route_indexes: numpy.ndarray,
+        segments: numpy.ndarray,
+        lats: numpy.ndarray,
+        lngs: numpy.ndarray,
+        window: int = 8,
+    ) -> typing.Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """Find the nearest points of segments of routes not farther than window segments from known ones."""
+        first_segments = self.offsets[route_indexes]
+        last_segments = first_segments + self.lengths[route_indexes] - 2
+        candidates = segments[:, None] + numpy.arange(-window, window + 1)
+        candidates = numpy.clip(candidates, first_segments[:, None], last_segments[:, None])
+        return self.project(candidates, lats, lngs)
+
+    def locate(self, distances: numpy.ndarray) -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
+        """Get coordinates of points at distances along routes."""
+        return (
+            numpy.interp(distances, self.distances, self.coordinates[:, 0]),
+            numpy.interp(distances, self.distances, self.coordinates[:, 1]),
+        )
+
+
+class Motion:
+    """The last report of bus and its speeds, straight one and one along its route."""
+
+    __slots__ = (
+        'bus', 'timestamp', 'lat_speed', 'lng_speed',
+        'route_index', 'segment', 'distance', 'distance_timestamp', 'distance_speed',
+    )
+
+    def __init__(self, bus: models.BusRecord, timestamp: float):
+        self.bus = bus
+        self.timestamp = timestamp
+        self.lat_speed = 0.0
+        self.lng_speed = 0.0
+        self.route_index: typing.Optional[int] = None  # bus moves along route if it is set
+        # the latest projection of bus to route, it may be older than report till next estimate
+        self.segment: typing.Optional[int] = None
+        self.distance = 0.0
+        self.distance_timestamp: typing.Optional[float] = None
+        self.distance_speed = 0.0
+
+    @property
+    def is_moving(self) -> bool:
+        if self.route_index is not None:
+            return self.distance_speed != 0
+        return self.lat_speed != 0 or self.lng_speed != 0
+
+
+class MotionEstimator:
+    """
+    Dead reckoning of buses between their reports.
+
+    Speed of bus is estimated by its two last reports, so server can show positions of buses more often
+    than trackers send them. Bus moves along its route if route geometry is known and bus is near its route,
+    otherwise it moves by straight line. Bus stops at position estimated for `max_ahead` seconds after report.
+
+    Report only saves position, reports are projected to routes together by `estimate`, usually only
+    on few segments near previous projection.
+    """
+
+    def __init__(
+        self,
+        geometry: typing.Optional[RouteGeometry] = None,
+        max_ahead: float = 10,
+        max_speed: float = 0.005,
+        max_snap_distance: float = 0.001,
+    ):
+        """
+        :param geometry: routes of buses, buses move by straight lines without it
+        :param max_ahead: max seconds after report for which position is estimated
+        :param max_speed: degrees per second, faster move is a jump, for example to start of route
+        :param max_snap_distance: degrees, bus which is farther from its route moves by straight line
+        """
+        self.geometry = geometry
+        self.max_ahead = max_ahead
+        self.max_speed = max_speed
+        self.max_snap_distance = max_snap_distance
+        self.motions: typing.Dict[str, Motion] = {}
+        self.unprojected_motions: typing.Dict[str, Motion] = {}
+
+    def __len__(self) -> int:
+        return len(self.motions)
+
+    def report(self, bus: models.BusRecord, timestamp: float) -> None:
+        """Save reported position of bus and estimate its straight speed."""
+        previous_motion = self.motions.get(bus.busId)
+        motion = self.motions[bus.busId] = Motion(bus, timestamp)
+        if previous_motion is not None and previous_motion.bus.route != bus.route:
+            previous_motion = None
+        if previous_motion is not None and 0 < timestamp - previous_motion.timestamp <= self.max_ahead:
+            seconds = timestamp - previous_motion.timestamp
+            lat_speed = (bus.lat - previous_motion.bus.lat) / seconds
+            lng_speed = (bus.lng - previous_motion.bus.lng) / seconds
+            if (lat_speed ** 2 + lng_speed ** 2) ** 0.5 <= self.max_speed:
+                motion.lat_speed = lat_speed
+                motion.lng_speed = lng_speed
+
+        if self.geometry is None:
+            return
+        motion.route_index = self.geometry.get_route_index(bus.route)
+        if motion.route_index is None:
+            return
+        if previous_motion is not None:
+            motion.segment = previous_motion.segment
+            motion.distance = previous_motion.distance
+            motion.distance_timestamp = previous_motion.distance_timestamp
+        self.unprojected_motions[bus.busId] = motion
+
+    def remove(self, bus_id: str) -> None:
+        self.motions.pop(bus_id, None)
+        self.unprojected_motions.pop(bus_id, None)
+
+    def clear(self) -> None:
+        self.motions.clear()
+        self.unprojected_motions.clear()
+
+    def project_reports(self) -> None:
+        """Project reports to routes and estimate speeds of buses along routes."""
+        motions = list(self.unprojected_motions.values())
+        self.unprojected_motions.clear()
+        far_motions = [motion for motion in motions if motion.segment is None]
+        near_motions = [motion for motion in motions if motion.segment is not None]
+        projections = []
+        if near_motions:
+            distances, offsets, segments = self.geometry.project_near(
+                numpy.array([motion.route_index for motion in near_motions]),
+                numpy.array([motion.segment for motion in near_motions]),
+                numpy.array([motion.bus.lat for motion in near_motions]),
+                numpy.array([motion.bus.lng for motion in near_motions]),
+            )
+            for motion, distance, offset, segment in zip(
+                near_motions, distances.tolist(), offsets.tolist(), segments.tolist()
+            ):
+                if offset <= self.max_snap_distance:
+                    projections.append((motion, distance, segment))
+                else:  # bus has jumped far along route or has left it
+                    far_motions.append(motion)
+        route_far_motions = collections.defaultdict(list)
+        for motion in far_motions:
+            route_far_motions[motion.route_index].append(motion)
+        for route_index, motions in route_far_motions.items():
+            distances, offsets, segments = self.geometry.project_on_route(
+                route_index,
+                numpy.array([motion.bus.lat for motion in motions]),
+                numpy.array([motion.bus.lng for motion in motions]),
+            )
+            for motion, distance, offset, segment in zip(
+                motions, distances.tolist(), offsets.tolist(), segments.tolist()
+            ):
+                if offset <= self.max_snap_distance:
+                    projections.append((motion, distance, segment))
+                else:
+                    motion.route_index = None
+                    motion.segment = None
+
+        for motion, distance, segment in projections:
+            if motion.distance_timestamp is not None:
+                seconds = motion.timestamp - motion.distance_timestamp
+                if 0 < seconds <= self.max_ahead and abs(distance - motion.distance) <= self.max_speed * seconds:
+                    motion.distance_speed = (distance - motion.distance) / seconds
+            motion.segment = segment
+            motion.distance = distance
+            motion.distance_timestamp = motion.timestamp
+
+    def estimate(self, timestamp: float) -> typing.List[models.BusRecord]:
+        """
+        Get estimated positions of moving buses, buses which have stopped aren't returned again.
+
+        Coordinates are rounded to 6 digits after point, about 10 cm.
+        """
+        if self.unprojected_motions:
+            self.project_reports()
+        estimated_buses = []
+        snapped_motions = []
+        snapped_distances = []
+        for motion in self.motions.values():
+            if not motion.is_moving:
+                continue
+            seconds = timestamp - motion.timestamp
+            if seconds <= 0:
+                continue
+            if seconds >= self.max_ahead:
+                seconds = self.max_ahead
+                is_stopped = True
+            else:
+                is_stopped = False
+            bus = motion.bus
+            if motion.route_index is not None:
+                first_distance, last_distance = self.geometry.get_route_distances(motion.route_index)
+                distance = motion.distance + motion.distance_speed * seconds
+                snapped_motions.append(motion)
+                snapped_distances.append(min(max(distance, first_distance), last_distance))
+            else:
+                estimated_buses.append(models.BusRecord(
+                    bus.busId,
+                    bus.route,
+                    round(bus.lat + motion.lat_speed * seconds, 6),
+                    round(bus.lng + motion.lng_speed * seconds, 6),
+                ))
+            if is_stopped:
+                motion.lat_speed = motion.lng_speed = motion.distance_speed = 0.0
+
+        if snapped_motions:
+            lats, lngs = self.geometry.locate(numpy.array(snapped_distances))
+            for motion, lat, lng in zip(snapped_motions, lats.round(6).tolist(), lngs.round(6).tolist()):
+                estimated_buses.append(models.BusRecord(motion.bus.busId, motion.bus.route, lat, lng))
+        return estimated_buses
@@ -0,0 +1,159 @@
+import bisect
+import contextlib
+import logging
+import typing
+
+import trio
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+MAX_REQUEST_SIZE = 8192
+
+
+class Registry:
+    """Metrics of process rendered in Prometheus text format."""
+
+    def __init__(self):
+        self.metrics: typing.List['Metric'] = []
+
+    def register(self, metric: 'Metric') -> None:
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.metric_type}')
+            lines.extend(f'{name} {format_value(value)}' for name, value in metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric:
+    metric_type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, metrics_registry: Registry = registry):
+        self.name = name
+        self.documentation = documentation
+        metrics_registry.register(self)
+
+    def collect(self) -> typing.Iterator[typing.Tuple[str, float]]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    metric_type = 'counter'
+
+    def __init__(self, name: str, documentation: str, metrics_registry: Registry = registry):
+        super().__init__(name, documentation, metrics_registry)
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def collect(self) -> typing.Iterator[typing.Tuple[str, float]]:
+        yield self.name, self.value
+
+
+class Gauge(Metric):
+    """Gauge which is set by code or, if function is passed, is read from it on every scrape."""
+
+    metric_type = 'gauge'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        function: typing.Optional[typing.Callable[[], float]] = None,
+        metrics_registry: Registry = registry,
+    ):
+        super().__init__(name, documentation, metrics_registry)
+        self.value = 0
+        self.function = function
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def collect(self) -> typing.Iterator[typing.Tuple[str, float]]:
+        yield self.name, self.function() if self.function is not None else self.value
+
+
+class Histogram(Metric):
+    metric_type = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: typing.Sequence[float],
+        metrics_registry: Registry = registry,
+    ):
+        super().__init__(name, documentation, metrics_registry)
+        self.buckets = sorted(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)  # last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def collect(self) -> typing.Iterator[typing.Tuple[str, float]]:
+        cumulative_count = 0
+        for upper_bound, bucket_count in zip([*self.buckets, float('inf')], self.bucket_counts):
+            cumulative_count += bucket_count
+            yield f'{self.name}_bucket{{le="{format_value(upper_bound)}"}}', cumulative_count
+        yield f'{self.name}_sum', self.sum
+        yield f'{self.name}_count', self.count
+
+
+async def monitor_event_loop_lag(lag: Histogram, interval: float = 0.5):
+    """Measure how much later than planned trio wakes up sleeping task, busy event loop makes it late."""
+    while True:
+        planned_at = trio.current_time() + interval
+        await trio.sleep_until(planned_at)
+        lag.observe(max(trio.current_time() - planned_at, 0))
+
+
+async def handle_metrics_request(stream: trio.SocketStream, metrics_registry: Registry = registry):
+    """Answer to HTTP request, GET /metrics gets metrics, other paths get 404."""
+    with contextlib.suppress(trio.BrokenResourceError, trio.ClosedResourceError):
+        request = b''
+        with trio.move_on_after(5):
+            while b'\r\n\r\n' not in request and len(request) < MAX_REQUEST_SIZE:
+                data = await stream.receive_some(MAX_REQUEST_SIZE)
+                if not data:
+                    break
+                request += data
+        request_line = request.split(b'\r\n', 1)[0].split()
+        if request_line[:2] == [b'GET', b'/metrics']:
+            status, content_type, body = '200 OK', CONTENT_TYPE, metrics_registry.render().encode()
+        else:
+            status, content_type, body = '404 Not Found', 'text/plain', b'not found\n'
+        await stream.send_all(
+            f'HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n'
+            f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body
+        )
+        await stream.aclose()
+
+
+async def serve_metrics(port: int, host: str = '127.0.0.1'):
+    """Serve metrics on local HTTP port, which Prometheus scrapes."""
+    logger.info(f'serve metrics on http://{host}:{port}/metrics')
+    await trio.serve_tcp(handle_metrics_request, port, host=host)
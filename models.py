@@ -1,3 +1,5 @@
+import typing
+
 import pydantic
 
 
@@ -20,6 +22,79 @@ class Bus(pydantic.BaseModel):
         return lng
 
 
+class BusRecord:
+    """
+    Lightweight validated bus info, server keeps it instead of pydantic Bus.
+
+    It is created by `validate_bus` and `parse_bus`, which check valid messages without pydantic.
+    """
+
+    __slots__ = ('busId', 'route', 'lat', 'lng')
+
+    def __init__(self, busId: str, route: str, lat: float, lng: float):
+        self.busId = busId
+        self.route = route
+        self.lat = lat
+        self.lng = lng
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, BusRecord):
+            return NotImplemented
+        return self.dict() == other.dict()
+
+    def __repr__(self) -> str:
+        return f'BusRecord(busId={self.busId!r}, route={self.route!r}, lat={self.lat!r}, lng={self.lng!r})'
+
+    def dict(self) -> typing.Dict[str, typing.Any]:
+        return {'busId': self.busId, 'route': self.route, 'lat': self.lat, 'lng': self.lng}
+
+
+def validate_bus(bus_id: typing.Any, route: typing.Any, lat: typing.Any, lng: typing.Any) -> BusRecord:
+    """
+    Validate bus info.
+
+    Values with exact types and inside limits are accepted by fast checks,
+    other values are validated by pydantic Bus, so errors and coercion are the same as for Bus.
+    """
+    if (
+        type(bus_id) is str
+        and type(route) is str
+        and (type(lat) is float or type(lat) is int)
+        and (type(lng) is float or type(lng) is int)
+        and -90 <= lat <= 90
+        and -180 <= lng <= 180
+    ):
+        return BusRecord(bus_id, route, float(lat), float(lng))
+    bus = Bus(busId=bus_id, route=route, lat=lat, lng=lng)
+    return BusRecord(bus.busId, bus.route, bus.lat, bus.lng)
+
+
+def parse_bus(decoded_message: typing.Any) -> BusRecord:
+    """Validate bus info from decoded JSON message of microservice, errors are the same as for Bus."""
+    try:
+        return validate_bus(
+            decoded_message['busId'],
+            decoded_message['route'],
+            decoded_message['lat'],
+            decoded_message['lng'],
+        )
+    except (KeyError, TypeError):
+        bus = Bus(**decoded_message)
+        return BusRecord(bus.busId, bus.route, bus.lat, bus.lng)
+
+
+class BusDictionaryMessage(pydantic.BaseModel):
+    msgType: str
+    buses: typing.List[typing.Tuple[int, str]]
+    routes: typing.List[typing.Tuple[int, str]]
+
+    @pydantic.validator('msgType')
+    def validate_msg_type(cls, msg_type):
+        if msg_type != 'BusDictionary':
+            raise ValueError('msgType should be equal BusDictionary')
+        return msg_type
+
+
 class WindowBounds(pydantic.BaseModel):
     # can't init with default values cause all fields are required
     south_lat: float
@@ -39,7 +114,7 @@ class WindowBounds(pydantic.BaseModel):
             raise ValueError('should be between -180 and 180')
         return lng
 
-    def is_inside(self, bus: Bus) -> bool:
+    def is_inside(self, bus: BusRecord) -> bool:
         """Check if bus is inside bounds."""
         if self.south_lat > bus.lat or self.north_lat < bus.lat:
             return False
@@ -63,3 +138,99 @@ class NewBoundsMessage(pydantic.BaseModel):
         if msg_type != 'newBounds':
             raise ValueError('msgType should be equal newBounds')
         return msg_type
+
+
+class BrowserOptions(pydantic.BaseModel):
+    deltas: bool = False  # send BusesDelta messages with changes only instead of Buses
+    binary: bool = False  # send buses in binary frames, see wire module
+    max_buses: pydantic.conint(ge=0) = 0  # send Clusters instead of buses if window has more buses, 0 - never
+    compression: bool = False  # send big messages in deflate frames, see wire module
+    reported: bool = False  # send reported positions in BusesDelta instead of estimated ones, edge servers need them
+
+    def update(self, **options) -> None:
+        for name, value in options.items():
+            setattr(self, name, value)
+
+
+class SetOptionsMessage(pydantic.BaseModel):
+    msgType: str
+    data: BrowserOptions
+
+    @pydantic.validator('msgType')
+    def validate_msg_type(cls, msg_type):
+        if msg_type != 'setOptions':
+            raise ValueError('msgType should be equal setOptions')
+        return msg_type
+
+
+class RoutesFilter(pydantic.BaseModel):
+    routes: pydantic.conset(str, max_items=1000) = set()  # routes which browser watches, empty set means all routes
+
+    def update(self, routes: typing.Set[str]) -> None:
+        self.routes = routes
+
+
+class SubscribeRoutesMessage(pydantic.BaseModel):
+    msgType: str
+    data: RoutesFilter
+
+    @pydantic.validator('msgType')
+    def validate_msg_type(cls, msg_type):
+        if msg_type != 'subscribeRoutes':
+            raise ValueError('msgType should be equal subscribeRoutes')
+        return msg_type
+
+
+class TrackRequest(pydantic.BaseModel):
+    busId: str
+
+
+class RequestTrackMessage(pydantic.BaseModel):
+    msgType: str
+    data: TrackRequest
+
+    @pydantic.validator('msgType')
+    def validate_msg_type(cls, msg_type):
+        if msg_type != 'requestTrack':
+            raise ValueError('msgType should be equal requestTrack')
+        return msg_type
+
+
+class ReplayRequest(pydantic.BaseModel):
+    seconds_ago: pydantic.confloat(ge=0) = 0  # replay starts this number of seconds ago, 0 stops replay
+    speed: pydantic.confloat(gt=0, le=1000) = 1  # seconds of replay in one second
+
+
+class RequestReplayMessage(pydantic.BaseModel):
+    msgType: str
+    data: ReplayRequest
+
+    @pydantic.validator('msgType')
+    def validate_msg_type(cls, msg_type):
+        if msg_type != 'requestReplay':
+            raise ValueError('msgType should be equal requestReplay')
+        return msg_type
+
+
+BROWSER_MESSAGES = {
+    'newBounds': NewBoundsMessage,
+    'setOptions': SetOptionsMessage,
+    'subscribeRoutes': SubscribeRoutesMessage,
+    'requestTrack': RequestTrackMessage,
+    'requestReplay': RequestReplayMessage,
+}
+
+
+def parse_browser_message(decoded_message: typing.Any) -> pydantic.BaseModel:
+    """
+    Validate message from browser by model of its msgType.
+
+    Message with unknown msgType is validated as newBounds to get errors about all its fields.
+    """
+    if not isinstance(decoded_message, dict):
+        raise pydantic.ValidationError(
+            [pydantic.error_wrappers.ErrorWrapper(TypeError('message should be JSON object'), loc='__root__')],
+            NewBoundsMessage,
+        )
+    message_model = BROWSER_MESSAGES.get(decoded_message.get('msgType'), NewBoundsMessage)
+    return message_model(**decoded_message)
@@ -0,0 +1,90 @@
+import json
+import typing
+
+import models
+import wire
+
+# edge server watches whole world of upstream server
+WORLD_BOUNDS = {'south_lat': -90, 'north_lat': 90, 'west_lng': -180, 'east_lng': 180}
+
+
+class UpstreamBuses:
+    """
+    Buses of upstream server restored from BusesDelta messages which it sends to edge server like to browser.
+
+    Edge server subscribes to whole world with deltas in compressed binary frames, so every change of bus
+    crosses network once per edge server. Keyframe and full Buses message replace all buses, buses which are not
+    in them are removed.
+    """
+
+    def __init__(self):
+        self.dictionary = wire.Dictionary()
+        self.bus_ids: typing.Set[str] = set()
+
+    @staticmethod
+    def build_subscribe_messages() -> typing.List[str]:
+        """Build messages which subscribe to changes of all buses of upstream server."""
+        return [
+            json.dumps({
+                'msgType': 'setOptions',
+                'data': {'deltas': True, 'binary': True, 'compression': True, 'reported': True},
+            }),
+            json.dumps({'msgType': 'newBounds', 'data': WORLD_BOUNDS}),
+        ]
+
+    def receive(
+        self,
+        message: typing.Union[str, bytes],
+    ) -> typing.Tuple[typing.List[models.BusRecord], typing.List[str]]:
+        """
+        Read message of upstream server.
+
+        :return: changed buses and ids of removed buses
+        """
+        if message[:1] == bytes([wire.FRAME_DEFLATE]):
+            message = wire.unpack_deflate_frame(message)
+        if isinstance(message, bytes):
+            if message[:1] == bytes([wire.FRAME_BUSES]):
+                keyframe, removed_bus_indexes, records = True, [], list(wire.unpack_buses_frame(message))
+            else:
+                keyframe, removed_bus_indexes, records = wire.unpack_buses_delta_frame(message)
+            bus_ids, routes = self.dictionary.bus_ids, self.dictionary.routes
+            try:
+                changed_buses = [
+                    models.BusRecord(bus_ids[bus_index], routes[route_index], lat, lng)
+                    for bus_index, route_index, lat, lng in records
+                ]
+                removed_bus_ids = [bus_ids[bus_index] for bus_index in removed_bus_indexes]
+            except KeyError as e:
+                raise wire.WireFormatError(f'index {e} is not in dictionary of upstream server') from e
+            return self.apply(keyframe, changed_buses, removed_bus_ids)
+
+        decoded_message = json.loads(message)
+        if not isinstance(decoded_message, dict):
+            raise wire.WireFormatError(f'message of upstream server should be JSON object, got {message!r:.100}')
+        msg_type = decoded_message.get('msgType')
+        if msg_type == 'BusDictionary':
+            dictionary_message = models.BusDictionaryMessage(**decoded_message)
+            self.dictionary.update(dictionary_message.buses, dictionary_message.routes)
+            return [], []
+        if msg_type == 'BusesDelta':
+            changed_buses = [models.parse_bus(bus) for bus in decoded_message['buses']]
+            return self.apply(decoded_message['keyframe'], changed_buses, decoded_message['removed'])
+        if msg_type == 'Buses':  # upstream can send full state of world before it gets options
+            return self.apply(True, [models.parse_bus(bus) for bus in decoded_message['buses']], [])
+        raise wire.WireFormatError(f'unexpected message of upstream server {msg_type}')
+
+    def apply(
+        self,
+        keyframe: bool,
+        changed_buses: typing.List[models.BusRecord],
+        removed_bus_ids: typing.List[str],
+    ) -> typing.Tuple[typing.List[models.BusRecord], typing.List[str]]:
+        if keyframe:
+            changed_bus_ids = {bus.busId for bus in changed_buses}
+            removed_bus_ids = [bus_id for bus_id in self.bus_ids if bus_id not in changed_bus_ids]
+            self.bus_ids = changed_bus_ids
+        else:
+            self.bus_ids.update(bus.busId for bus in changed_buses)
+            self.bus_ids.difference_update(removed_bus_ids)
+        return changed_buses, removed_bus_ids
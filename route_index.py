@@ -0,0 +1,50 @@
+import typing
+
+import models
+
+
+class RouteIndex:
+    """
+    Inverted index of buses by route.
+
+    Browser which watches few routes gets buses only of these routes, so cost of its messages is proportional
+    to number of buses of its routes instead of all buses in window.
+    """
+
+    def __init__(self):
+        self.routes: typing.Dict[str, typing.Dict[str, models.BusRecord]] = {}
+        self.bus_routes: typing.Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self.bus_routes)
+
+    def update(self, bus: models.BusRecord) -> None:
+        """Add new bus or replace existing bus, bus can change its route."""
+        old_route = self.bus_routes.get(bus.busId)
+        if old_route is not None and old_route != bus.route:
+            self._discard(old_route, bus.busId)
+        self.routes.setdefault(bus.route, {})[bus.busId] = bus
+        self.bus_routes[bus.busId] = bus.route
+
+    def remove(self, bus_id: str) -> None:
+        """Remove bus from index if it exists."""
+        route = self.bus_routes.pop(bus_id, None)
+        if route is not None:
+            self._discard(route, bus_id)
+
+    def clear(self) -> None:
+        self.routes.clear()
+        self.bus_routes.clear()
+
+    def _discard(self, route: str, bus_id: str) -> None:
+        route_buses = self.routes[route]
+        del route_buses[bus_id]
+        if not route_buses:
+            del self.routes[route]
+
+    def query(self, routes: typing.Iterable[str], bounds: models.WindowBounds) -> typing.Iterator[models.BusRecord]:
+        """Get buses of routes inside window bounds."""
+        for route in routes:
+            route_buses = self.routes.get(route)
+            if route_buses:
+                yield from (bus for bus in route_buses.values() if bounds.is_inside(bus))
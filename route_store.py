@@ -0,0 +1,115 @@
+import argparse
+import glob
+import json
+import mmap
+import os
+import struct
+import typing
+
+import numpy
+
+MAGIC = b'BUSROUTE'
+VERSION = 1
+# magic, version, size of JSON index of routes, number of coordinate points
+HEADER = struct.Struct('<8sIQQ')
+COORDINATES_ALIGNMENT = 8
+
+
+def compile_routes(directory_path: str, output_path: str) -> int:
+    """
+    Pack all routes from directory to one binary file.
+
+    File consists of header, JSON index of routes (name, offset and length in points)
+    and block of float64 (lat, lng) of all routes aligned by 8 bytes.
+
+    :return: number of packed routes
+    """
+    index = []
+    coordinates = []
+    points_count = 0
+    for filename in sorted(glob.glob(os.path.join(directory_path, '*.json'))):
+        with open(filename, 'r', encoding='utf8') as file:
+            route = json.load(file)
+        route_coordinates = numpy.asarray(route['coordinates'], dtype='<f8').reshape(-1, 2)
+        index.append({'name': route['name'], 'offset': points_count, 'length': len(route_coordinates)})
+        coordinates.append(route_coordinates)
+        points_count += len(route_coordinates)
+
+    encoded_index = json.dumps(index, ensure_ascii=False).encode('utf8')
+    padding = -(HEADER.size + len(encoded_index)) % COORDINATES_ALIGNMENT
+    with open(output_path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(encoded_index), points_count))
+        file.write(encoded_index)
+        file.write(b' ' * padding)
+        for route_coordinates in coordinates:
+            file.write(route_coordinates.tobytes())
+    return len(index)
+
+
+class RouteStore:
+    """
+    Routes from compiled file, coordinates are memory-mapped, so processes which read one file share its pages.
+
+    Coordinates of all routes are one (points, 2) array, route points are found by offsets and lengths.
+    """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, index_size, points_count = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not compiled routes file of version {VERSION}')
+        index = json.loads(self.mmap[HEADER.size:HEADER.size + index_size].decode('utf8'))
+        coordinates_offset = HEADER.size + index_size
+        coordinates_offset += -coordinates_offset % COORDINATES_ALIGNMENT
+
+        self.names: typing.List[str] = [route['name'] for route in index]
+        self.offsets = numpy.array([route['offset'] for route in index], dtype=numpy.int64)
+        self.lengths = numpy.array([route['length'] for route in index], dtype=numpy.int64)
+        self.coordinates = numpy.frombuffer(
+            self.mmap,
+            dtype='<f8',
+            count=points_count * 2,
+            offset=coordinates_offset,
+        ).reshape(-1, 2)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def get_route(self, route_index: int) -> dict:
+        """Get route like in routes directory, coordinates are read-only view of memory-mapped file."""
+        offset = self.offsets[route_index]
+        return {
+            'name': self.names[route_index],
+            'coordinates': self.coordinates[offset:offset + self.lengths[route_index]],
+        }
+
+    def iter_routes(
+        self,
+        routes_number: int = 0,
+        worker_index: int = 0,
+        workers_number: int = 1,
+    ) -> typing.Iterator[dict]:
+        """Iterate routes like `fake_bus.load_routes`."""
+        if routes_number <= 0:
+            routes_number = len(self)
+        for route_index in range(min(routes_number, len(self)))[worker_index::workers_number]:
+            yield self.get_route(route_index)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='Routes compiler',
+        description='Pack routes JSON files to one binary file, which emulator reads by --routes_file',
+    )
+    parser.add_argument('directory_path', type=str, help='directory with routes JSON files, example "routes"')
+    parser.add_argument('output_path', type=str, help='path of compiled file, example "routes.bin"')
+    args = parser.parse_args()
+
+    routes_count = compile_routes(args.directory_path, args.output_path)
+    print(f'{routes_count} routes are packed to {args.output_path}')
+
+
+if __name__ == '__main__':
+    main()
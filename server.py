@@ -2,16 +2,143 @@ import argparse
 import contextlib
 import json
 import logging
+import multiprocessing
+import time
+import typing
 
 import trio
 import trio_websocket
-from trio_websocket import serve_websocket, ConnectionClosed
+from trio_websocket import serve_websocket, open_websocket_url, ConnectionClosed
 import pydantic
 
+import backpressure
+import bus_engine
+import bus_log
+import encoding
+import expiry
+import history
+import ingest
+import interpolation
+import metrics
 import models
+import relay
+import route_index
+import route_store
+import shared_state
+import spatial
+import wire
 
 logger = logging.getLogger(__name__)
 
+# positions which buses reported, estimated positions of interpolation are only in structures of browsers
+buses: typing.Dict[str, models.BusRecord] = {}
+buses_grid = spatial.BusGrid()
+buses_routes = route_index.RouteIndex()
+buses_encoder = encoding.BusesEncoder(buses_grid, buses_routes)
+buses_clusters = spatial.ClusterGrid()
+buses_compressor = encoding.MessageCompressor()
+# in multi-process mode ingest process writes buses to the table and browser workers read them from it
+shared_table: typing.Optional[shared_state.SharedBusTable] = None
+# last seen time of buses, stale buses are removed only by process which gets buses from microservice
+buses_expiry: typing.Optional[expiry.ExpiryWheel] = None
+buses_history: typing.Optional[history.PositionHistory] = None
+# log of ingest process which restores buses after restart
+buses_log: typing.Optional[bus_log.BusLog] = None
+# speeds of buses of process which serves browsers, it shows estimated positions between reports
+buses_motion: typing.Optional[interpolation.MotionEstimator] = None
+send_limits = backpressure.SendLimits()
+# messages of microservices are saved once per tick, 0 - every message is saved at once
+ingest_tick = 0.1
+
+ingested_buses = metrics.Counter('buses_ingested_total', 'Bus positions got from microservices')
+superseded_buses = metrics.Counter(
+    'buses_superseded_total',
+    'Bus positions dropped because the same bus sent newer position during ingest tick',
+)
+bus_errors = metrics.Counter('bus_errors_total', 'Errors of validation of microservice messages')
+tracked_buses = metrics.Gauge('buses_tracked', 'Buses which server knows', lambda: len(buses))
+upstream_changes = metrics.Counter('buses_upstream_changes_total', 'Changes and removals of buses got from upstream')
+shared_table_skipped_buses = metrics.Counter(
+    'shared_table_skipped_positions_total',
+    'Bus positions which were not written to shared table because it was full or bus was too long',
+)
+history_skipped_buses = metrics.Counter(
+    'history_skipped_positions_total',
+    'Bus positions which were not saved to history because it was full',
+)
+evicted_buses = metrics.Counter('buses_evicted_total', 'Buses removed because they were not updated for ttl')
+connected_browsers = metrics.Gauge('browsers_connected', 'Browsers which are connected now')
+browser_send_duration = metrics.Histogram(
+    'browser_send_seconds',
+    'Time of building and sending of one update to browser',
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+browser_sent_bytes = metrics.Counter('browser_sent_bytes_total', 'Size of messages sent to browsers')
+browser_compression_saved_bytes = metrics.Counter(
+    'browser_compression_saved_bytes_total',
+    'Difference of sizes of messages to browsers before and after compression',
+)
+slow_browsers = metrics.Counter('browsers_slow_disconnected_total', 'Browsers disconnected because they were too slow')
+event_loop_lag = metrics.Histogram(
+    'event_loop_lag_seconds',
+    'Delay of wake up of sleeping task, it grows when event loop is busy',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+
+def show_bus(bus: models.BusRecord) -> None:
+    """Save position of bus which browsers see, it is reported or estimated one."""
+    old_cell = buses_grid.bus_cells.get(bus.busId)
+    buses_grid.update(bus)
+    buses_encoder.invalidate(bus.busId, old_cell, buses_grid.bus_cells[bus.busId])
+    buses_clusters.update(bus)
+    buses_routes.update(bus)
+
+
+def update_bus(bus: models.BusRecord, is_logged: bool = True) -> None:
+    """
+    Save new bus info to all server structures.
+
+    :param is_logged: append bus to log, bus restored from log is already there
+    """
+    buses[bus.busId] = bus
+    if shared_table is not None and shared_table.is_writer:
+        # ingest process serves no browsers, browser workers show buses of shared table
+        if not shared_table.write(bus):
+            shared_table_skipped_buses.inc()
+    else:
+        show_bus(bus)
+    if buses_expiry is not None:
+        buses_expiry.touch(bus.busId, time.monotonic())
+    if buses_history is not None and not buses_history.append(bus, time.time()):
+        history_skipped_buses.inc()
+    if buses_log is not None and is_logged:
+        buses_log.append(bus)
+    if buses_motion is not None:
+        buses_motion.report(bus, time.monotonic())
+
+
+def remove_bus(bus_id: str) -> None:
+    """Remove bus from all server structures."""
+    if buses.pop(bus_id, None) is None:
+        return
+    if shared_table is not None and shared_table.is_writer:
+        shared_table.remove(bus_id)
+    else:
+        old_cell = buses_grid.bus_cells.get(bus_id)
+        buses_grid.remove(bus_id)
+        buses_encoder.remove(bus_id, old_cell)
+        buses_clusters.remove(bus_id)
+        buses_routes.remove(bus_id)
+    if buses_expiry is not None:
+        buses_expiry.discard(bus_id)
+    if buses_history is not None:
+        buses_history.remove(bus_id)
+    if buses_log is not None:
+        buses_log.remove(bus_id)
+    if buses_motion is not None:
+        buses_motion.remove(bus_id)
+
 
 async def communicate_with_browser(request: trio_websocket.WebSocketRequest):
     """Run coroutines which interact with browser."""
@@ -21,16 +148,26 @@ async def communicate_with_browser(request: trio_websocket.WebSocketRequest):
         west_lng=-180,
         east_lng=180
     )  # это нужно здесь, т.к. для каждого вебсокета (клиента) свои границы
-    async with trio.open_nursery() as nursery:
-        ws = await request.accept()
-        nursery.start_soon(listen_browser, ws, window_bounds)
-        nursery.start_soon(talk_to_browser, ws, window_bounds)
+    options = models.BrowserOptions()
+    routes_filter = models.RoutesFilter()
+    replay = history.Replay()
+    ws = await request.accept()
+    connected_browsers.inc()
+    try:
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(listen_browser, ws, window_bounds, True, options, routes_filter, replay)
+            nursery.start_soon(talk_to_browser, ws, window_bounds, options, routes_filter, replay)
+    finally:
+        connected_browsers.dec()
 
 
 async def listen_browser(
     ws: trio_websocket.WebSocketConnection,
     bounds: models.WindowBounds,
     prod_mode=True,
+    options: typing.Optional[models.BrowserOptions] = None,
+    routes_filter: typing.Optional[models.RoutesFilter] = None,
+    replay: typing.Optional[history.Replay] = None,
 ):
     """
     Listen browser messages.
@@ -38,7 +175,16 @@ async def listen_browser(
     :param ws: web socket
     :param bounds: current windown bounds in browser
     :param prod_mode: value for the test, because without it the tests fail due to the while true loop
+    :param options: options of messages which browser negotiated with setOptions message
+    :param routes_filter: routes which browser subscribed to with subscribeRoutes message
+    :param replay: replay of history which browser requested with requestReplay message
     """
+    if options is None:
+        options = models.BrowserOptions()
+    if routes_filter is None:
+        routes_filter = models.RoutesFilter()
+    if replay is None:
+        replay = history.Replay()
     while True:
         errors = []
         try:
@@ -47,9 +193,28 @@ async def listen_browser(
                 break
             try:
                 decoded_message = json.loads(message)
-                new_bounds = models.NewBoundsMessage(**decoded_message).data
-                bounds.update(**new_bounds.dict())
-                logger.debug(f'update window bounds {bounds}')
+                browser_message = models.parse_browser_message(decoded_message)
+                if isinstance(browser_message, models.SetOptionsMessage):
+                    options.update(**browser_message.data.dict(exclude_unset=True))
+                    logger.debug('update browser options %s', options)
+                elif isinstance(browser_message, models.SubscribeRoutesMessage):
+                    routes_filter.update(browser_message.data.routes)
+                    logger.debug('update browser routes %s', routes_filter)
+                elif isinstance(browser_message, (models.RequestTrackMessage, models.RequestReplayMessage)):
+                    if buses_history is None:
+                        errors.append('history of buses is disabled')
+                    elif isinstance(browser_message, models.RequestTrackMessage):
+                        bus_id = browser_message.data.busId
+                        await ws.send_message(encoding.build_track_message(bus_id, buses_history.get_track(bus_id)))
+                    elif browser_message.data.seconds_ago:
+                        now = time.time()
+                        replay.start(now - browser_message.data.seconds_ago, browser_message.data.speed, now)
+                        logger.debug('start replay %s', browser_message.data)
+                    else:
+                        replay.stop()
+                else:
+                    bounds.update(**browser_message.data.dict())
+                    logger.debug('update window bounds %s', bounds)
             except json.JSONDecodeError:
                 errors.append(f'can not decode message "{message}" to JSON')
             except pydantic.ValidationError as e:
@@ -63,99 +228,611 @@ async def listen_browser(
             break
 
 
-async def talk_to_browser(ws: trio_websocket.WebSocketConnection, bounds: models.WindowBounds):
-    """Send regular messages to browser."""
-    send_every_seconds = 1
+async def talk_to_browser(
+    ws: trio_websocket.WebSocketConnection,
+    bounds: models.WindowBounds,
+    options: models.BrowserOptions,
+    routes_filter: typing.Optional[models.RoutesFilter] = None,
+    replay: typing.Optional[history.Replay] = None,
+):
+    """
+    Send regular messages to browser, interval of messages adapts to speed of browser.
+
+    Messages are built right before sending, so slow browser gets latest buses instead of queue of old messages.
+    Browser which can't get messages even with max interval or in send timeout is disconnected.
+    Browser which subscribed to routes gets only buses of these routes and never gets clusters.
+    Browser which requested replay gets snapshots of history till replay catches up with now.
+    """
+    if routes_filter is None:
+        routes_filter = models.RoutesFilter()
+    if replay is None:
+        replay = history.Replay()
+    send_rate = backpressure.SendRate(send_limits)
+    delta_tracker = encoding.BusesDeltaTracker(buses_encoder)
+    browser_dictionary = wire.Dictionary()
     while True:
         try:
-            await send_buses(ws, bounds)
-            await trio.sleep(send_every_seconds)
+            known = browser_dictionary if options.binary else None
+            delta_tracker.reported_buses = buses if options.reported else None
+            routes = routes_filter.routes
+            window_clusters = None if routes else get_window_clusters(bounds, options.max_buses)
+            replay_time = replay.get_time(time.time()) if buses_history is not None else None
+            with trio.move_on_after(send_limits.send_timeout) as send_scope:
+                if replay_time is not None:
+                    delta_tracker.reset()  # browser replaces all buses by snapshot
+                    sent_size, send_seconds = await send_replay(ws, bounds, replay_time, options.compression)
+                elif window_clusters is not None:
+                    delta_tracker.reset()  # browser drops buses when it gets clusters
+                    sent_size, send_seconds = await send_clusters(ws, *window_clusters, options.compression)
+                elif options.deltas:
+                    sent_size, send_seconds = await send_buses_delta(
+                        ws, bounds, delta_tracker, known, routes, options.compression
+                    )
+                else:
+                    delta_tracker.reset()  # browser will get keyframe if it switches to deltas
+                    sent_size, send_seconds = await send_buses(ws, bounds, known, routes, options.compression)
+            if send_scope.cancelled_caught:
+                logger.warning(f'messages were not sent to browser in {send_limits.send_timeout} seconds, disconnect')
+                slow_browsers.inc()
+                await disconnect_slow_browser(ws)
+                break
+
+            browser_send_duration.observe(send_seconds)
+            browser_sent_bytes.inc(sent_size)
+            send_rate.on_sent(send_seconds, sent_size)
+            if send_rate.is_slow:
+                logger.warning(f'browser is too slow ({send_rate.throughput:.0f} bytes per second), disconnect it')
+                slow_browsers.inc()
+                await disconnect_slow_browser(ws)
+                break
+            await trio.sleep(send_rate.interval)
         except ConnectionClosed:
             break
 
 
-async def send_buses(ws: trio_websocket.WebSocketConnection, bounds: models.WindowBounds):
-    """Send message with buses."""
-    buses_in_window = {
-        bus_id: bus.dict()
-        for bus_id, bus
-        in buses.items()
-        if bounds.is_inside(bus)
-    }
-    logger.debug(f'{len(buses_in_window)} buses in window from {len(buses)}')
-    message = json.dumps(
-        {
-            'msgType': 'Buses',
-            'buses': list(buses_in_window.values()),
-        },
-        ensure_ascii=False
+async def disconnect_slow_browser(ws: trio_websocket.WebSocketConnection):
+    """Close connection, but don't wait browser, which doesn't read socket."""
+    with trio.move_on_after(1):
+        await ws.aclose(code=1013, reason='connection is too slow')
+
+
+def get_window_clusters(
+    bounds: models.WindowBounds,
+    max_buses: int,
+) -> typing.Optional[typing.Tuple[typing.List[spatial.Cluster], float]]:
+    """
+    Get clusters of window if it has more than max_buses buses.
+
+    Level of clusters depends on window size, so number of clusters is limited at any zoom.
+
+    :param max_buses: 0 means that browser wants buses at any zoom
+    :return: clusters and size of their cells or None if browser should get buses
+    """
+    if not max_buses:
+        return None
+    level = buses_clusters.choose_level(bounds)
+    clusters = buses_clusters.query(bounds, level)
+    # border clusters can have buses out of window, so it's upper estimate
+    if sum(cluster.count for cluster in clusters) <= max_buses:
+        return None
+    return clusters, buses_clusters.cell_sizes[level]
+
+
+async def send_messages(
+    ws: trio_websocket.WebSocketConnection,
+    messages: typing.Iterable[typing.Union[str, bytes]],
+    compression: bool = False,
+) -> typing.Tuple[int, float]:
+    """
+    Send messages to browser, big messages are compressed if browser asked for it.
+
+    :return: size of sent messages and seconds of their sending without time of their compression
+    """
+    sent_size = 0
+    send_seconds = 0.0
+    for message in messages:
+        if compression:
+            frame = buses_compressor.compress(message)
+            browser_compression_saved_bytes.inc(len(message) - len(frame))
+            message = frame
+        started_at = trio.current_time()
+        await ws.send_message(message)
+        send_seconds += trio.current_time() - started_at
+        sent_size += len(message)
+    return sent_size, send_seconds
+
+
+async def send_replay(
+    ws: trio_websocket.WebSocketConnection,
+    bounds: models.WindowBounds,
+    replay_time: float,
+    compression: bool = False,
+):
+    """
+    Send message with buses which were inside window bounds at replay time.
+
+    :return: size of sent message and seconds of its sending
+    """
+    snapshot = buses_history.get_snapshot(replay_time, bounds)
+    message = encoding.build_replay_message(snapshot, replay_time)
+    logger.debug('send replay of %s buses at %s', len(snapshot), replay_time)
+    return await send_messages(ws, [message], compression)
+
+
+async def send_clusters(
+    ws: trio_websocket.WebSocketConnection,
+    clusters: typing.List[spatial.Cluster],
+    cell_size: float,
+    compression: bool = False,
+):
+    """
+    Send message with clusters of buses instead of buses.
+
+    :return: size of sent message and seconds of its sending
+    """
+    message = encoding.build_clusters_message(clusters, cell_size)
+    logger.debug('send %s clusters of %s degrees cells', len(clusters), cell_size)
+    return await send_messages(ws, [message], compression)
+
+
+async def send_buses(
+    ws: trio_websocket.WebSocketConnection,
+    bounds: models.WindowBounds,
+    known: typing.Optional[wire.Dictionary] = None,
+    routes: typing.Collection[str] = (),
+    compression: bool = False,
+):
+    """
+    Send message with buses.
+
+    :param known: indexes which browser knows, if it is passed buses are sent in binary frame
+    :param routes: routes which browser watches, empty means all routes
+    :param compression: compress big messages
+    :return: size of sent messages and seconds of their sending
+    """
+    if known is None:
+        message, buses_in_window_count = buses_encoder.build_buses_message(bounds, routes)
+        messages = [message]
+    else:
+        messages, buses_in_window_count = buses_encoder.build_binary_buses_messages(bounds, known, routes)
+    logger.debug('%s buses in window from %s', buses_in_window_count, len(buses))
+    logger.debug('send new messages with buses: %s', messages)
+    return await send_messages(ws, messages, compression)
+
+
+async def send_buses_delta(
+    ws: trio_websocket.WebSocketConnection,
+    bounds: models.WindowBounds,
+    delta_tracker: encoding.BusesDeltaTracker,
+    known: typing.Optional[wire.Dictionary] = None,
+    routes: typing.Collection[str] = (),
+    compression: bool = False,
+):
+    """
+    Send message with buses changed since previous message.
+
+    :param known: indexes which browser knows, if it is passed buses are sent in binary frame
+    :param routes: routes which browser watches, empty means all routes
+    :param compression: compress big messages
+    :return: size of sent messages and seconds of their sending
+    """
+    if known is None:
+        message, changed_buses_count = delta_tracker.build_delta_message(bounds, routes)
+        messages = [message]
+    else:
+        messages, changed_buses_count = delta_tracker.build_binary_delta_messages(bounds, known, routes)
+    logger.debug('%s buses changed in window from %s', changed_buses_count, len(buses))
+    logger.debug('send new messages with buses delta: %s', messages)
+    return await send_messages(ws, messages, compression)
+
+
+def commit_ingested_buses(ingest_buffer: ingest.IngestBuffer) -> list:
+    """
+    Save the latest positions of buses from buffered messages of microservice.
+
+    :return: errors of every wrong message
+    """
+    messages_count = len(ingest_buffer)
+    committed_buses, errors, superseded_count = ingest_buffer.parse()
+    for bus in committed_buses:
+        update_bus(bus)
+    ingested_buses.inc(len(committed_buses))
+    superseded_buses.inc(superseded_count)
+    logger.debug(
+        'committed %s buses of %s messages, %s updates are superseded',
+        len(committed_buses), messages_count, superseded_count,
     )
-    logger.debug(f'send new message with buses: {message}')
-    await ws.send_message(message)
+    return errors
+
+
+async def send_bus_errors(ws: trio_websocket.WebSocketConnection, messages_errors: typing.List[list]) -> None:
+    """Reply by Errors message to every wrong message of microservice."""
+    for errors in messages_errors:
+        bus_errors.inc(len(errors))
+        error_message = json.dumps({'msgType': 'Errors', 'errors': errors}, ensure_ascii=True)
+        logger.warning(f'got wrong message from microservice {error_message}')
+        with contextlib.suppress(ConnectionClosed):
+            await ws.send_message(error_message)
+
+
+async def commit_ingested_buses_periodically(
+    ws: trio_websocket.WebSocketConnection,
+    ingest_buffer: ingest.IngestBuffer,
+):
+    """Save buses of microservice every ingest tick."""
+    while True:
+        await trio.sleep(ingest_tick)
+        if ingest_buffer:
+            errors = commit_ingested_buses(ingest_buffer)
+            if errors:
+                await send_bus_errors(ws, errors)
 
 
 async def get_bus_updates(request: trio_websocket.WebSocketRequest, prod_mode: bool = True):
     """
     Get updates from microservice with buses info.
 
+    Messages are buffered and committed once per ingest tick, so bus which reports several times
+    during tick is parsed and saved once.
+
     :param request: request from microservice
     :param prod_mode: value for the test, because without it the tests fail due to the while true loop
-    also it creates global variable buses, which absents when you run tests
     """
     ws = await request.accept()
-    while True:
-        try:
-            message = await ws.get_message()
+    ingest_buffer = ingest.IngestBuffer()
+    async with trio.open_nursery() as nursery:
+        if ingest_tick > 0:
+            nursery.start_soon(commit_ingested_buses_periodically, ws, ingest_buffer)
+        while True:
+            try:
+                message = await ws.get_message()
+            except ConnectionClosed:
+                break
 
-            if not prod_mode:
-                global buses
-                buses = {}
             if not prod_mode and message == 'break':
                 break
 
-            errors = []
-            try:
-                decoded_message = json.loads(message)
-                bus = models.Bus(**decoded_message)
-                buses[bus.busId] = bus
-                logger.debug(f'get new bus info: {message}')
-            except json.JSONDecodeError:
-                errors.append(f'can not decode message "{message}" to JSON')
-            except pydantic.ValidationError as e:
-                errors += e.errors()
+            ingest_buffer.add(message)
+            if ingest_tick <= 0:
+                errors = commit_ingested_buses(ingest_buffer)
+                if errors:
+                    await send_bus_errors(ws, errors)
+        nursery.cancel_scope.cancel()
+
+    if ingest_buffer:  # buses which microservice sent before disconnect
+        errors = commit_ingested_buses(ingest_buffer)
+        if errors:
+            await send_bus_errors(ws, errors)
 
-            if errors:
-                error_message = json.dumps({'msgType': 'Errors', 'errors': errors}, ensure_ascii=True)
-                await ws.send_message(error_message)
-                logger.warning(f'got wrong message from browser {error_message}')
-        except ConnectionClosed:
-            break
+
+async def relay_upstream(upstream_url: str, max_reconnect_delay: float = 30):
+    """
+    Get all buses from upstream server and save them, so edge server serves its own browsers.
+
+    Edge subscribes to upstream like browser, which watches whole world and gets deltas.
+    After reconnect the first keyframe removes buses which were removed from upstream meanwhile.
+    """
+    upstream_buses = relay.UpstreamBuses()
+    reconnect_delay = 1
+    while True:
+        try:
+            async with open_websocket_url(upstream_url) as ws:
+                upstream_buses.dictionary = wire.Dictionary()  # indexes of dictionary are sent for every connection
+                for message in upstream_buses.build_subscribe_messages():
+                    await ws.send_message(message)
+                logger.info(f'subscribed to buses of upstream server {upstream_url}')
+                reconnect_delay = 1
+                while True:
+                    changed_buses, removed_bus_ids = upstream_buses.receive(await ws.get_message())
+                    for bus in changed_buses:
+                        update_bus(bus)
+                    for bus_id in removed_bus_ids:
+                        remove_bus(bus_id)
+                    upstream_changes.inc(len(changed_buses) + len(removed_bus_ids))
+                    logger.debug(
+                        'got %s changed and %s removed buses from upstream', len(changed_buses), len(removed_bus_ids)
+                    )
+        except (OSError, trio_websocket.HandshakeError, ConnectionClosed) as e:
+            logger.warning(f'connection to upstream server is lost ({e!r}), reconnect in {reconnect_delay} seconds')
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f'wrong message of upstream server ({e!r}), reconnect in {reconnect_delay} seconds')
+        await trio.sleep(reconnect_delay)
+        reconnect_delay = min(reconnect_delay * 2, max_reconnect_delay)
+
+
+def evict_stale_buses() -> int:
+    """
+    Remove buses which were not updated for ttl of buses_expiry, browsers get them as removed in next delta.
+
+    :return: number of evicted buses
+    """
+    expired_bus_ids = buses_expiry.expire(time.monotonic())
+    for bus_id in expired_bus_ids:
+        remove_bus(bus_id)
+    evicted_buses.inc(len(expired_bus_ids))
+    return len(expired_bus_ids)
+
+
+async def run_buses_eviction():
+    """Remove stale buses every tick of buses_expiry."""
+    while True:
+        await trio.sleep(buses_expiry.tick)
+        evicted_buses_count = evict_stale_buses()
+        if evicted_buses_count:
+            logger.info(
+                f'evicted {evicted_buses_count} stale buses, {len(buses)} buses left, '
+                f'{buses_expiry.expired_buses_count} evicted since start'
+            )
+
+
+async def run_interpolation(tick: float):
+    """Show estimated positions of moving buses every tick, so buses move smoothly between rare reports."""
+    while True:
+        await trio.sleep(tick)
+        started_at = time.perf_counter()
+        estimated_buses = buses_motion.estimate(time.monotonic())
+        for bus in estimated_buses:
+            if bus.busId in buses:
+                show_bus(bus)
+        logger.debug('estimated %s buses in %.3f seconds', len(estimated_buses), time.perf_counter() - started_at)
+
+
+def create_motion_estimator(routes_file: typing.Optional[str]) -> interpolation.MotionEstimator:
+    """Create estimator of bus speeds, buses are snapped to routes of compiled routes file if it is set."""
+    geometry = None
+    if routes_file:
+        route_table = bus_engine.RouteTable.from_store(route_store.RouteStore(routes_file))
+        geometry = interpolation.RouteGeometry(route_table)
+        logger.info(f'loaded {len(route_table)} routes for interpolation of buses from {routes_file}')
+    return interpolation.MotionEstimator(geometry)
+
+
+async def restore_buses(restored_buses: typing.List[models.BusRecord], chunk_size: int = 1000):
+    """Save buses read from log after restart by chunks, so server serves browsers and microservices meanwhile."""
+    started_at = time.perf_counter()
+    for chunk_start in range(0, len(restored_buses), chunk_size):
+        for bus in restored_buses[chunk_start:chunk_start + chunk_size]:
+            if bus.busId not in buses:  # microservice has already sent newer position
+                update_bus(bus, is_logged=False)
+        await trio.sleep(0)
+    logger.info(f'restored {len(restored_buses)} buses in {time.perf_counter() - started_at:.3f} seconds')
+
+
+async def log_buses(
+    restored_buses: typing.List[models.BusRecord],
+    flush_every_seconds: float,
+    snapshot_every_seconds: float,
+):
+    """Restore buses and then write changes to log, so snapshot of partly restored buses doesn't replace old one."""
+    await restore_buses(restored_buses)
+    await buses_log.run(buses, flush_every_seconds, snapshot_every_seconds)
+
+
+async def sync_shared_buses(sync_every_seconds: float):
+    """Copy changes of shared table, which ingest process writes, to structures of browser worker."""
+    while True:
+        changed_buses, removed_bus_ids = shared_table.read_changes()
+        for bus in changed_buses:
+            update_bus(bus)
+        for bus_id in removed_bus_ids:
+            remove_bus(bus_id)
+        await trio.sleep(sync_every_seconds)
+
+
+async def serve_browsers_on_shared_port(host: str, port: int):
+    """Serve browsers on socket with SO_REUSEPORT, kernel balances connections between browser workers."""
+    addresses = await trio.socket.getaddrinfo(host, port, type=trio.socket.SOCK_STREAM)
+    family, socket_type, proto, _, address = addresses[0]
+    sock = trio.socket.socket(family, socket_type, proto)
+    sock.setsockopt(trio.socket.SOL_SOCKET, trio.socket.SO_REUSEADDR, 1)
+    sock.setsockopt(trio.socket.SOL_SOCKET, trio.socket.SO_REUSEPORT, 1)
+    await sock.bind(address)
+    sock.listen()
+    server = trio_websocket.WebSocketServer(communicate_with_browser, [trio.SocketListener(sock)])
+    await server.run()
+
+
+async def serve_browser_worker(
+    host: str,
+    port: int,
+    sync_every_seconds: float,
+    metrics_port: int,
+    interpolation_tick: float,
+):
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(sync_shared_buses, sync_every_seconds)
+        nursery.start_soon(serve_browsers_on_shared_port, host, port)
+        if buses_motion is not None:
+            nursery.start_soon(run_interpolation, interpolation_tick)
+        if metrics_port:
+            nursery.start_soon(metrics.serve_metrics, metrics_port)
+            nursery.start_soon(metrics.monitor_event_loop_lag, event_loop_lag)
+
+
+def run_browser_worker(
+    host: str,
+    port: int,
+    shared_table_name: str,
+    sync_every_seconds: float,
+    browser_send_limits: backpressure.SendLimits,
+    history_length: int,
+    history_capacity: int,
+    metrics_port: int,
+    interpolation_tick: float,
+    routes_file: typing.Optional[str],
+    compressor: encoding.MessageCompressor,
+    verbosity: int,
+):
+    """Entry point of browser worker process."""
+    global shared_table, send_limits, buses_history, buses_motion, buses_compressor
+    logging.basicConfig(level=verbosity)
+    send_limits = browser_send_limits
+    buses_compressor = compressor
+    if history_length > 0:
+        buses_history = history.PositionHistory(history_capacity, history_length)
+    if interpolation_tick > 0:
+        buses_motion = create_motion_estimator(routes_file)
+    shared_table = shared_state.SharedBusTable.attach(shared_table_name)
+    with contextlib.suppress(KeyboardInterrupt):
+        trio.run(serve_browser_worker, host, port, sync_every_seconds, metrics_port, interpolation_tick)
+
+
+async def supervise_browser_workers(args: argparse.Namespace):
+    """Run browser worker processes and restart them if they die."""
+    # workers are spawned, because fork of process with running trio loop is unsafe
+    context = multiprocessing.get_context('spawn')
+
+    def start_worker(worker_index: int) -> multiprocessing.Process:
+        # every worker has its own metrics on next port after metrics port of ingest process
+        metrics_port = args.metrics_port and args.metrics_port + 1 + worker_index
+        worker = context.Process(
+            target=run_browser_worker,
+            args=(
+                args.host,
+                args.browser_port,
+                shared_table.name,
+                args.sync_timeout,
+                send_limits,
+                args.history_length,
+                args.history_capacity,
+                metrics_port,
+                args.interpolation_tick,
+                args.routes_file,
+                buses_compressor,
+                args.verbosity,
+            ),
+            name=f'server-browser-worker-{worker_index}',
+            daemon=True,
+        )
+        worker.start()
+        return worker
+
+    workers = [start_worker(worker_index) for worker_index in range(args.browser_workers)]
+    while True:
+        await trio.sleep(1)
+        for worker_index, worker in enumerate(workers):
+            if not worker.is_alive():
+                logger.warning(f'browser worker {worker_index} exited with code {worker.exitcode}, restart it')
+                workers[worker_index] = start_worker(worker_index)
 
 
 async def main():
+    global shared_table, buses_expiry, send_limits, buses_history, buses_log, buses_motion, buses_compressor
+    global ingest_tick
     parser = argparse.ArgumentParser(
         prog='Server of buses',
         description='Get data from bus microservice and from browsers and send data to browsers',
     )
     parser.add_argument('-host', '--host', type=str, required=True,
                         help='server address, example "127.0.0.1"')
-    parser.add_argument('-lp', '--bus_port', type=int, required=True,
-                        help='port where server listen buses ws')
+    parser.add_argument('-lp', '--bus_port', type=int, default=None,
+                        help='port where server listen buses ws, it is required if there is no upstream server')
     parser.add_argument('-sp', '--browser_port', type=int, required=True,
                         help='port where server send info')
+    parser.add_argument('-up', '--upstream', type=str, default=None,
+                        help='address of upstream server, which sends all buses to this edge server, '
+                             'example "ws://10.0.0.1:8000" (browser port of upstream), default no upstream')
+    parser.add_argument('-bw', '--browser_workers', type=int, default=0,
+                        help='number of processes which serve browsers, buses are shared with them by shared memory, '
+                             'default 0 (browsers are served by the same process)')
+    parser.add_argument('-sc', '--shared_capacity', type=int, default=200000,
+                        help='max number of buses in shared memory for browser workers, default 200000')
+    parser.add_argument('-syt', '--sync_timeout', type=float, default=0.2,
+                        help='browser workers read changes of shared buses every "sync_timeout" seconds, default 0.2')
+    parser.add_argument('-ttl', '--bus_ttl', type=float, default=60,
+                        help='remove bus if it was not updated for "bus_ttl" seconds, default 60, 0 - never remove')
+    parser.add_argument('-et', '--expiry_tick', type=float, default=1,
+                        help='look for stale buses every "expiry_tick" seconds, default 1')
+    parser.add_argument('-igt', '--ingest_tick', type=float, default=0.1,
+                        help='save buses of microservice every "ingest_tick" seconds, only the latest position '
+                             'of bus during tick is saved, default 0.1, 0 - save every message at once')
+    parser.add_argument('-si', '--send_interval', type=float, default=1,
+                        help='min seconds between messages to browser, interval grows for slow browsers, default 1')
+    parser.add_argument('-msi', '--max_send_interval', type=float, default=10,
+                        help='max seconds between messages to slow browser, slower browser is disconnected, default 10')
+    parser.add_argument('-sto', '--send_timeout', type=float, default=10,
+                        help='disconnect browser if its messages are not sent in "send_timeout" seconds, default 10')
+    parser.add_argument('-hl', '--history_length', type=int, default=0,
+                        help='number of last positions of every bus in history, for example 60, default 0 - no history')
+    parser.add_argument('-hc', '--history_capacity', type=int, default=100000,
+                        help='max number of buses in history, memory is 16 bytes per position and is allocated at '
+                             'start, default 100000 (about 92 MB with history length 60)')
+    parser.add_argument('-dd', '--data_dir', type=str, default=None,
+                        help='directory of log of buses, server restores buses from it after restart, default no log')
+    parser.add_argument('-lfi', '--log_flush_interval', type=float, default=0.5,
+                        help='write changes of buses to log every "log_flush_interval" seconds, default 0.5')
+    parser.add_argument('-ssi', '--snapshot_interval', type=float, default=10,
+                        help='write snapshot of all buses to log every "snapshot_interval" seconds, default 10')
+    parser.add_argument('-it', '--interpolation_tick', type=float, default=0,
+                        help='show estimated positions of moving buses between their reports every '
+                             '"interpolation_tick" seconds, default 0 - only reported positions')
+    parser.add_argument('-rf', '--routes_file', type=str, default=None,
+                        help='compiled routes file (see route_store.py), estimated positions of buses are kept '
+                             'on their routes, default buses move by straight lines')
+    parser.add_argument('-cl', '--compression_level', type=int, default=6, choices=range(1, 10),
+                        help='deflate level of messages to browsers which asked for compression, '
+                             'from 1 (fast) to 9 (small), default 6')
+    parser.add_argument('-cth', '--compression_threshold', type=int, default=1024,
+                        help='messages to browsers smaller than "compression_threshold" bytes are not compressed, '
+                             'default 1024')
+    parser.add_argument('-mp', '--metrics_port', type=int, default=0,
+                        help='local port of Prometheus metrics, browser workers use next ports, default 0 - no metrics')
     parser.add_argument('-v', '--verbosity', type=int, default=0, choices=range(0, 51, 10),
                         help='level of log verbosity from 0 (notset) to 50 (only critical) through 10, default 0')
 
     args = parser.parse_args()
+    if args.bus_port is None and args.upstream is None:
+        parser.error('bus port is required if there is no upstream server')
 
     logging.basicConfig(level=args.verbosity)
 
-    async with trio.open_nursery() as nursery:
-        nursery.start_soon(serve_websocket, communicate_with_browser, args.host, args.browser_port, None)
-        nursery.start_soon(serve_websocket, get_bus_updates, args.host, args.bus_port, None)
+    ingest_tick = args.ingest_tick
+    send_limits = backpressure.SendLimits(
+        min_interval=args.send_interval,
+        max_interval=args.max_send_interval,
+        send_timeout=args.send_timeout,
+    )
+    buses_compressor = encoding.MessageCompressor(args.compression_level, args.compression_threshold)
+    if args.browser_workers > 0:
+        shared_table = shared_state.SharedBusTable.create(args.shared_capacity)
+    if args.bus_ttl > 0 and args.upstream is None:  # upstream server removes stale buses for edge server
+        buses_expiry = expiry.ExpiryWheel(args.bus_ttl, args.expiry_tick)
+    if args.history_length > 0 and shared_table is None:  # history of browser workers is kept by workers
+        buses_history = history.PositionHistory(args.history_capacity, args.history_length)
+    if args.interpolation_tick > 0 and shared_table is None:  # browser workers estimate positions themselves
+        buses_motion = create_motion_estimator(args.routes_file)
+    restored_buses = []
+    if args.data_dir:
+        buses_log = bus_log.BusLog(args.data_dir)
+        started_at = time.perf_counter()
+        restored_buses = buses_log.restore()
+        logger.info(f'read {len(restored_buses)} buses from log in {time.perf_counter() - started_at:.3f} seconds')
+    try:
+        async with trio.open_nursery() as nursery:
+            if shared_table is None:
+                nursery.start_soon(serve_websocket, communicate_with_browser, args.host, args.browser_port, None)
+            else:
+                nursery.start_soon(supervise_browser_workers, args)
+            if args.bus_port is not None:
+                nursery.start_soon(serve_websocket, get_bus_updates, args.host, args.bus_port, None)
+            if args.upstream is not None:
+                nursery.start_soon(relay_upstream, args.upstream)
+            if buses_expiry is not None:
+                nursery.start_soon(run_buses_eviction)
+            if buses_motion is not None:
+                nursery.start_soon(run_interpolation, args.interpolation_tick)
+            if args.metrics_port:
+                nursery.start_soon(metrics.serve_metrics, args.metrics_port)
+                nursery.start_soon(metrics.monitor_event_loop_lag, event_loop_lag)
+            if buses_log is not None:
+                nursery.start_soon(log_buses, restored_buses, args.log_flush_interval, args.snapshot_interval)
+    finally:
+        if buses_log is not None:
+            buses_log.close()
+        if shared_table is not None:
+            shared_table.close()
 
 
 if __name__ == '__main__':
-    buses = {}
     with contextlib.suppress(KeyboardInterrupt):
         trio.run(main)
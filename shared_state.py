@@ -0,0 +1,179 @@
+import logging
+import struct
+import typing
+from multiprocessing import shared_memory
+
+import numpy
+
+import models
+
+logger = logging.getLogger(__name__)
+
+BUS_ID_SIZE = 64
+ROUTE_SIZE = 32
+
+HEADER = struct.Struct('<QQ')  # capacity, number of used slots
+SEQUENCE = struct.Struct('<Q')
+# lat, lng, sizes of utf8 bus id and route (bus id size 0 means removed bus), bus id, route
+SLOT_PAYLOAD = struct.Struct(f'<ddBB6x{BUS_ID_SIZE}s{ROUTE_SIZE}s')
+SLOT_DTYPE = numpy.dtype([
+    ('sequence', '<u8'),
+    ('lat', '<f8'),
+    ('lng', '<f8'),
+    ('bus_id_size', 'u1'),
+    ('route_size', 'u1'),
+    ('padding', 'V6'),
+    ('bus_id', f'V{BUS_ID_SIZE}'),
+    ('route', f'V{ROUTE_SIZE}'),
+])
+assert SLOT_DTYPE.itemsize == SEQUENCE.size + SLOT_PAYLOAD.size
+
+
+class SharedBusTable:
+    """
+    Table of buses in shared memory, one ingest process writes it and browser worker processes read it.
+
+    Every slot is protected by seqlock: writer makes slot sequence odd before writing and even after,
+    reader takes slot only if its sequence was even and didn't change while the slot was copied,
+    so readers never see torn positions and writer never waits for readers.
+    """
+
+    def __init__(self, memory: shared_memory.SharedMemory, is_writer: bool = False):
+        self.memory = memory
+        self.is_writer = is_writer
+        self.capacity, _ = HEADER.unpack_from(memory.buf)
+        self.slots = numpy.ndarray(self.capacity, dtype=SLOT_DTYPE, buffer=memory.buf, offset=HEADER.size)
+
+        # state of writer
+        self.bus_slots: typing.Dict[str, int] = {}
+        self.free_slots: typing.List[int] = []
+        self.sequences: typing.List[int] = []
+        # skipped buses are reported once: too long ones by id, others once till table has free slot
+        self.too_long_bus_ids: typing.Set[str] = set()
+        self.is_full = False
+
+        # state of reader
+        self.known_sequences = numpy.zeros(self.capacity, dtype=numpy.uint64)
+        self.slot_bus_ids: typing.Dict[int, str] = {}
+        self.read_bus_slots: typing.Dict[str, int] = {}
+
+    @classmethod
+    def create(cls, capacity: int) -> 'SharedBusTable':
+        memory = shared_memory.SharedMemory(create=True, size=HEADER.size + capacity * SLOT_DTYPE.itemsize)
+        HEADER.pack_into(memory.buf, 0, capacity, 0)
+        return cls(memory, is_writer=True)
+
+    @classmethod
+    def attach(cls, name: str) -> 'SharedBusTable':
+        return cls(shared_memory.SharedMemory(name=name))
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    @property
+    def used_slots_count(self) -> int:
+        return HEADER.unpack_from(self.memory.buf)[1]
+
+    def close(self) -> None:
+        del self.slots  # numpy array keeps export of buffer, memory can't be closed with it
+        self.memory.close()
+        if self.is_writer:
+            self.memory.unlink()
+
+    def _write_slot(self, slot_index: int, *payload) -> None:
+        offset = HEADER.size + slot_index * SLOT_DTYPE.itemsize
+        sequence = self.sequences[slot_index]
+        SEQUENCE.pack_into(self.memory.buf, offset, sequence + 1)
+        SLOT_PAYLOAD.pack_into(self.memory.buf, offset + SEQUENCE.size, *payload)
+        SEQUENCE.pack_into(self.memory.buf, offset, sequence + 2)
+        self.sequences[slot_index] = sequence + 2
+
+    def write(self, bus: models.BusRecord) -> bool:
+        """
+        Write bus to its slot, new bus gets free slot.
+
+        :return: bus is written, it isn't if its id or route is too long or table is full
+        """
+        encoded_bus_id = bus.busId.encode('utf8')
+        encoded_route = bus.route.encode('utf8')
+        if not encoded_bus_id or len(encoded_bus_id) > BUS_ID_SIZE or len(encoded_route) > ROUTE_SIZE:
+            if bus.busId not in self.too_long_bus_ids:
+                self.too_long_bus_ids.add(bus.busId)
+                logger.warning(f'bus {bus.busId} of route {bus.route} is too long for shared table, skip it')
+            return False
+
+        slot_index = self.bus_slots.get(bus.busId)
+        if slot_index is None:
+            if self.free_slots:
+                slot_index = self.free_slots.pop()
+            elif len(self.sequences) < self.capacity:
+                slot_index = len(self.sequences)
+                self.sequences.append(0)
+            else:
+                if not self.is_full:
+                    self.is_full = True
+                    logger.warning(
+                        f'shared table is full ({self.capacity} buses), new buses are skipped till buses are removed, '
+                        f'the first skipped bus is {bus.busId}'
+                    )
+                return False
+            self.bus_slots[bus.busId] = slot_index
+
+        self._write_slot(
+            slot_index, bus.lat, bus.lng, len(encoded_bus_id), len(encoded_route), encoded_bus_id, encoded_route,
+        )
+        if slot_index >= self.used_slots_count:
+            HEADER.pack_into(self.memory.buf, 0, self.capacity, slot_index + 1)
+        return True
+
+    def remove(self, bus_id: str) -> None:
+        """Mark slot of bus as empty, it will be reused by new bus."""
+        self.too_long_bus_ids.discard(bus_id)
+        slot_index = self.bus_slots.pop(bus_id, None)
+        if slot_index is None:
+            return
+        self._write_slot(slot_index, 0, 0, 0, 0, b'', b'')
+        self.free_slots.append(slot_index)
+        self.is_full = False
+
+    def read_changes(self) -> typing.Tuple[typing.List[models.BusRecord], typing.List[str]]:
+        """
+        Read slots changed since previous call.
+
+        Slots which are being written now are skipped, they will be read by next call.
+
+        :return: changed buses and ids of removed buses
+        """
+        used_slots_count = self.used_slots_count
+        slots = self.slots[:used_slots_count]
+        sequences = slots['sequence'].copy()
+        changed_indexes = numpy.flatnonzero(
+            (sequences != self.known_sequences[:used_slots_count]) & (sequences % 2 == 0)
+        )
+        changed_slots = slots[changed_indexes]
+        is_consistent = slots['sequence'][changed_indexes] == sequences[changed_indexes]
+        changed_indexes = changed_indexes[is_consistent]
+        changed_slots = changed_slots[is_consistent]
+        self.known_sequences[changed_indexes] = sequences[changed_indexes]
+
+        changed_buses = []
+        removed_bus_ids = []
+        for slot_index, (_, lat, lng, bus_id_size, route_size, _, bus_id, route) in zip(
+            changed_indexes.tolist(),
+            changed_slots.tolist(),
+        ):
+            old_bus_id = self.slot_bus_ids.pop(slot_index, None)
+            bus_id = bus_id[:bus_id_size].decode('utf8') if bus_id_size else None
+            # slot of removed bus is empty or reused now, but the bus could be added again to other slot
+            if old_bus_id is not None and old_bus_id != bus_id and self.read_bus_slots.get(old_bus_id) == slot_index:
+                del self.read_bus_slots[old_bus_id]
+                removed_bus_ids.append(old_bus_id)
+            if bus_id is None:
+                continue
+
+            self.slot_bus_ids[slot_index] = bus_id
+            self.read_bus_slots[bus_id] = slot_index
+            changed_buses.append(models.BusRecord(bus_id, route[:route_size].decode('utf8'), lat, lng))
+        # bus could be removed and added again to slot which is read after its old slot
+        return changed_buses, [bus_id for bus_id in removed_bus_ids if bus_id not in self.read_bus_slots]
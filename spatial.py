@@ -0,0 +1,222 @@
+import math
+import typing
+
+import models
+
+Cell = typing.Tuple[int, int]
+
+
+class BusGrid:
+    """
+    Uniform grid spatial index of buses.
+
+    Every bus lives in one cell of `cell_size` x `cell_size` degrees, so window query touches only cells
+    which overlap the window instead of all buses.
+    """
+
+    def __init__(self, cell_size: float = 0.01):
+        """
+        Create empty grid.
+
+        :param cell_size: size of cell side in degrees, default is about 1 km in Moscow
+        """
+        self.cell_size = cell_size
+        self.cells: typing.Dict[Cell, typing.Dict[str, models.BusRecord]] = {}
+        self.bus_cells: typing.Dict[str, Cell] = {}
+
+    def __len__(self) -> int:
+        return len(self.bus_cells)
+
+    def get_cell(self, lat: float, lng: float) -> Cell:
+        """Get cell which contains point."""
+        return math.floor(lat / self.cell_size), math.floor(lng / self.cell_size)
+
+    def update(self, bus: models.BusRecord) -> None:
+        """Add new bus or move existing bus to the cell of its new position."""
+        cell = self.get_cell(bus.lat, bus.lng)
+        old_cell = self.bus_cells.get(bus.busId)
+        if old_cell is not None and old_cell != cell:
+            self._discard(old_cell, bus.busId)
+        self.cells.setdefault(cell, {})[bus.busId] = bus
+        self.bus_cells[bus.busId] = cell
+
+    def remove(self, bus_id: str) -> None:
+        """Remove bus from grid if it exists."""
+        cell = self.bus_cells.pop(bus_id, None)
+        if cell is not None:
+            self._discard(cell, bus_id)
+
+    def clear(self) -> None:
+        self.cells.clear()
+        self.bus_cells.clear()
+
+    def _discard(self, cell: Cell, bus_id: str) -> None:
+        cell_buses = self.cells[cell]
+        del cell_buses[bus_id]
+        if not cell_buses:
+            del self.cells[cell]  # don't keep empty cells, query iterates over cells
+
+    def query_cells(
+        self,
+        bounds: models.WindowBounds,
+    ) -> typing.Iterator[typing.Tuple[Cell, typing.Dict[str, models.BusRecord], bool]]:
+        """
+        Get not empty cells which overlap window bounds.
+
+        :return: tuples (cell, buses of cell by id, cell is completely inside window)
+        """
+        south_row, west_column = self.get_cell(bounds.south_lat, bounds.west_lng)
+        north_row, east_column = self.get_cell(bounds.north_lat, bounds.east_lng)
+        if south_row > north_row or west_column > east_column:
+            return
+
+        window_cells_count = (north_row - south_row + 1) * (east_column - west_column + 1)
+        if window_cells_count > len(self.cells):
+            # big window (e.g. all world), cheaper to check every not empty cell
+            cells = [
+                cell for cell in self.cells
+                if south_row <= cell[0] <= north_row and west_column <= cell[1] <= east_column
+            ]
+        else:
+            cells = [
+                (row, column)
+                for row in range(south_row, north_row + 1)
+                for column in range(west_column, east_column + 1)
+                if (row, column) in self.cells
+            ]
+
+        for row, column in cells:
+            is_inside = south_row < row < north_row and west_column < column < east_column
+            yield (row, column), self.cells[(row, column)], is_inside
+
+    def query(self, bounds: models.WindowBounds) -> typing.Iterator[models.BusRecord]:
+        """
+        Get buses inside window bounds.
+
+        Buses from cells which are completely inside window are returned without checks,
+        only buses from border cells are checked by `bounds.is_inside`.
+        """
+        for _, cell_buses, is_inside in self.query_cells(bounds):
+            if is_inside:
+                yield from cell_buses.values()
+            else:
+                yield from (bus for bus in cell_buses.values() if bounds.is_inside(bus))
+
+
+class Cluster:
+    """Number of buses in cell and sums of their coordinates, which give centroid of cell buses."""
+
+    __slots__ = ('count', 'lat_sum', 'lng_sum')
+
+    def __init__(self):
+        self.count = 0
+        self.lat_sum = 0.0
+        self.lng_sum = 0.0
+
+    @property
+    def lat(self) -> float:
+        return self.lat_sum / self.count
+
+    @property
+    def lng(self) -> float:
+        return self.lng_sum / self.count
+
+
+class ClusterGrid:
+    """
+    Hierarchical grid of bus clusters for zoomed out windows.
+
+    Cell of every next level is `factor` times bigger than cell of previous level. Clusters of all levels
+    are updated with every bus, so clusters of window are read from ready cells of level suitable for window size
+    and their number doesn't depend on number of buses in window.
+    """
+
+    def __init__(self, cell_size: float = 0.04, factor: int = 4, levels_number: int = 6, max_window_cells: int = 400):
+        """
+        Create empty grid.
+
+        :param cell_size: size of cell side of the first level in degrees
+        :param factor: integer ratio of cell sizes of neighbour levels, so cells of levels are nested
+        :param levels_number: number of levels, default levels are from about 4 km to whole world in few cells
+        :param max_window_cells: level for window is the smallest one with not more cells in window
+        """
+        self.cell_sizes = [cell_size * factor ** level for level in range(levels_number)]
+        self.levels: typing.List[typing.Dict[Cell, Cluster]] = [{} for _ in range(levels_number)]
+        self.bus_positions: typing.Dict[str, typing.Tuple[float, float]] = {}
+        self.max_window_cells = max_window_cells
+
+    def __len__(self) -> int:
+        return len(self.bus_positions)
+
+    def update(self, bus: models.BusRecord) -> None:
+        """Add new bus or move existing bus in clusters of all levels."""
+        old_position = self.bus_positions.get(bus.busId)
+        for cell_size, clusters in zip(self.cell_sizes, self.levels):
+            cell = math.floor(bus.lat / cell_size), math.floor(bus.lng / cell_size)
+            if old_position is not None:
+                old_lat, old_lng = old_position
+                old_cell = math.floor(old_lat / cell_size), math.floor(old_lng / cell_size)
+                if old_cell == cell:
+                    cluster = clusters[cell]
+                    cluster.lat_sum += bus.lat - old_lat
+                    cluster.lng_sum += bus.lng - old_lng
+                    continue
+                self._discard(clusters, old_cell, old_lat, old_lng)
+            cluster = clusters.get(cell)
+            if cluster is None:
+                cluster = clusters[cell] = Cluster()
+            cluster.count += 1
+            cluster.lat_sum += bus.lat
+            cluster.lng_sum += bus.lng
+        self.bus_positions[bus.busId] = bus.lat, bus.lng
+
+    def remove(self, bus_id: str) -> None:
+        """Remove bus from clusters if it exists."""
+        position = self.bus_positions.pop(bus_id, None)
+        if position is None:
+            return
+        lat, lng = position
+        for cell_size, clusters in zip(self.cell_sizes, self.levels):
+            self._discard(clusters, (math.floor(lat / cell_size), math.floor(lng / cell_size)), lat, lng)
+
+    def clear(self) -> None:
+        for clusters in self.levels:
+            clusters.clear()
+        self.bus_positions.clear()
+
+    @staticmethod
+    def _discard(clusters: typing.Dict[Cell, Cluster], cell: Cell, lat: float, lng: float) -> None:
+        cluster = clusters[cell]
+        cluster.count -= 1
+        if not cluster.count:
+            del clusters[cell]  # also drops rounding errors of sums
+            return
+        cluster.lat_sum -= lat
+        cluster.lng_sum -= lng
+
+    def choose_level(self, bounds: models.WindowBounds) -> int:
+        """Get the smallest level with not more than max_window_cells cells in window."""
+        for level, cell_size in enumerate(self.cell_sizes):
+            rows_count = math.floor(bounds.north_lat / cell_size) - math.floor(bounds.south_lat / cell_size) + 1
+            columns_count = math.floor(bounds.east_lng / cell_size) - math.floor(bounds.west_lng / cell_size) + 1
+            if rows_count * columns_count <= self.max_window_cells:
+                return level
+        return len(self.levels) - 1
+
+    def query(self, bounds: models.WindowBounds, level: int) -> typing.List[Cluster]:
+        """Get clusters of level whose cells overlap window bounds, border clusters may have buses out of window."""
+        cell_size = self.cell_sizes[level]
+        clusters = self.levels[level]
+        south_row, north_row = math.floor(bounds.south_lat / cell_size), math.floor(bounds.north_lat / cell_size)
+        west_column, east_column = math.floor(bounds.west_lng / cell_size), math.floor(bounds.east_lng / cell_size)
+        if (north_row - south_row + 1) * (east_column - west_column + 1) > len(clusters):
+            return [
+                cluster for (row, column), cluster in clusters.items()
+                if south_row <= row <= north_row and west_column <= column <= east_column
+            ]
+        return [
+            clusters[(row, column)]
+            for row in range(south_row, north_row + 1)
+            for column in range(west_column, east_column + 1)
+            if (row, column) in clusters
+        ]
@@ -0,0 +1,15 @@
+import pytest
+
+import server
+
+
+@pytest.fixture
+def server_buses(monkeypatch) -> dict:
+    """Empty buses of server for one test, global buses of server are restored after it even if it fails."""
+    buses = {}
+    monkeypatch.setattr(server, 'buses', buses)
+    monkeypatch.setattr(server, 'buses_grid', server.spatial.BusGrid())
+    monkeypatch.setattr(server, 'buses_clusters', server.spatial.ClusterGrid())
+    monkeypatch.setattr(server, 'buses_routes', server.route_index.RouteIndex())
+    monkeypatch.setattr(server, 'buses_encoder', server.encoding.BusesEncoder(server.buses_grid, server.buses_routes))
+    return buses
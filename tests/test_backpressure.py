@@ -0,0 +1,47 @@
+import pytest
+
+from backpressure import SendLimits, SendRate
+
+
+def test_fast_browser_gets_min_interval():
+    send_rate = SendRate(SendLimits(min_interval=1, max_interval=10))
+    for _ in range(10):
+        send_rate.on_sent(seconds=0.001, size=100000)
+    assert send_rate.interval == 1
+    assert not send_rate.is_slow
+
+
+def test_interval_grows_with_send_time():
+    send_rate = SendRate(SendLimits(min_interval=1, max_interval=10, max_send_share=0.5))
+    send_rate.on_sent(seconds=2, size=100000)
+    assert send_rate.interval == pytest.approx(4)
+    assert send_rate.throughput == pytest.approx(50000)
+    assert not send_rate.is_slow
+
+    for _ in range(20):
+        send_rate.on_sent(seconds=0.01, size=100000)
+    assert send_rate.interval == 1
+
+
+def test_stalled_send_is_not_hidden_by_fast_ones():
+    send_rate = SendRate(SendLimits(min_interval=1, max_interval=10, max_send_share=0.5))
+    for _ in range(10):
+        send_rate.on_sent(seconds=0.001, size=100000)
+    send_rate.on_sent(seconds=5, size=100000)
+    assert send_rate.interval > 2
+
+
+def test_browser_is_slow_after_several_slow_sends():
+    send_rate = SendRate(SendLimits(min_interval=1, max_interval=10, slow_sends_limit=3))
+    for _ in range(2):
+        send_rate.on_sent(seconds=8, size=1000)
+    assert send_rate.interval == 10
+    assert not send_rate.is_slow
+    send_rate.on_sent(seconds=8, size=1000)
+    assert send_rate.is_slow
+
+
+def test_empty_send_is_ignored():
+    send_rate = SendRate(SendLimits())
+    send_rate.on_sent(seconds=1, size=0)
+    assert send_rate.throughput is None
@@ -1,11 +1,14 @@
 import json
 
 import pytest
-from trio_websocket import WebSocketConnection
+import trio
+from trio_websocket import ConnectionClosed, WebSocketConnection
 from unittest.mock import AsyncMock
 
-from server import listen_browser
-from models import WindowBounds
+import server
+from backpressure import SendLimits
+from server import listen_browser, talk_to_browser
+from models import BrowserOptions, RoutesFilter, WindowBounds
 
 
 @pytest.fixture
@@ -114,3 +117,194 @@ async def test_listen_browser_incomplete_data(ws):
     assert isinstance(decoded_message['errors'], list)
     assert len(decoded_message['errors']) == 1
     assert len([error for error in decoded_message['errors'] if 'east_lng' in error['loc']]) == 1
+
+
+@pytest.mark.trio
+async def test_listen_browser_set_options(ws):
+    test_message = json.dumps({
+        'msgType': 'setOptions',
+        'data': {
+            'deltas': True,
+        },
+    })
+    ws.get_message.side_effect = [
+        test_message,
+        'break',  # without it with while true in listen_browser tests won't be success
+    ]
+    bounds = WindowBounds(south_lat=-90, north_lat=90, west_lng=-180, east_lng=180)
+    options = BrowserOptions()
+    await listen_browser(ws, bounds, False, options)
+
+    assert ws.send_message.call_count == 0
+    assert options.deltas is True
+    assert bounds.south_lat == -90
+
+
+@pytest.mark.trio
+async def test_listen_browser_keeps_options_which_are_not_set(ws):
+    ws.get_message.side_effect = [
+        json.dumps({'msgType': 'setOptions', 'data': {'binary': True, 'compression': True, 'max_buses': 100}}),
+        json.dumps({'msgType': 'setOptions', 'data': {'deltas': True}}),
+        'break',
+    ]
+    bounds = WindowBounds(south_lat=-90, north_lat=90, west_lng=-180, east_lng=180)
+    options = BrowserOptions()
+    await listen_browser(ws, bounds, False, options)
+
+    assert ws.send_message.call_count == 0
+    assert options == BrowserOptions(deltas=True, binary=True, compression=True, max_buses=100)
+
+
+@pytest.mark.trio
+async def test_listen_browser_not_object(ws):
+    ws.get_message.side_effect = ['[1, 2]', 'break']
+    bounds = WindowBounds(south_lat=-90, north_lat=90, west_lng=-180, east_lng=180)
+    await listen_browser(ws, bounds, False)
+
+    assert ws.send_message.call_count == 1
+    decoded_message = json.loads(ws.send_message.call_args.args[0])
+    assert decoded_message['msgType'] == 'Errors'
+    assert len(decoded_message['errors']) == 1
+
+
+@pytest.mark.trio
+async def test_talk_to_browser_disconnects_stalled_browser(ws, autojump_clock, monkeypatch):
+    monkeypatch.setattr(server, 'send_limits', SendLimits(send_timeout=5))
+
+    async def never_sent(message):
+        await trio.sleep_forever()
+
+    ws.send_message.side_effect = never_sent
+    bounds = WindowBounds(south_lat=-90, north_lat=90, west_lng=-180, east_lng=180)
+    await talk_to_browser(ws, bounds, BrowserOptions())
+
+    assert trio.current_time() >= 5
+    ws.aclose.assert_awaited_once()
+
+
+@pytest.mark.trio
+async def test_send_messages_doesnt_count_compression_as_sending(ws, autojump_clock, monkeypatch):
+    class SlowCompressor:
+        def compress(self, message):
+            autojump_clock.jump(5)  # server is loaded
+            return message
+
+    async def send_message(message):
+        await trio.sleep(1)
+
+    monkeypatch.setattr(server, 'buses_compressor', SlowCompressor())
+    ws.send_message.side_effect = send_message
+    assert await server.send_messages(ws, ['first', 'second'], compression=True) == (11, 2)
+
+
+@pytest.mark.trio
+async def test_talk_to_browser_slows_down_for_slow_browser(ws, autojump_clock, monkeypatch):
+    monkeypatch.setattr(server, 'send_limits', SendLimits(min_interval=1, max_interval=10, max_send_share=0.5))
+    sent_at = []
+
+    async def slow_send(message):
+        sent_at.append(trio.current_time())
+        if len(sent_at) == 4:
+            raise ConnectionClosed(None)
+        await trio.sleep(2)
+
+    ws.send_message.side_effect = slow_send
+    bounds = WindowBounds(south_lat=-90, north_lat=90, west_lng=-180, east_lng=180)
+    await talk_to_browser(ws, bounds, BrowserOptions())
+
+    intervals = [next_time - time for time, next_time in zip(sent_at, sent_at[1:])]
+    assert all(interval > 4 for interval in intervals)
+    ws.aclose.assert_not_awaited()
+
+
+@pytest.mark.trio
+async def test_talk_to_browser_sends_clusters_for_crowded_window(ws, autojump_clock, server_buses):
+    for bus_index in range(10):
+        server.update_bus(server.models.BusRecord(str(bus_index), 'A', 55.75 + bus_index / 1000, 37.6))
+
+    ws.send_message.side_effect = [None, ConnectionClosed(None)]
+    bounds = WindowBounds(south_lat=55.5, north_lat=56, west_lng=37.4, east_lng=37.9)
+    await talk_to_browser(ws, bounds, BrowserOptions(deltas=True, max_buses=5))
+
+    decoded_message = json.loads(ws.send_message.call_args_list[0].args[0])
+    assert decoded_message['msgType'] == 'Clusters'
+    assert decoded_message['cellSize'] == 0.04
+    assert decoded_message['clusters'] == [{'lat': 55.7545, 'lng': 37.6, 'count': 10}]
+
+    ws.send_message.side_effect = [None, ConnectionClosed(None)]
+    await talk_to_browser(ws, bounds, BrowserOptions(deltas=True, max_buses=10))
+    assert json.loads(ws.send_message.call_args.args[0])['msgType'] == 'BusesDelta'
+
+
+@pytest.mark.trio
+async def test_listen_browser_subscribe_routes(ws):
+    ws.get_message.side_effect = [json.dumps({'msgType': 'subscribeRoutes', 'data': {'routes': ['120']}}), 'break']
+    bounds = WindowBounds(south_lat=-90, north_lat=90, west_lng=-180, east_lng=180)
+    routes_filter = RoutesFilter()
+    await listen_browser(ws, bounds, False, BrowserOptions(), routes_filter)
+
+    assert ws.send_message.call_count == 0
+    assert routes_filter.routes == {'120'}
+
+
+@pytest.mark.trio
+async def test_talk_to_browser_sends_buses_of_subscribed_routes(ws, autojump_clock, server_buses):
+    server.update_bus(server.models.BusRecord('subscribed-1', '120', 55.75, 37.6))
+    server.update_bus(server.models.BusRecord('subscribed-2', '120', 10, 10))
+    server.update_bus(server.models.BusRecord('subscribed-3', '5', 55.75, 37.6))
+
+    bounds = WindowBounds(south_lat=55, north_lat=56, west_lng=37, east_lng=38)
+    for options in [BrowserOptions(), BrowserOptions(deltas=True)]:
+        ws.send_message.side_effect = [None, ConnectionClosed(None)]
+        await talk_to_browser(ws, bounds, options, RoutesFilter(routes={'120'}))
+        decoded_message = json.loads(ws.send_message.call_args_list[-2].args[0])
+        assert [bus['busId'] for bus in decoded_message['buses']] == ['subscribed-1']
+
+
+@pytest.mark.trio
+async def test_talk_to_browser_compresses_big_messages(ws, autojump_clock, monkeypatch, server_buses):
+    monkeypatch.setattr(server, 'buses_compressor', server.encoding.MessageCompressor(threshold=100))
+    for bus_index in range(10):
+        server.update_bus(server.models.BusRecord(f'compressed-{bus_index}', 'A', 55.75, 37.6 + bus_index / 1000))
+
+    bounds = WindowBounds(south_lat=55, north_lat=56, west_lng=37, east_lng=38)
+    ws.send_message.side_effect = [None, ConnectionClosed(None)]
+    await talk_to_browser(ws, bounds, BrowserOptions(compression=True))
+    frame = ws.send_message.call_args_list[-2].args[0]
+    decoded_message = json.loads(server.wire.unpack_deflate_frame(frame))
+    assert decoded_message['msgType'] == 'Buses'
+    assert len(frame) < len(json.dumps(decoded_message))
+
+
+@pytest.mark.trio
+async def test_listen_browser_request_track(ws, monkeypatch):
+    monkeypatch.setattr(server, 'buses_history', server.history.PositionHistory(buses_capacity=10))
+    server.buses_history.append(server.models.BusRecord('tracked', 'A', 55.75, 37.6), 1000)
+    ws.get_message.side_effect = [json.dumps({'msgType': 'requestTrack', 'data': {'busId': 'tracked'}}), 'break']
+    bounds = WindowBounds(south_lat=-90, north_lat=90, west_lng=-180, east_lng=180)
+    await listen_browser(ws, bounds, False)
+
+    assert json.loads(ws.send_message.call_args.args[0]) == {
+        'msgType': 'Track',
+        'busId': 'tracked',
+        'track': [{'timestamp': 1000, 'lat': 55.75, 'lng': 37.6}],
+    }
+
+
+@pytest.mark.trio
+async def test_talk_to_browser_sends_replay(ws, autojump_clock, monkeypatch):
+    monkeypatch.setattr(server, 'buses_history', server.history.PositionHistory(buses_capacity=10))
+    now = server.time.time()
+    server.buses_history.append(server.models.BusRecord('replayed', 'A', 55.75, 37.6), now - 100)
+    server.buses_history.append(server.models.BusRecord('replayed', 'A', 55.76, 37.6), now - 50)
+    replay = server.history.Replay()
+    replay.start(since=now - 90, speed=1, now=now)
+
+    ws.send_message.side_effect = [None, ConnectionClosed(None)]
+    bounds = WindowBounds(south_lat=-90, north_lat=90, west_lng=-180, east_lng=180)
+    await talk_to_browser(ws, bounds, BrowserOptions(deltas=True), RoutesFilter(), replay)
+
+    decoded_message = json.loads(ws.send_message.call_args_list[0].args[0])
+    assert decoded_message['msgType'] == 'Buses'
+    assert decoded_message['replayTime'] == pytest.approx(now - 90, abs=1)
+    assert decoded_message['buses'] == [{'busId': 'replayed', 'route': 'A', 'lat': 55.75, 'lng': 37.6}]
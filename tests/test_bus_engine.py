@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+from bus_engine import BusFleet, RouteTable
+from fake_bus import get_bus_info
+from wire import unpack_buses_frame
+
+
+@pytest.fixture
+def routes() -> list:
+    return [
+        {'name': '120', 'coordinates': [[55.7 + index / 1000, 37.6 + index / 1000] for index in range(7)]},
+        {'name': '670к', 'coordinates': [[55.8 - index / 1000, 37.5 - index / 1000] for index in range(3)]},
+    ]
+
+
+@pytest.fixture
+def fleet(routes) -> BusFleet:
+    buses = [
+        ('bus-1', '120', 0),
+        ('bus-2', '670к', 5),
+        ('bus-3', '120', 100),
+    ]
+    return BusFleet(RouteTable(routes), buses)
+
+
+@pytest.mark.parametrize('timestamp', [0, 1.5, 1681000000.3])
+@pytest.mark.parametrize('sleep', [1, 3])
+def test_fleet_buses_same_as_get_bus_info(routes, fleet, timestamp, sleep, monkeypatch):
+    monkeypatch.setattr('time.time', lambda: timestamp)
+    routes_by_name = {route['name']: route for route in routes}
+    expected_buses = [
+        get_bus_info('bus-1', routes_by_name['120'], 0, sleep),
+        get_bus_info('bus-2', routes_by_name['670к'], 5, sleep),
+        get_bus_info('bus-3', routes_by_name['120'], 100, sleep),
+    ]
+    assert fleet.get_buses(timestamp, sleep) == expected_buses
+
+
+def test_fleet_pack_frame(fleet):
+    dictionary = json.loads(fleet.build_dictionary_message())
+    assert dictionary['buses'] == [[0, 'bus-1'], [1, 'bus-2'], [2, 'bus-3']]
+    assert dictionary['routes'] == [[0, '120'], [1, '670к']]
+
+    records = list(unpack_buses_frame(fleet.pack_frame(10, 1)))
+    buses = fleet.get_buses(10, 1)
+    assert [(bus_index, route_index) for bus_index, route_index, _, _ in records] == [(0, 0), (1, 1), (2, 0)]
+    for (_, _, lat, lng), bus in zip(records, buses):
+        assert lat == pytest.approx(bus['lat'], abs=1e-6)
+        assert lng == pytest.approx(bus['lng'], abs=1e-6)
@@ -0,0 +1,69 @@
+import pytest
+import trio
+
+from bus_log import BusLog, pack_batch, unpack_batches
+from models import BusRecord
+
+
+def test_batch_roundtrip():
+    data = pack_batch([BusRecord('1', 'А', 55.75, 37.61), BusRecord('2', 'B', -1.5, 2.25)], ['3'])
+    assert list(unpack_batches(data)) == [(['1', '2'], ['А', 'B'], [55.75, -1.5], [37.61, 2.25], ['3'])]
+
+
+def test_torn_batch_is_skipped():
+    data = pack_batch([BusRecord('1', 'A', 1, 1)]) + pack_batch([BusRecord('2', 'A', 2, 2)])
+    assert len(list(unpack_batches(data[:-1]))) == 1
+
+    broken_data = bytearray(data)
+    broken_data[-1] ^= 0xFF
+    assert len(list(unpack_batches(bytes(broken_data)))) == 1
+
+
+def test_restore_snapshot_and_tail(tmp_path):
+    log = BusLog(tmp_path)
+    log.write_snapshot({}, [BusRecord('1', 'A', 1, 1), BusRecord('2', 'A', 2, 2)])
+    log.append(BusRecord('1', 'A', 1.5, 1.5))
+    log.append(BusRecord('3', 'B', 3, 3))
+    log.remove('2')
+    log.write(log.take_pending())
+    log.close()
+    with open(tmp_path / 'segment-0000000002.log', 'ab') as segment_file:
+        segment_file.write(pack_batch([BusRecord('4', 'B', 4, 4)])[:-3])  # crash in the middle of write
+
+    restored_log = BusLog(tmp_path)
+    assert sorted(restored_log.restore(), key=lambda bus: bus.busId) == [
+        BusRecord('1', 'A', 1.5, 1.5),
+        BusRecord('3', 'B', 3, 3),
+    ]
+    assert restored_log.tail_buses_count == 3
+
+
+def test_snapshot_deletes_older_files(tmp_path):
+    log = BusLog(tmp_path)
+    log.write({'1': BusRecord('1', 'A', 1, 1)})
+    log.write_snapshot({'2': BusRecord('2', 'A', 2, 2)}, [BusRecord('1', 'A', 1, 1), BusRecord('2', 'A', 2, 2)])
+    log.write({'1': None})
+    log.write_snapshot({}, [BusRecord('2', 'A', 2, 2)])
+    log.close()
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['snapshot-0000000003.bin']
+    assert BusLog(tmp_path).restore() == [BusRecord('2', 'A', 2, 2)]
+
+
+async def wait_files(directory, names: list, timeout: float = 5) -> None:
+    with trio.fail_after(timeout):
+        while sorted(path.name for path in directory.iterdir()) != names:
+            await trio.sleep(0.01)
+
+
+@pytest.mark.trio
+async def test_run_writes_batches_and_snapshots(tmp_path):
+    log = BusLog(tmp_path)
+    buses = {'1': BusRecord('1', 'A', 1, 1)}
+    log.append(buses['1'])
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(log.run, buses, 0.05, 1)  # disk is written in thread, so clock is real
+        await wait_files(tmp_path, ['segment-0000000001.log'])
+        await wait_files(tmp_path, ['snapshot-0000000002.bin'])
+        nursery.cancel_scope.cancel()
+    assert BusLog(tmp_path).restore() == [BusRecord('1', 'A', 1, 1)]
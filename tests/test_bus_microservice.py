@@ -1,10 +1,16 @@
 import json
 
 import pytest
+import trio
 from unittest.mock import AsyncMock
 
+import server
+import wire
 from server import get_bus_updates
 
+# every test gets empty buses of server, so buses of failed test don't leak to next tests
+pytestmark = pytest.mark.usefixtures('server_buses')
+
 
 @pytest.fixture
 def ws_request():
@@ -97,3 +103,155 @@ async def test_get_bus_updates_incomplete_data(ws_request):
     assert isinstance(decoded_message['errors'], list)
     assert len(decoded_message['errors']) == 1
     assert len([error for error in decoded_message['errors'] if 'route' in error['loc']]) == 1
+
+
+@pytest.mark.trio
+async def test_get_bus_updates_binary(ws_request):
+    frame_writer = wire.FrameWriter()
+    messages = frame_writer.encode([{'busId': 'binary-1', 'route': 'A', 'lat': 55.75, 'lng': 37.6}])
+    unknown_index_frame = wire.pack_buses_frame([wire.pack_bus_record(5, 0, 55, 37)])
+    ws_request.accept.return_value.get_message.side_effect = [*messages, unknown_index_frame, 'break']
+    await get_bus_updates(ws_request, False)
+
+    assert server.buses['binary-1'].route == 'A'
+    assert server.buses['binary-1'].lat == 55.75
+    assert ws_request.accept.return_value.send_message.call_count == 1
+    decoded_message = json.loads(ws_request.accept.return_value.send_message.call_args.args[0])
+    assert decoded_message['msgType'] == 'Errors'
+    assert decoded_message['errors'] == ['unknown bus index 5 or route index 0']
+
+
+@pytest.mark.trio
+async def test_get_bus_updates_batch(ws_request):
+    test_message = json.dumps([
+        {'busId': 'batch-1', 'lat': 1, 'lng': 2, 'route': 'A'},
+        {'busId': 'batch-2', 'lat': -100, 'lng': 2, 'route': 'B'},
+        'wrong',
+        {'busId': 'batch-3', 'lat': 3, 'lng': 4, 'route': 'C'},
+    ])
+    ws_request.accept.return_value.get_message.side_effect = [test_message, 'break']
+    await get_bus_updates(ws_request, False)
+
+    assert server.buses['batch-1'].lat == 1
+    assert server.buses['batch-3'].route == 'C'
+    assert 'batch-2' not in server.buses
+    assert ws_request.accept.return_value.send_message.call_count == 1
+    decoded_message = json.loads(ws_request.accept.return_value.send_message.call_args.args[0])
+    assert decoded_message['msgType'] == 'Errors'
+    assert [error['loc'] for error in decoded_message['errors']] == [[1, 'lat'], [2]]
+
+
+@pytest.mark.trio
+async def test_get_bus_updates_replies_to_every_wrong_message_of_tick(ws_request, monkeypatch):
+    monkeypatch.setattr(server, 'ingest_tick', 1)
+    ws_request.accept.return_value.get_message.side_effect = [
+        json.dumps({'busId': 'replied-1', 'lat': 100, 'lng': 2, 'route': 'A'}),
+        json.dumps({'busId': 'replied-1', 'lat': 1, 'lng': 2, 'route': 'A'}),
+        'invalid json',
+        'break',
+    ]
+    await get_bus_updates(ws_request, False)
+
+    assert server.buses['replied-1'].lat == 1
+    sent_messages = [call.args[0] for call in ws_request.accept.return_value.send_message.call_args_list]
+    assert [json.loads(message)['msgType'] for message in sent_messages] == ['Errors', 'Errors']
+    assert json.loads(sent_messages[0])['errors'][0]['loc'] == ['lat']
+
+
+@pytest.mark.trio
+async def test_get_bus_updates_commits_latest_positions_every_tick(ws_request, monkeypatch, autojump_clock):
+    monkeypatch.setattr(server, 'ingest_tick', 1)
+    superseded_count = server.superseded_buses.value
+    ws = ws_request.accept.return_value
+
+    async def get_message():
+        if ws.get_message.call_count <= 3:
+            return json.dumps({'busId': 'ticked-1', 'lat': 1, 'lng': ws.get_message.call_count, 'route': 'A'})
+        await trio.sleep(1.5)
+        assert server.buses['ticked-1'].lng == 3
+        return 'break'
+
+    ws.get_message.side_effect = get_message
+    await get_bus_updates(ws_request, False)
+
+    assert server.superseded_buses.value == superseded_count + 2
+
+
+def test_evict_stale_buses(monkeypatch):
+    monkeypatch.setattr(server, 'buses_expiry', server.expiry.ExpiryWheel(ttl=10))
+    monkeypatch.setattr(server.time, 'monotonic', lambda: 1000)
+    server.update_bus(server.models.BusRecord('stale-1', 'A', 1, 2))
+    server.update_bus(server.models.BusRecord('stale-2', 'A', 1, 2))
+    monkeypatch.setattr(server.time, 'monotonic', lambda: 1005)
+    server.update_bus(server.models.BusRecord('stale-2', 'A', 1, 3))
+    assert server.evict_stale_buses() == 0
+
+    monkeypatch.setattr(server.time, 'monotonic', lambda: 1011)
+    assert server.evict_stale_buses() == 1
+    assert 'stale-1' not in server.buses
+    assert 'stale-1' not in server.buses_grid.bus_cells
+    assert server.buses['stale-2'].lng == 3
+    server.remove_bus('stale-2')
+    assert len(server.buses_expiry) == 0  # removed bus is discarded from expiry
+
+
+@pytest.mark.trio
+async def test_get_bus_updates_metrics(ws_request):
+    ingested_buses_count = server.ingested_buses.value
+    bus_errors_count = server.bus_errors.value
+    ws_request.accept.return_value.get_message.side_effect = [
+        json.dumps([{'busId': 'metrics-1', 'lat': 1, 'lng': 2, 'route': 'A'}, {'busId': 'metrics-2'}]),
+        'break',
+    ]
+    await get_bus_updates(ws_request, False)
+
+    assert server.ingested_buses.value == ingested_buses_count + 1
+    assert server.bus_errors.value == bus_errors_count + 3
+
+
+@pytest.mark.trio
+async def test_restore_buses_keeps_newer_positions(monkeypatch, tmp_path):
+    log = server.bus_log.BusLog(tmp_path)
+    monkeypatch.setattr(server, 'buses_log', log)
+    server.update_bus(server.models.BusRecord('restored-1', 'A', 1, 3))
+    await server.restore_buses([
+        server.models.BusRecord('restored-1', 'A', 1, 2),
+        server.models.BusRecord('restored-2', 'A', 1, 2),
+    ], chunk_size=1)
+
+    assert server.buses['restored-1'].lng == 3
+    assert server.buses['restored-2'].lng == 2
+    assert set(log.pending) == {'restored-1'}  # restored buses are already in log
+
+
+@pytest.mark.trio
+async def test_run_interpolation_shows_estimated_positions(monkeypatch, autojump_clock):
+    monkeypatch.setattr(server, 'buses_motion', server.interpolation.MotionEstimator())
+    monkeypatch.setattr(server.time, 'monotonic', lambda: 1000)
+    server.update_bus(server.models.BusRecord('moving-1', 'A', 55, 37))
+    monkeypatch.setattr(server.time, 'monotonic', lambda: 1001)
+    server.update_bus(server.models.BusRecord('moving-1', 'A', 55, 37.001))
+    monkeypatch.setattr(server.time, 'monotonic', lambda: 1002)
+    with trio.move_on_after(1.5):
+        await server.run_interpolation(1)
+
+    assert server.buses['moving-1'].lng == 37.001  # log and edge servers get reported position
+    assert server.buses_grid.cells[server.buses_grid.get_cell(55, 37.002)]['moving-1'].lng == 37.002
+    assert server.buses_motion.motions['moving-1'].bus.lng == 37.001
+
+
+def test_ingest_process_writes_buses_only_to_shared_table(monkeypatch):
+    table = server.shared_state.SharedBusTable.create(capacity=10)
+    reader = server.shared_state.SharedBusTable.attach(table.name)
+    try:
+        monkeypatch.setattr(server, 'shared_table', table)
+        server.update_bus(server.models.BusRecord('shared-1', 'A', 1, 2))
+
+        assert 'shared-1' in server.buses
+        assert 'shared-1' not in server.buses_grid.bus_cells
+        assert reader.read_changes() == ([server.models.BusRecord('shared-1', 'A', 1, 2)], [])
+        server.remove_bus('shared-1')
+        assert reader.read_changes() == ([], ['shared-1'])
+    finally:
+        reader.close()
+        table.close()
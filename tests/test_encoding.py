@@ -0,0 +1,125 @@
+import json
+
+import pytest
+
+from encoding import BusesDeltaTracker, BusesEncoder, MessageCompressor
+from models import Bus, WindowBounds
+from spatial import BusGrid
+from wire import Dictionary, unpack_buses_frame, unpack_deflate_frame
+
+
+@pytest.fixture
+def grid() -> BusGrid:
+    grid = BusGrid(cell_size=0.01)
+    for bus_index in range(100):
+        grid.update(Bus(busId=str(bus_index), route='Б', lat=55 + bus_index / 1000, lng=37 + bus_index / 1000))
+    return grid
+
+
+def test_build_buses_message(grid):
+    encoder = BusesEncoder(grid)
+    bounds = WindowBounds(south_lat=55.005, north_lat=55.05, west_lng=37, east_lng=38)
+    message, buses_count = encoder.build_buses_message(bounds)
+
+    decoded_message = json.loads(message)
+    expected_buses = [bus.dict() for bus in grid.query(bounds)]
+    assert decoded_message['msgType'] == 'Buses'
+    assert sorted(decoded_message['buses'], key=lambda bus: bus['busId']) == \
+        sorted(expected_buses, key=lambda bus: bus['busId'])
+    assert buses_count == len(expected_buses) == 46
+
+
+def test_fragments_are_shared_and_invalidated(grid):
+    encoder = BusesEncoder(grid)
+    bounds = WindowBounds(south_lat=-90, north_lat=90, west_lng=-180, east_lng=180)
+    message, _ = encoder.build_buses_message(bounds)
+    assert encoder.build_buses_message(bounds)[0] == message
+    assert len(encoder.bus_fragments) == 100
+
+    old_cell = grid.bus_cells['0']
+    moved_bus = Bus(busId='0', route='Б', lat=56, lng=38)
+    grid.update(moved_bus)
+    encoder.invalidate(moved_bus.busId, old_cell, grid.bus_cells['0'])
+    decoded_message = json.loads(encoder.build_buses_message(bounds)[0])
+    assert moved_bus.dict() in decoded_message['buses']
+
+
+def test_delta_tracker(grid):
+    encoder = BusesEncoder(grid)
+    delta_tracker = BusesDeltaTracker(encoder, keyframe_every=3)
+    bounds = WindowBounds(south_lat=55, north_lat=55.05, west_lng=37, east_lng=38)
+
+    keyframe = json.loads(delta_tracker.build_delta_message(bounds)[0])
+    assert keyframe['msgType'] == 'BusesDelta'
+    assert keyframe['keyframe'] is True
+    assert len(keyframe['buses']) == 51
+    assert keyframe['removed'] == []
+
+    assert json.loads(delta_tracker.build_delta_message(bounds)[0])['buses'] == []
+
+    old_cell = grid.bus_cells['1']
+    moved_bus = Bus(busId='1', route='Б', lat=55.0011, lng=37.0011)
+    grid.update(moved_bus)
+    encoder.invalidate('1', old_cell, grid.bus_cells['1'])
+    grid.remove('2')
+    delta = json.loads(delta_tracker.build_delta_message(bounds)[0])
+    assert delta['keyframe'] is False
+    assert delta['buses'] == [moved_bus.dict()]
+    assert delta['removed'] == ['2']
+
+    assert json.loads(delta_tracker.build_delta_message(bounds)[0])['keyframe'] is True
+
+
+def test_build_binary_buses_messages(grid):
+    encoder = BusesEncoder(grid)
+    known = Dictionary()
+    bounds = WindowBounds(south_lat=55, north_lat=55.009, west_lng=37, east_lng=38)
+
+    dictionary_message, frame = encoder.build_binary_buses_messages(bounds, known)[0]
+    decoded_dictionary = json.loads(dictionary_message)
+    assert len(decoded_dictionary['buses']) == 10
+    assert decoded_dictionary['routes'] == [[0, 'Б']]
+    assert len(list(unpack_buses_frame(frame))) == 10
+
+    messages, buses_count = encoder.build_binary_buses_messages(bounds, known)
+    assert len(messages) == 1
+    assert buses_count == 10
+
+
+def test_bus_ids_are_renumbered_after_removal_of_most_buses(grid, monkeypatch):
+    monkeypatch.setattr('encoding.MIN_BUS_INDEXES_TO_RENUMBER', 0)
+    encoder = BusesEncoder(grid)
+    known = Dictionary()
+    bounds = WindowBounds(south_lat=55, north_lat=56, west_lng=37, east_lng=38)
+    encoder.build_binary_buses_messages(bounds, known)
+    assert len(encoder.bus_ids) == 100
+
+    for bus_index in range(51):
+        cell = grid.bus_cells[str(bus_index)]
+        grid.remove(str(bus_index))
+        encoder.remove(str(bus_index), cell)
+    assert len(encoder.bus_ids) == 0
+
+    (dictionary_message, frame), buses_count = encoder.build_binary_buses_messages(bounds, known)
+    bus_indexes, bus_ids = zip(*json.loads(dictionary_message)['buses'])
+    assert sorted(bus_indexes) == list(range(49))
+    assert sorted(map(int, bus_ids)) == list(range(51, 100))
+    assert sorted(bus_index for bus_index, _, _, _ in unpack_buses_frame(frame)) == list(range(49))
+    assert buses_count == 49
+
+
+def test_message_compressor_shares_frames():
+    compressor = MessageCompressor(threshold=10, cache_size=1000)
+    assert compressor.compress('short') == 'short'
+
+    message = json.dumps({'msgType': 'Buses', 'buses': [{'route': 'A'}] * 20})
+    frame = compressor.compress(message)
+    assert unpack_deflate_frame(frame) == message
+    assert compressor.compress(''.join(message)) is frame  # equal message of other browser
+
+    incompressible_message = bytes(range(256))
+    assert compressor.compress(incompressible_message) is incompressible_message
+
+    compressor.compress(json.dumps({'msgType': 'Buses', 'buses': [{'route': 'B'}] * 100}))
+    assert message not in compressor.frames  # the least recently used frame is dropped
+    assert compressor.cached_size <= 1000
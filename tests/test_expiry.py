@@ -0,0 +1,63 @@
+import random
+
+import pytest
+
+from expiry import ExpiryWheel
+
+
+@pytest.fixture
+def wheel() -> ExpiryWheel:
+    return ExpiryWheel(ttl=10, tick=1)
+
+
+def test_bus_expires_after_ttl(wheel):
+    wheel.touch('1', now=100)
+    assert wheel.expire(now=105) == []
+    assert wheel.expire(now=109.9) == []
+    assert wheel.expire(now=111) == ['1']
+    assert len(wheel) == 0
+    assert wheel.expired_buses_count == 1
+
+
+def test_updated_bus_does_not_expire(wheel):
+    wheel.touch('1', now=100)
+    wheel.touch('2', now=100)
+    for now in range(101, 116):
+        wheel.touch('1', now=now)
+        expired_bus_ids = wheel.expire(now=now)
+        if now < 110:
+            assert expired_bus_ids == []
+    assert '1' in wheel.last_seen
+    assert '2' not in wheel.last_seen
+
+
+def test_discarded_bus_does_not_expire(wheel):
+    wheel.touch('1', now=100)
+    wheel.discard('1')
+    assert wheel.expire(now=200) == []
+    wheel.touch('1', now=200)
+    assert wheel.expire(now=211) == ['1']
+
+
+def test_expire_after_long_pause(wheel):
+    wheel.expire(now=0)
+    wheel.touch('1', now=50)
+    wheel.touch('2', now=995)
+    assert wheel.expire(now=1000) == ['1']
+    assert wheel.expire(now=1006) == ['2']
+
+
+def test_expire_same_as_linear_scan():
+    wheel = ExpiryWheel(ttl=7, tick=0.5)
+    last_seen = {}
+    now = 0
+    for _ in range(2000):
+        now += random.uniform(0, 0.3)
+        bus_id = str(random.randrange(100))
+        wheel.touch(bus_id, now)
+        last_seen[bus_id] = now
+        if random.random() < 0.05:
+            expired_bus_ids = set(wheel.expire(now))
+            # bus is expired not later than ttl + tick after last update
+            assert {bus_id for bus_id, seen in last_seen.items() if now - seen >= 7.5} <= expired_bus_ids
+            assert all(now - last_seen.pop(bus_id) >= 7 for bus_id in expired_bus_ids)
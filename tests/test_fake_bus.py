@@ -0,0 +1,190 @@
+import collections
+import contextlib
+from unittest.mock import AsyncMock
+
+import pytest
+import trio
+from trio_websocket import ConnectionClosed
+
+from bus_engine import BusFleet, RouteTable
+from fake_bus import (
+    Backoff,
+    ConnectionPool,
+    EmissionScheduler,
+    LimitedFloat,
+    emit_bus,
+    emit_fleet,
+    get_stats_delta,
+    parse_route_timeout,
+    send_stats,
+    send_updates,
+)
+from wire import unpack_buses_frame
+
+
+def test_scheduler_spreads_emissions_evenly():
+    scheduler = EmissionScheduler(tick=0.01, slots_number=64)
+    for bus_index in range(100):
+        scheduler.add(bus_index, 1, 1000)
+    assert scheduler.target_rate == 100
+
+    emitted_at = collections.defaultdict(list)
+    for tick in range(300):
+        timestamp = 1000 + tick * 0.01
+        for bus_index in scheduler.pop_due(timestamp):
+            emitted_at[bus_index].append(timestamp)
+    assert all(len(timestamps) == 3 for timestamps in emitted_at.values())
+    # every tenth of interval gets tenth of buses
+    tenths = collections.Counter(int((timestamps[0] - 1000) * 10) for timestamps in emitted_at.values())
+    assert all(9 <= count <= 11 for count in tenths.values())
+
+
+def test_scheduler_supports_fractional_and_long_intervals():
+    scheduler = EmissionScheduler(tick=0.01, slots_number=16)  # wheel turns every 0.16 seconds
+    scheduler.add('fast', 0.05, 0)
+    scheduler.add('slow', 0.5, 0)
+    assert scheduler.target_rate == pytest.approx(22)
+
+    emitted = collections.Counter()
+    for tick in range(200):
+        emitted.update(scheduler.pop_due(tick * 0.01))
+    assert emitted == {'fast': 40, 'slow': 4}
+
+
+def test_scheduler_skips_missed_emissions():
+    scheduler = EmissionScheduler(tick=0.01, slots_number=16)
+    scheduler.add('bus', 1, 0)
+    assert scheduler.pop_due(0) == ['bus']
+    assert scheduler.pop_due(3.5) == ['bus']  # emulator was paused
+    assert scheduler.skipped_count == 2
+    assert scheduler.pop_due(3.9) == []
+    assert scheduler.pop_due(4) == ['bus']
+
+
+@pytest.fixture
+def routes_table() -> RouteTable:
+    return RouteTable([{'name': 'A', 'coordinates': [[55.7 + index / 1000, 37.6] for index in range(20)]}])
+
+
+def test_pool_sends_buses_to_least_loaded_healthy_connection():
+    pool = ConnectionPool(3)
+    first_connection, second_connection, down_connection = pool.connections
+    first_connection.is_healthy = second_connection.is_healthy = True
+    route = {'name': 'A', 'coordinates': [[55.0, 37.0]]}
+    for bus_index in range(4):
+        emit_bus(pool, (f'bus-{bus_index}', route, 0, 1))
+    assert [connection.queue_depth for connection in pool.connections] == [2, 2, 0]
+
+    first_connection.is_healthy = False
+    pool.reroute(first_connection)
+    assert [connection.queue_depth for connection in pool.connections] == [0, 4, 0]
+    bus, buses_count = second_connection.receive_channel.receive_nowait()
+    assert (bus['busId'], buses_count) == ('bus-1', 1)
+
+    second_connection.is_healthy = False
+    pool.reroute(second_connection)
+    assert [connection.queue_depth for connection in pool.connections] == [1, 1, 1]
+    down_connection.is_healthy = True  # websocket is reconnected
+    pool.rebalance()
+    assert [connection.queue_depth for connection in pool.connections] == [0, 0, 3]
+
+
+def test_pool_drops_bus_if_all_queues_are_full(monkeypatch):
+    monkeypatch.setattr('fake_bus.CHANNEL_BUFFER_SIZE', 1)
+    pool = ConnectionPool(1)
+    dropped_buses = send_stats.dropped_buses
+    pool.send({'busId': '1'})  # bus waits for reconnect
+    pool.send({'busId': '2'})
+    assert pool.connections[0].queue_depth == 1
+    assert send_stats.dropped_buses == dropped_buses + 1
+
+
+def test_pool_sends_fleet_to_least_loaded_connection(monkeypatch, routes_table):
+    monkeypatch.setattr('fake_bus.CHANNEL_BUFFER_SIZE', 2)
+    pool = ConnectionPool(2)
+    first_connection, second_connection = pool.connections
+    first_connection.is_healthy = second_connection.is_healthy = True
+    small_fleet = BusFleet(routes_table, [('bus-1', 'A', 0)])
+    big_fleet = BusFleet(routes_table, [('bus-2', 'A', 0), ('bus-3', 'A', 5), ('bus-4', 'A', 10)], first_bus_index=1)
+    dropped_buses = send_stats.dropped_buses
+    emit_fleet(pool, (small_fleet, 1))
+    emit_fleet(pool, (big_fleet, 1))  # fleet bigger than queue is queued only to empty queue
+    emit_fleet(pool, (big_fleet, 1))
+    assert [connection.queue_depth for connection in pool.connections] == [1, 3]
+    assert send_stats.dropped_buses == dropped_buses + 3
+
+    second_connection.is_healthy = False
+    pool.reroute(second_connection)
+    assert [connection.queue_depth for connection in pool.connections] == [1, 0]
+    assert send_stats.dropped_buses == dropped_buses + 6
+
+
+@pytest.mark.trio
+async def test_send_updates_returns_unsent_bus_to_pool(monkeypatch):
+    pool = ConnectionPool(2)
+    broken_connection, other_connection = pool.connections
+    other_connection.is_healthy = True
+    broken_connection.send_channel.send_nowait(({'busId': 'bus-1', 'route': 'A', 'lat': 1, 'lng': 1}, 1))
+    broken_connection.queue_depth = 1
+    ws = AsyncMock()
+    ws.send_message.side_effect = ConnectionClosed(None)
+
+    @contextlib.asynccontextmanager
+    async def open_websocket_url(url):
+        yield ws
+
+    monkeypatch.setattr('fake_bus.open_websocket_url', open_websocket_url)
+    with pytest.raises(ConnectionClosed):
+        await send_updates.__wrapped__('ws://server', pool, broken_connection)
+
+    assert not broken_connection.is_healthy
+    assert [connection.queue_depth for connection in pool.connections] == [0, 1]
+    bus, _ = other_connection.receive_channel.receive_nowait()
+    assert bus['busId'] == 'bus-1'
+
+
+@pytest.mark.trio
+async def test_send_updates_sends_dictionary_of_fleet_on_every_connection(monkeypatch, routes_table, autojump_clock):
+    pool = ConnectionPool(1)
+    connection, = pool.connections
+    fleet = BusFleet(routes_table, [('bus-1', 'A', 0)], first_bus_index=7)
+    ws = AsyncMock()
+
+    @contextlib.asynccontextmanager
+    async def open_websocket_url(url):
+        yield ws
+
+    monkeypatch.setattr('fake_bus.open_websocket_url', open_websocket_url)
+    for _ in range(2):  # connection is reopened
+        emit_fleet(pool, (fleet, 1))
+        emit_fleet(pool, (fleet, 1))
+        with trio.move_on_after(1):
+            await send_updates.__wrapped__('ws://server', pool, connection, binary=True)
+
+    messages = [message for (message,), _ in ws.send_message.call_args_list]
+    dictionary = fleet.build_dictionary_message()
+    assert [message == dictionary for message in messages] == [True, False, False] * 2
+    assert [bus_index for bus_index, _, _, _ in unpack_buses_frame(messages[1])] == [7]
+
+
+def test_backoff_delays_grow_with_jitter():
+    backoff = Backoff(min_delay=1, max_delay=8, stable_seconds=10)
+    delays = [backoff.get_delay(0) for _ in range(5)]
+    for delay, max_delay in zip(delays, [1, 2, 4, 8, 8]):
+        assert max_delay / 2 <= delay <= max_delay
+    assert backoff.get_delay(10) <= 1  # connection was stable
+
+
+def test_stats_delta_of_restarted_worker_is_not_negative():
+    assert get_stats_delta((10, 5, 100, 0), (4, 2, 40, 0)) == (6, 3, 60, 0)
+    assert get_stats_delta((3, 1, 30, 0), (10, 5, 100, 0)) == (3, 1, 30, 0)  # worker is restarted
+    assert get_stats_delta((3, 1, 30, 2), (10, 5, 100, 0)) == (3, 1, 30, 2)
+
+
+def test_parse_route_timeout():
+    assert parse_route_timeout('670к=0.5') == ('670к', 0.5)
+    for value in ['0.5', '=0.5', 'A=0', 'A=x']:
+        with pytest.raises(ValueError):
+            parse_route_timeout(value)
+    assert LimitedFloat(0.01, 60)('0.25') == 0.25
+    assert repr(LimitedFloat(0.01, 60)) == 'LimitedFloat (min=0.01, max=60)'
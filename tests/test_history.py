@@ -0,0 +1,83 @@
+import pytest
+
+from history import PositionHistory, Replay
+from models import BusRecord, WindowBounds
+
+WORLD = WindowBounds(south_lat=-90, north_lat=90, west_lng=-180, east_lng=180)
+
+
+@pytest.fixture
+def positions_history() -> PositionHistory:
+    return PositionHistory(buses_capacity=2, positions_per_bus=3)
+
+
+def test_track_keeps_last_positions(positions_history):
+    assert positions_history.get_track('1') == []
+    for timestamp in range(5):
+        positions_history.append(BusRecord('1', 'A', 55 + timestamp / 10, 37), timestamp)
+    assert positions_history.get_track('1') == [(2, 55.2, 37), (3, 55.3, 37), (4, 55.4, 37)]
+
+
+def test_row_of_removed_bus_is_reused(positions_history, caplog):
+    positions_history.append(BusRecord('1', 'A', 1, 1), 0)
+    positions_history.append(BusRecord('2', 'A', 2, 2), 0)
+    assert not positions_history.append(BusRecord('3', 'A', 3, 3), 0)  # history is full
+    assert not positions_history.append(BusRecord('3', 'A', 3, 3), 0)
+    assert positions_history.is_full
+    assert len(caplog.records) == 1  # full history is reported once
+    assert positions_history.get_track('3') == []
+
+    positions_history.remove('1')
+    assert not positions_history.is_full
+    assert positions_history.get_track('1') == [(0, 1, 1)]  # history of removed bus is kept till reuse
+    assert positions_history.append(BusRecord('3', 'A', 3, 3), 1)
+    assert positions_history.get_track('1') == []
+    assert positions_history.get_track('3') == [(1, 3, 3)]
+
+
+def test_returned_bus_keeps_its_row(positions_history):
+    positions_history.append(BusRecord('1', 'A', 1, 1), 0)
+    positions_history.append(BusRecord('2', 'A', 2, 2), 0)
+    positions_history.remove('1')
+    positions_history.append(BusRecord('1', 'A', 1.5, 1.5), 1)
+    positions_history.append(BusRecord('3', 'A', 3, 3), 1)
+    assert positions_history.get_track('1') == [(0, 1, 1), (1, 1.5, 1.5)]
+    assert positions_history.get_track('3') == []
+
+
+def test_snapshot(positions_history):
+    positions_history.append(BusRecord('1', 'A', 55.1, 37.1), 10)
+    positions_history.append(BusRecord('1', 'A', 55.2, 37.2), 20)
+    positions_history.append(BusRecord('2', 'B', 10, 10), 15)
+    positions_history.append(BusRecord('2', 'B', 10, 11), 100)
+
+    assert positions_history.get_snapshot(5, WORLD) == []
+    assert positions_history.get_snapshot(16, WORLD) == [BusRecord('1', 'A', 55.1, 37.1), BusRecord('2', 'B', 10, 10)]
+    assert positions_history.get_snapshot(78, WORLD, max_age=60) == [BusRecord('1', 'A', 55.2, 37.2)]
+    moscow = WindowBounds(south_lat=55, north_lat=56, west_lng=37, east_lng=38)
+    assert positions_history.get_snapshot(100, moscow, max_age=100) == [BusRecord('1', 'A', 55.2, 37.2)]
+
+
+def test_snapshot_reads_rows_by_chunks(monkeypatch):
+    monkeypatch.setattr('history.SNAPSHOT_CHUNK_ROWS', 2)
+    positions_history = PositionHistory(buses_capacity=5, positions_per_bus=2)
+    for bus_index in range(5):
+        positions_history.append(BusRecord(str(bus_index), 'A', bus_index, 1), 10)
+        positions_history.append(BusRecord(str(bus_index), 'A', bus_index, 2), 20 + bus_index)
+
+    assert positions_history.get_snapshot(22, WORLD) == [
+        BusRecord('0', 'A', 0, 2),
+        BusRecord('1', 'A', 1, 2),
+        BusRecord('2', 'A', 2, 2),
+        BusRecord('3', 'A', 3, 1),
+        BusRecord('4', 'A', 4, 1),
+    ]
+
+
+def test_replay_stops_when_it_catches_up():
+    replay = Replay()
+    assert replay.get_time(now=1000) is None
+    replay.start(since=900, speed=10, now=1000)
+    assert replay.get_time(now=1005) == 950
+    assert replay.get_time(now=1012) is None
+    assert not replay.is_active
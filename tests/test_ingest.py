@@ -0,0 +1,46 @@
+import json
+
+from ingest import IngestBuffer
+from models import BusRecord
+from wire import FrameWriter
+
+
+def test_latest_update_supersedes_earlier_ones():
+    ingest_buffer = IngestBuffer()
+    ingest_buffer.add(json.dumps({'busId': '1', 'route': 'A', 'lat': 1, 'lng': 1}))
+    ingest_buffer.add(json.dumps([
+        {'busId': '2', 'route': 'A', 'lat': 2, 'lng': 2},
+        {'busId': '1', 'route': 'A', 'lat': 1, 'lng': 1.5},
+    ]))
+    frame_writer = FrameWriter()
+    for message in frame_writer.encode([{'busId': '2', 'route': 'B', 'lat': 2, 'lng': 2.5}]):
+        ingest_buffer.add(message)
+    assert len(ingest_buffer) == 4
+
+    buses, errors, superseded_count = ingest_buffer.parse()
+    assert sorted(buses, key=lambda bus: bus.busId) == [BusRecord('1', 'A', 1, 1.5), BusRecord('2', 'B', 2, 2.5)]
+    assert errors == []
+    assert superseded_count == 2
+    assert len(ingest_buffer) == 0
+
+    ingest_buffer.add(frame_writer.encode([{'busId': '2', 'route': 'B', 'lat': 3, 'lng': 3}])[0])
+    assert ingest_buffer.parse() == ([BusRecord('2', 'B', 3, 3)], [], 0)  # dictionary is kept between ticks
+
+
+def test_errors_are_grouped_by_messages():
+    ingest_buffer = IngestBuffer()
+    ingest_buffer.add(json.dumps([{'busId': '1', 'route': 'A', 'lat': 100, 'lng': 1}, 'wrong']))
+    ingest_buffer.add('invalid json')
+    ingest_buffer.add(json.dumps({'busId': '2', 'route': 'A', 'lat': 1, 'lng': 1}))
+    ingest_buffer.add(json.dumps({'busId': [], 'route': 'A', 'lat': 1, 'lng': 1}))
+    ingest_buffer.add(json.dumps({'busId': '1', 'route': 'A', 'lat': 1, 'lng': 1}))
+
+    buses, errors, superseded_count = ingest_buffer.parse()
+    assert buses == [BusRecord('2', 'A', 1, 1), BusRecord('1', 'A', 1, 1)]
+    assert superseded_count == 1
+    assert len(errors) == 3
+    first_message_errors, second_message_errors, fourth_message_errors = errors
+    # invalid update is superseded by valid one, but its error is reported
+    assert [error['loc'] for error in first_message_errors] == [(0, 'lat'), (1,)]
+    assert second_message_errors == ['can not decode message "invalid json" to JSON']
+    assert [error['loc'] for error in fourth_message_errors] == [('busId',)]
@@ -0,0 +1,83 @@
+import numpy
+import pytest
+
+from bus_engine import RouteTable
+from interpolation import MotionEstimator, RouteGeometry
+from models import BusRecord
+
+# route turns at the corner, so straight line movement would leave it
+ROUTE = {'name': 'A', 'coordinates': [[55.0, 37.0], [55.0, 37.01], [55.01, 37.01]]}
+OTHER_ROUTE = {'name': 'B', 'coordinates': [[56.0, 38.0], [56.0, 38.01]]}
+
+
+@pytest.fixture
+def geometry() -> RouteGeometry:
+    return RouteGeometry(RouteTable([ROUTE, OTHER_ROUTE]))
+
+
+def test_estimate_straight_movement():
+    estimator = MotionEstimator(max_ahead=3)
+    estimator.report(BusRecord('1', 'A', 55.0, 37.0), 0)
+    assert estimator.estimate(1) == []  # speed is unknown after the first report
+
+    estimator.report(BusRecord('1', 'A', 55.001, 37.002), 1)
+    assert estimator.estimate(1.5) == [BusRecord('1', 'A', 55.0015, 37.003)]
+    assert estimator.estimate(10) == [BusRecord('1', 'A', 55.004, 37.008)]  # stops after max_ahead
+    assert estimator.estimate(11) == []
+
+
+def test_jump_is_not_movement():
+    estimator = MotionEstimator()
+    estimator.report(BusRecord('1', 'A', 55.0, 37.0), 0)
+    estimator.report(BusRecord('1', 'A', 55.5, 37.0), 1)
+    assert estimator.estimate(2) == []
+
+    estimator.remove('1')
+    assert len(estimator) == 0
+
+
+def test_route_geometry(geometry):
+    assert geometry.get_route_distances(0) == pytest.approx((0, 0.02))
+    distances, offsets, segments = geometry.project_on_route(
+        0,
+        numpy.array([55.001, 55.0]),
+        numpy.array([37.005, 37.0]),
+    )
+    assert distances.tolist() == pytest.approx([0.005, 0])
+    assert offsets.tolist() == pytest.approx([0.001, 0])
+    assert segments.tolist() == [0, 0]
+    distances, offsets, segments = geometry.project_on_route(1, numpy.array([56.0]), numpy.array([38.005]))
+    assert distances.tolist() == pytest.approx([geometry.route_gap + 0.025])
+    assert segments.tolist() == [3]
+    distances, offsets, segments = geometry.project_near(
+        numpy.array([0, 0]),
+        numpy.array([0, 0]),
+        numpy.array([55.005, 55.001]),
+        numpy.array([37.011, 37.005]),
+        window=1,
+    )
+    assert distances.tolist() == pytest.approx([0.015, 0.005])
+    assert offsets.tolist() == pytest.approx([0.001, 0.001])
+    assert segments.tolist() == [1, 0]
+    lats, lngs = geometry.locate([0.015, geometry.route_gap + 0.025])
+    assert lats.tolist() == pytest.approx([55.005, 56.0])
+    assert lngs.tolist() == pytest.approx([37.01, 38.005])
+
+
+def test_estimate_movement_along_route(geometry):
+    estimator = MotionEstimator(geometry, max_ahead=10)
+    estimator.report(BusRecord('1', 'A', 55.0, 37.006), 0)
+    assert estimator.estimate(0.5) == []  # reports are projected to route by estimate
+    estimator.report(BusRecord('1', 'A', 55.0, 37.008), 1)
+
+    bus, = estimator.estimate(3)  # bus turns at the corner
+    assert (bus.lat, bus.lng) == pytest.approx((55.002, 37.01))
+    bus, = estimator.estimate(8)  # bus stays at the end of route
+    assert (bus.lat, bus.lng) == pytest.approx((55.01, 37.01))
+
+
+def test_bus_far_from_route_moves_straight(geometry):
+    estimator = MotionEstimator(geometry)
+    estimator.report(BusRecord('1', 'A', 55.1, 37.0), 0)
+    estimator.report(BusRecord('1', 'A', 55.1, 37.001), 1)
+    assert estimator.estimate(2) == [BusRecord('1', 'A', 55.1, 37.002)]
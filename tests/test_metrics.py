@@ -0,0 +1,67 @@
+import pytest
+import trio
+import trio.testing
+
+from metrics import Counter, Gauge, Histogram, Registry, handle_metrics_request, monitor_event_loop_lag
+
+
+@pytest.fixture
+def registry() -> Registry:
+    return Registry()
+
+
+def test_render(registry):
+    counter = Counter('buses_total', 'Buses', metrics_registry=registry)
+    gauge = Gauge('browsers', 'Browsers', metrics_registry=registry)
+    function_gauge = Gauge('items', 'Items', lambda: 7, metrics_registry=registry)
+    histogram = Histogram('send_seconds', 'Send time', buckets=[0.1, 1], metrics_registry=registry)
+    counter.inc()
+    counter.inc(2)
+    gauge.inc()
+    gauge.dec()
+    gauge.inc(5)
+    for value in [0.05, 0.1, 0.5, 3]:
+        histogram.observe(value)
+
+    assert registry.render() == '\n'.join([
+        '# HELP buses_total Buses',
+        '# TYPE buses_total counter',
+        'buses_total 3.0',
+        '# HELP browsers Browsers',
+        '# TYPE browsers gauge',
+        'browsers 5.0',
+        '# HELP items Items',
+        '# TYPE items gauge',
+        'items 7.0',
+        '# HELP send_seconds Send time',
+        '# TYPE send_seconds histogram',
+        'send_seconds_bucket{le="0.1"} 2.0',
+        'send_seconds_bucket{le="1.0"} 3.0',
+        'send_seconds_bucket{le="+Inf"} 4.0',
+        'send_seconds_sum 3.65',
+        'send_seconds_count 4.0',
+    ]) + '\n'
+
+
+@pytest.mark.trio
+@pytest.mark.parametrize('path, expected_status', [(b'/metrics', b'200 OK'), (b'/', b'404 Not Found')])
+async def test_handle_metrics_request(registry, path, expected_status):
+    Counter('buses_total', 'Buses', metrics_registry=registry).inc()
+    client_stream, server_stream = trio.testing.memory_stream_pair()
+    await client_stream.send_all(b'GET ' + path + b' HTTP/1.1\r\nHost: localhost\r\n\r\n')
+    await handle_metrics_request(server_stream, registry)
+
+    response = b''
+    while data := await client_stream.receive_some():
+        response += data
+    assert response.startswith(b'HTTP/1.1 ' + expected_status)
+    assert (b'\nbuses_total 1.0\n' in response) == (expected_status == b'200 OK')
+
+
+@pytest.mark.trio
+async def test_monitor_event_loop_lag(autojump_clock):
+    lag = Histogram('lag', 'Lag', buckets=[0.01], metrics_registry=Registry())
+    with trio.move_on_after(2.2):
+        await monitor_event_loop_lag(lag, interval=0.5)
+    assert lag.count == 4
+    assert lag.sum == 0
@@ -0,0 +1,40 @@
+import pydantic
+import pytest
+
+from models import Bus, BusRecord, SubscribeRoutesMessage, parse_browser_message, parse_bus
+
+
+@pytest.mark.parametrize('decoded_message', [
+    {'busId': '1', 'route': 'A', 'lat': 55.75, 'lng': 37.6},
+    {'busId': '1', 'route': 'A', 'lat': 55, 'lng': 37, 'extra': 'ignored'},
+    {'busId': 1, 'route': 'A', 'lat': '55.75', 'lng': 37.6},  # pydantic coercion
+    {'busId': '1', 'route': 'A', 'lat': -90, 'lng': 180},
+])
+def test_parse_bus_same_as_pydantic(decoded_message):
+    bus = Bus(**decoded_message)
+    assert parse_bus(decoded_message) == BusRecord(bus.busId, bus.route, bus.lat, bus.lng)
+    assert parse_bus(decoded_message).dict() == bus.dict()
+
+
+@pytest.mark.parametrize('decoded_message', [
+    {'busId': [], 'route': [], 'lat': -100, 'lng': 200},
+    {'busId': '1', 'lat': 1, 'lng': 2},
+    {'busId': '1', 'route': 'A', 'lat': 1, 'lng': 180.5},
+    {'busId': '1', 'route': 'A', 'lat': float('inf'), 'lng': 1},
+])
+def test_parse_bus_errors_same_as_pydantic(decoded_message):
+    with pytest.raises(pydantic.ValidationError) as pydantic_error:
+        Bus(**decoded_message)
+    with pytest.raises(pydantic.ValidationError) as parse_error:
+        parse_bus(decoded_message)
+    assert parse_error.value.errors() == pydantic_error.value.errors()
+
+
+def test_parse_subscribe_routes():
+    message = parse_browser_message({'msgType': 'subscribeRoutes', 'data': {'routes': ['120', '120', 'Б']}})
+    assert isinstance(message, SubscribeRoutesMessage)
+    assert message.data.routes == {'120', 'Б'}
+
+    with pytest.raises(pydantic.ValidationError) as error:
+        parse_browser_message({'msgType': 'subscribeRoutes', 'data': {'routes': 'not list'}})
+    assert error.value.errors()[0]['loc'] == ('data', 'routes')
@@ -0,0 +1,108 @@
+import contextlib
+import json
+from unittest.mock import AsyncMock
+
+import pytest
+import trio
+
+import server
+from encoding import BusesDeltaTracker, BusesEncoder
+from models import BusRecord, WindowBounds
+from relay import UpstreamBuses, WORLD_BOUNDS
+from spatial import BusGrid
+from wire import Dictionary, WireFormatError, pack_deflate_frame
+
+WORLD = WindowBounds(**WORLD_BOUNDS)
+
+
+@pytest.fixture
+def grid() -> BusGrid:
+    grid = BusGrid()
+    grid.update(BusRecord('1', 'А', 55.75, 37.6))
+    grid.update(BusRecord('2', 'B', 55.7, 37.5))
+    return grid
+
+
+def get_buses(changed_buses):
+    return sorted(changed_buses, key=lambda bus: bus.busId)
+
+
+def test_receive_binary_deltas(grid):
+    encoder = BusesEncoder(grid)
+    delta_tracker = BusesDeltaTracker(encoder)
+    known = Dictionary()
+    upstream_buses = UpstreamBuses()
+
+    dictionary_message, frame = delta_tracker.build_binary_delta_messages(WORLD, known)[0]
+    assert upstream_buses.receive(pack_deflate_frame(dictionary_message)) == ([], [])
+    changed_buses, removed_bus_ids = upstream_buses.receive(pack_deflate_frame(frame))
+    assert get_buses(changed_buses) == [BusRecord('1', 'А', 55.75, 37.6), BusRecord('2', 'B', 55.7, 37.5)]
+    assert removed_bus_ids == []
+
+    grid.update(BusRecord('1', 'А', 55.76, 37.6))
+    grid.remove('2')
+    encoder.invalidate('1')
+    frame, = delta_tracker.build_binary_delta_messages(WORLD, known)[0]
+    assert upstream_buses.receive(frame) == ([BusRecord('1', 'А', 55.76, 37.6)], ['2'])
+    assert upstream_buses.bus_ids == {'1'}
+
+
+def test_edge_server_gets_reported_positions(grid):
+    encoder = BusesEncoder(grid)
+    delta_tracker = BusesDeltaTracker(encoder)
+    delta_tracker.reported_buses = {'1': BusRecord('1', 'А', 55.7, 37.6)}  # grid has estimated position of bus
+    upstream_buses = UpstreamBuses()
+    encoder.encode_bus(grid.cells[grid.bus_cells['1']]['1'])  # fragment of estimated position is cached
+
+    message, _ = delta_tracker.build_delta_message(WORLD)
+    changed_buses, _ = upstream_buses.receive(message)
+    assert get_buses(changed_buses) == [BusRecord('1', 'А', 55.7, 37.6), BusRecord('2', 'B', 55.7, 37.5)]
+
+    grid.update(BusRecord('1', 'А', 55.71, 37.6))  # new estimate without report isn't a change
+    encoder.invalidate('1')
+    message, _ = delta_tracker.build_delta_message(WORLD)
+    assert upstream_buses.receive(message) == ([], [])
+
+
+def test_keyframe_removes_missed_buses(grid):
+    upstream_buses = UpstreamBuses()
+    upstream_buses.receive(BusesEncoder(grid).build_buses_message(WORLD)[0])
+
+    grid.remove('2')
+    grid.update(BusRecord('3', 'B', 55.7, 37.5))
+    message, _ = BusesDeltaTracker(BusesEncoder(grid)).build_delta_message(WORLD)
+    assert json.loads(message)['keyframe']
+    changed_buses, removed_bus_ids = upstream_buses.receive(message)
+    assert get_buses(changed_buses) == [BusRecord('1', 'А', 55.75, 37.6), BusRecord('3', 'B', 55.7, 37.5)]
+    assert removed_bus_ids == ['2']
+
+
+def test_unknown_index():
+    upstream_buses = UpstreamBuses()
+    grid = BusGrid()
+    grid.update(BusRecord('1', 'A', 1, 1))
+    _, frame = BusesDeltaTracker(BusesEncoder(grid)).build_binary_delta_messages(WORLD, Dictionary())[0]
+    with pytest.raises(WireFormatError):
+        upstream_buses.receive(frame)
+    with pytest.raises(WireFormatError):
+        upstream_buses.receive(json.dumps({'msgType': 'Clusters'}))
+    for message in ['[]', '1']:
+        with pytest.raises(WireFormatError):
+            upstream_buses.receive(message)
+
+
+@pytest.mark.trio
+async def test_relay_reconnects_after_wrong_message(monkeypatch, autojump_clock, server_buses):
+    connections = []
+
+    @contextlib.asynccontextmanager
+    async def open_websocket_url(url):
+        ws = AsyncMock()
+        ws.get_message.side_effect = ['[]'] if not connections else trio.sleep_forever
+        connections.append(ws)
+        yield ws
+
+    monkeypatch.setattr(server, 'open_websocket_url', open_websocket_url)
+    with trio.move_on_after(5):
+        await server.relay_upstream('ws://upstream')
+    assert len(connections) == 2
@@ -0,0 +1,34 @@
+import random
+
+from models import Bus, WindowBounds
+from route_index import RouteIndex
+
+
+def test_route_index_query_same_as_linear_scan():
+    index = RouteIndex()
+    buses = {}
+    for _ in range(2000):
+        bus_id = str(random.randrange(300))
+        if random.random() < 0.1:
+            index.remove(bus_id)
+            buses.pop(bus_id, None)
+            continue
+        bus = Bus(busId=bus_id, route=random.choice('ABCDE'), lat=random.uniform(55, 56), lng=random.uniform(37, 38))
+        index.update(bus)
+        buses[bus_id] = bus
+
+    bounds = WindowBounds(south_lat=55.2, north_lat=55.8, west_lng=37.1, east_lng=37.9)
+    expected = {bus_id for bus_id, bus in buses.items() if bus.route in {'A', 'C'} and bounds.is_inside(bus)}
+    assert {bus.busId for bus in index.query({'A', 'C'}, bounds)} == expected
+    assert len(index) == len(buses)
+
+
+def test_route_index_bus_changes_route():
+    index = RouteIndex()
+    bounds = WindowBounds(south_lat=-90, north_lat=90, west_lng=-180, east_lng=180)
+    index.update(Bus(busId='1', route='A', lat=1, lng=2))
+    index.update(Bus(busId='1', route='B', lat=1, lng=2))
+    assert list(index.query(['A'], bounds)) == []
+    assert [bus.route for bus in index.query(['B', 'unknown'], bounds)] == ['B']
+    index.remove('1')
+    assert index.routes == {}
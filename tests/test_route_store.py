@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+from bus_engine import BusFleet, RouteTable
+from route_store import RouteStore, compile_routes
+
+
+@pytest.fixture
+def routes() -> list:
+    return [
+        {'name': '120', 'coordinates': [[55.7 + index / 1000, 37.6 + index / 1000] for index in range(7)]},
+        {'name': '670к', 'coordinates': [[55.8 - index / 1000, 37.5 - index / 1000] for index in range(3)]},
+        {'name': 'Т25', 'coordinates': [[55.9, 37.9]]},
+    ]
+
+
+@pytest.fixture
+def store(routes, tmp_path) -> RouteStore:
+    routes_directory = tmp_path / 'routes'
+    routes_directory.mkdir()
+    for route in routes:
+        (routes_directory / f'{route["name"]}.json').write_text(json.dumps(route), encoding='utf8')
+    assert compile_routes(str(routes_directory), str(tmp_path / 'routes.bin')) == 3
+    return RouteStore(str(tmp_path / 'routes.bin'))
+
+
+def test_store_routes_same_as_json(routes, store):
+    routes_by_name = {route['name']: route for route in routes}
+    assert len(store) == 3
+    for route in store.iter_routes():
+        assert route['coordinates'].tolist() == routes_by_name[route['name']]['coordinates']
+
+
+def test_store_iter_routes_of_worker(store):
+    assert len(list(store.iter_routes(routes_number=2))) == 2
+    assert [route['name'] for route in store.iter_routes(worker_index=1, workers_number=2)] == [store.names[1]]
+
+
+def test_route_table_from_store_shares_coordinates(routes, store):
+    route_table = RouteTable.from_store(store)
+    assert route_table.coordinates.base is not None
+    assert not route_table.coordinates.flags.writeable
+
+    buses = [('bus-1', '120', 3), ('bus-2', 'Т25', 0)]
+    assert BusFleet(route_table, buses).get_buses(10, 1) == BusFleet(RouteTable(routes), buses).get_buses(10, 1)
+
+
+def test_store_wrong_file(tmp_path):
+    (tmp_path / 'wrong.bin').write_bytes(b'x' * 100)
+    with pytest.raises(ValueError):
+        RouteStore(str(tmp_path / 'wrong.bin'))
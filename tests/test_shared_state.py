@@ -0,0 +1,122 @@
+import multiprocessing
+import time
+
+import pytest
+
+from models import BusRecord
+from shared_state import HEADER, SEQUENCE, SLOT_DTYPE, SharedBusTable
+
+
+@pytest.fixture
+def table() -> SharedBusTable:
+    table = SharedBusTable.create(capacity=100)
+    yield table
+    table.close()
+
+
+@pytest.fixture
+def reader(table) -> SharedBusTable:
+    reader = SharedBusTable.attach(table.name)
+    yield reader
+    reader.close()
+
+
+def write_positions(table_name: str, buses_number: int, seconds: float):
+    """Write positions where lng is always equal -lat, so torn read breaks this rule."""
+    table = SharedBusTable.attach(table_name)
+    finish_at = time.monotonic() + seconds
+    step = 0
+    while time.monotonic() < finish_at:
+        step += 1
+        lat = step % 90 + step % 1000 / 1000
+        for bus_index in range(buses_number):
+            table.write(BusRecord(str(bus_index), 'A', lat, -lat))
+    table.close()
+
+
+def test_read_changes(table, reader):
+    table.write(BusRecord('1', 'A', 55.5, 37.5))
+    table.write(BusRecord('2', 'Б', 55.6, 37.6))
+    assert reader.read_changes() == (
+        [BusRecord('1', 'A', 55.5, 37.5), BusRecord('2', 'Б', 55.6, 37.6)],
+        [],
+    )
+    assert reader.read_changes() == ([], [])
+
+    table.write(BusRecord('2', 'Б', 55.7, 37.7))
+    table.remove('1')
+    assert reader.read_changes() == ([BusRecord('2', 'Б', 55.7, 37.7)], ['1'])
+
+    table.write(BusRecord('3', 'A', 1, 2))  # reuses slot of removed bus
+    assert reader.read_changes() == ([BusRecord('3', 'A', 1, 2)], [])
+    assert table.used_slots_count == 2
+
+
+def test_bus_added_again_to_other_slot_is_not_removed(table, reader):
+    for bus_id in '0123':
+        table.write(BusRecord(bus_id, 'A', 1, 2))
+    reader.read_changes()
+    for bus_id in '021':
+        table.remove(bus_id)
+    table.write(BusRecord('9', 'A', 3, 4))
+    table.write(BusRecord('0', 'A', 5, 6))
+
+    changed_buses, removed_bus_ids = reader.read_changes()
+    assert sorted(bus.busId for bus in changed_buses) == ['0', '9']
+    assert sorted(removed_bus_ids) == ['1', '2']
+    assert reader.read_changes() == ([], [])
+
+
+def test_reader_skips_slot_which_is_being_written(table, reader):
+    table.write(BusRecord('1', 'A', 55.5, 37.5))
+    reader.read_changes()
+    table.write(BusRecord('1', 'A', 10, 20))
+
+    slot_offset = HEADER.size
+    SEQUENCE.pack_into(table.memory.buf, slot_offset, table.sequences[0] + 1)  # writer is in the middle of write
+    assert reader.read_changes() == ([], [])
+
+    SEQUENCE.pack_into(table.memory.buf, slot_offset, table.sequences[0])
+    assert reader.read_changes() == ([BusRecord('1', 'A', 10, 20)], [])
+
+
+def test_too_long_bus_is_skipped(table, reader, caplog):
+    assert not table.write(BusRecord('x' * 100, 'A', 1, 2))
+    assert not table.write(BusRecord('x' * 100, 'A', 1, 3))
+    assert reader.read_changes() == ([], [])
+    assert len(caplog.records) == 1  # bus is reported once
+
+
+def test_full_table_is_reported_once(caplog):
+    table = SharedBusTable.create(capacity=1)
+    try:
+        assert table.write(BusRecord('1', 'A', 1, 2))
+        assert not table.write(BusRecord('2', 'A', 1, 2))
+        assert not table.write(BusRecord('3', 'A', 1, 2))
+        assert len(caplog.records) == 1
+        table.remove('1')
+        assert table.write(BusRecord('2', 'A', 1, 2))
+        assert not table.write(BusRecord('3', 'A', 1, 2))
+        assert len(caplog.records) == 2
+    finally:
+        table.close()
+
+
+def test_slot_size():
+    assert SLOT_DTYPE.itemsize == 128
+
+
+def test_reader_never_sees_torn_positions(table, reader):
+    writer = multiprocessing.get_context('spawn').Process(target=write_positions, args=(table.name, 50, 3))
+    writer.start()
+    try:
+        reads_count = 0
+        finish_at = time.monotonic() + 5
+        while writer.is_alive() and time.monotonic() < finish_at:
+            changed_buses, _ = reader.read_changes()
+            for bus in changed_buses:
+                assert bus.lng == -bus.lat
+            reads_count += len(changed_buses)
+        assert reads_count > 0
+    finally:
+        writer.join()
@@ -0,0 +1,104 @@
+import random
+
+import pytest
+
+from models import Bus, WindowBounds
+from spatial import BusGrid, ClusterGrid
+
+
+@pytest.fixture
+def grid() -> BusGrid:
+    return BusGrid(cell_size=0.01)
+
+
+def test_grid_query_same_as_linear_scan(grid):
+    buses = {}
+    for bus_index in range(1000):
+        bus = Bus(busId=str(bus_index), route='A', lat=random.uniform(55, 56), lng=random.uniform(37, 38))
+        buses[bus.busId] = bus
+        grid.update(bus)
+
+    for _ in range(20):
+        south_lat = random.uniform(55, 56)
+        west_lng = random.uniform(37, 38)
+        bounds = WindowBounds(
+            south_lat=south_lat,
+            north_lat=south_lat + 0.1,
+            west_lng=west_lng,
+            east_lng=west_lng + 0.2,
+        )
+        expected = {bus_id for bus_id, bus in buses.items() if bounds.is_inside(bus)}
+        assert {bus.busId for bus in grid.query(bounds)} == expected
+
+
+def test_grid_query_all_world(grid):
+    grid.update(Bus(busId='1', route='A', lat=-89, lng=-179))
+    grid.update(Bus(busId='2', route='A', lat=89, lng=179))
+    bounds = WindowBounds(south_lat=-90, north_lat=90, west_lng=-180, east_lng=180)
+    assert {bus.busId for bus in grid.query(bounds)} == {'1', '2'}
+
+
+def test_grid_moves_bus_between_cells(grid):
+    grid.update(Bus(busId='1', route='A', lat=55.001, lng=37.001))
+    grid.update(Bus(busId='1', route='A', lat=55.501, lng=37.501))
+    old_bounds = WindowBounds(south_lat=55, north_lat=55.002, west_lng=37, east_lng=37.002)
+    new_bounds = WindowBounds(south_lat=55.5, north_lat=55.502, west_lng=37.5, east_lng=37.502)
+
+    assert len(grid) == 1
+    assert len(grid.cells) == 1
+    assert list(grid.query(old_bounds)) == []
+    assert [bus.busId for bus in grid.query(new_bounds)] == ['1']
+
+
+def test_grid_remove(grid):
+    grid.update(Bus(busId='1', route='A', lat=55, lng=37))
+    grid.remove('1')
+    grid.remove('unknown')
+    assert len(grid) == 0
+    assert grid.cells == {}
+
+
+def test_clusters_same_as_linear_scan():
+    clusters = ClusterGrid(cell_size=0.04, factor=4, levels_number=3)
+    buses = {}
+    for _ in range(3000):
+        bus_id = str(random.randrange(500))
+        if random.random() < 0.1:
+            clusters.remove(bus_id)
+            buses.pop(bus_id, None)
+            continue
+        bus = Bus(busId=bus_id, route='A', lat=random.uniform(55, 56), lng=random.uniform(37, 38))
+        clusters.update(bus)
+        buses[bus_id] = bus
+
+    bounds = WindowBounds(south_lat=55, north_lat=56, west_lng=37, east_lng=38)
+    for level, cell_size in enumerate(clusters.cell_sizes):
+        expected = {}
+        for bus in buses.values():
+            cell = expected.setdefault((bus.lat // cell_size, bus.lng // cell_size), [0, 0, 0])
+            cell[0] += 1
+            cell[1] += bus.lat
+            cell[2] += bus.lng
+        level_clusters = clusters.query(bounds, level)
+        assert sorted(cluster.count for cluster in level_clusters) == sorted(cell[0] for cell in expected.values())
+        assert sorted(round(cluster.lat, 6) for cluster in level_clusters) == \
+            sorted(round(cell[1] / cell[0], 6) for cell in expected.values())
+
+
+def test_clusters_choose_level():
+    clusters = ClusterGrid(cell_size=0.04, factor=4, levels_number=6, max_window_cells=400)
+    moscow = WindowBounds(south_lat=55.5, north_lat=56, west_lng=37.2, east_lng=38)
+    moscow_region = WindowBounds(south_lat=54, north_lat=57, west_lng=35, east_lng=40)
+    world = WindowBounds(south_lat=-90, north_lat=90, west_lng=-180, east_lng=180)
+    assert clusters.choose_level(moscow) == 0
+    assert clusters.choose_level(moscow_region) == 2
+    assert clusters.choose_level(world) == 5
+
+
+def test_clusters_remove_last_bus_of_cell():
+    clusters = ClusterGrid()
+    clusters.update(Bus(busId='1', route='A', lat=55.75, lng=37.6))
+    clusters.update(Bus(busId='1', route='A', lat=55.76, lng=37.61))
+    clusters.remove('1')
+    assert len(clusters) == 0
+    assert all(not level_clusters for level_clusters in clusters.levels)
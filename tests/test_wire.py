@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+from wire import (
+    FrameWriter,
+    WireFormatError,
+    pack_buses_delta_frame,
+    pack_bus_record,
+    pack_deflate_frame,
+    unpack_buses_frame,
+    unpack_buses_delta_frame,
+    unpack_deflate_frame,
+    BUSES_DELTA_FRAME_HEADER,
+)
+
+
+def test_frame_writer_sends_dictionary_for_new_ids_only():
+    frame_writer = FrameWriter()
+    bus = {'busId': 'c790сс', 'route': '120', 'lat': 55.75, 'lng': 37.6}
+
+    dictionary_message, frame = frame_writer.encode([bus])
+    decoded_dictionary = json.loads(dictionary_message)
+    assert decoded_dictionary == {'msgType': 'BusDictionary', 'buses': [[0, 'c790сс']], 'routes': [[0, '120']]}
+    assert list(unpack_buses_frame(frame)) == [(0, 0, 55.75, 37.6)]
+
+    messages = frame_writer.encode([{**bus, 'lat': 55.7494}, {**bus, 'busId': 'a134aa'}])
+    assert len(messages) == 2
+    assert json.loads(messages[0])['buses'] == [[1, 'a134aa']]
+    assert json.loads(messages[0])['routes'] == []
+    assert list(unpack_buses_frame(messages[1])) == [(0, 0, 55.7494, 37.6), (1, 0, 55.75, 37.6)]
+
+    assert len(frame_writer.encode([bus])) == 1
+
+
+def test_frame_size():
+    frame = FrameWriter().encode([{'busId': str(index), 'route': 'A', 'lat': 1, 'lng': 2} for index in range(10)])[-1]
+    assert len(frame) == 4 + 10 * 16
+
+
+@pytest.mark.parametrize('frame', [b'', b'\x02\x00\x00\x00', b'\x01\x00\x00\x00\x01'])
+def test_unpack_wrong_frame(frame):
+    with pytest.raises(WireFormatError):
+        list(unpack_buses_frame(frame))
+
+
+def test_pack_buses_delta_frame():
+    frame = pack_buses_delta_frame(True, [3, 4], [pack_bus_record(1, 2, -55.5, -37.5)])
+    assert BUSES_DELTA_FRAME_HEADER.unpack_from(frame) == (2, True, 2)
+    assert len(frame) == 8 + 2 * 4 + 16
+
+
+def test_unpack_buses_delta_frame():
+    frame = pack_buses_delta_frame(True, [3, 4], [pack_bus_record(1, 2, -55.5, -37.5)])
+    assert unpack_buses_delta_frame(frame) == (True, [3, 4], [(1, 2, -55.5, -37.5)])
+    with pytest.raises(WireFormatError):
+        unpack_buses_delta_frame(frame[:-1])
+    with pytest.raises(WireFormatError):
+        unpack_buses_delta_frame(b'\x02\x00\x00\x00\x05\x00\x00\x00')  # removed indexes are cut
+
+
+@pytest.mark.parametrize('message', ['{"msgType": "Buses", "buses": []}' * 10, b'\x01\x00\x00\x00' * 10])
+def test_deflate_frame_roundtrip(message):
+    frame = pack_deflate_frame(message)
+    assert len(frame) < len(message)
+    assert unpack_deflate_frame(frame) == message
+
+
+@pytest.mark.parametrize('frame', [b'', b'\x01\x00\x00\x00', b'\x03\x01\x00\x00\xff'])
+def test_unpack_wrong_deflate_frame(frame):
+    with pytest.raises(WireFormatError):
+        unpack_deflate_frame(frame)
@@ -0,0 +1,174 @@
+import json
+import struct
+import typing
+import zlib
+
+FRAME_BUSES = 1
+FRAME_BUSES_DELTA = 2
+FRAME_DEFLATE = 3
+
+COORDINATE_SCALE = 10 ** 6  # coordinates are int32 with 6 digits after point, it is about 0.1 meter
+
+# headers are 4 and 8 bytes, so records are aligned by 4 bytes and can be read as Int32Array
+BUSES_FRAME_HEADER = struct.Struct('<B3x')  # frame type
+BUSES_DELTA_FRAME_HEADER = struct.Struct('<B?2xI')  # frame type, keyframe, removed buses count
+BUS_RECORD = struct.Struct('<IIii')  # bus index, route index, lat, lng
+BUS_INDEX = struct.Struct('<I')
+DEFLATE_FRAME_HEADER = struct.Struct('<B?2x')  # frame type, compressed message is text
+
+
+class WireFormatError(ValueError):
+    pass
+
+
+class Interner:
+    """Mapping of strings (bus ids, routes) to small indexes, which are sent instead of strings."""
+
+    def __init__(self):
+        self.indexes: typing.Dict[str, int] = {}
+        self.values: typing.List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def intern(self, value: str) -> int:
+        index = self.indexes.get(value)
+        if index is None:
+            index = len(self.values)
+            self.indexes[value] = index
+            self.values.append(value)
+        return index
+
+
+class Dictionary:
+    """Indexes of bus ids and routes which receiver got from sender in BusDictionary messages."""
+
+    def __init__(self):
+        self.bus_ids: typing.Dict[int, str] = {}
+        self.routes: typing.Dict[int, str] = {}
+        self.generation = 0  # sender renumbers indexes of bus ids in new generation
+
+    def update(self, buses: typing.Iterable[typing.Tuple[int, str]], routes: typing.Iterable[typing.Tuple[int, str]]):
+        self.bus_ids.update(buses)
+        self.routes.update(routes)
+
+
+def build_dictionary_message(
+    buses: typing.Iterable[typing.Tuple[int, str]],
+    routes: typing.Iterable[typing.Tuple[int, str]],
+) -> str:
+    """Build message with new indexes of bus ids and routes."""
+    return json.dumps(
+        {
+            'msgType': 'BusDictionary',
+            'buses': list(buses),
+            'routes': list(routes),
+        },
+        ensure_ascii=False
+    )
+
+
+def pack_bus_record(bus_index: int, route_index: int, lat: float, lng: float) -> bytes:
+    return BUS_RECORD.pack(bus_index, route_index, round(lat * COORDINATE_SCALE), round(lng * COORDINATE_SCALE))
+
+
+def pack_buses_frame(records: typing.Iterable[bytes]) -> bytes:
+    return BUSES_FRAME_HEADER.pack(FRAME_BUSES) + b''.join(records)
+
+
+def pack_buses_delta_frame(
+    keyframe: bool,
+    removed_bus_indexes: typing.Sequence[int],
+    records: typing.Iterable[bytes],
+) -> bytes:
+    header = BUSES_DELTA_FRAME_HEADER.pack(FRAME_BUSES_DELTA, keyframe, len(removed_bus_indexes))
+    removed = struct.pack(f'<{len(removed_bus_indexes)}I', *removed_bus_indexes)
+    return header + removed + b''.join(records)
+
+
+def unpack_buses_frame(frame: bytes) -> typing.Iterator[typing.Tuple[int, int, float, float]]:
+    """
+    Read records of frame with buses.
+
+    :return: tuples (bus index, route index, lat, lng)
+    """
+    if len(frame) < BUSES_FRAME_HEADER.size or frame[0] != FRAME_BUSES:
+        raise WireFormatError('frame should start with buses frame header')
+    records_size = len(frame) - BUSES_FRAME_HEADER.size
+    if records_size % BUS_RECORD.size:
+        raise WireFormatError(f'size of frame records should be multiple of {BUS_RECORD.size} bytes')
+    for bus_index, route_index, lat, lng in BUS_RECORD.iter_unpack(memoryview(frame)[BUSES_FRAME_HEADER.size:]):
+        yield bus_index, route_index, lat / COORDINATE_SCALE, lng / COORDINATE_SCALE
+
+
+def unpack_buses_delta_frame(
+    frame: bytes,
+) -> typing.Tuple[bool, typing.List[int], typing.List[typing.Tuple[int, int, float, float]]]:
+    """
+    Read frame with changed buses.
+
+    :return: keyframe flag, indexes of removed buses and tuples (bus index, route index, lat, lng) of changed buses
+    """
+    if len(frame) < BUSES_DELTA_FRAME_HEADER.size or frame[0] != FRAME_BUSES_DELTA:
+        raise WireFormatError('frame should start with buses delta frame header')
+    _, keyframe, removed_count = BUSES_DELTA_FRAME_HEADER.unpack_from(frame)
+    records_offset = BUSES_DELTA_FRAME_HEADER.size + removed_count * BUS_INDEX.size
+    if len(frame) < records_offset or (len(frame) - records_offset) % BUS_RECORD.size:
+        raise WireFormatError(f'size of frame records should be multiple of {BUS_RECORD.size} bytes')
+    removed_bus_indexes = list(struct.unpack_from(f'<{removed_count}I', frame, BUSES_DELTA_FRAME_HEADER.size))
+    records = [
+        (bus_index, route_index, lat / COORDINATE_SCALE, lng / COORDINATE_SCALE)
+        for bus_index, route_index, lat, lng in BUS_RECORD.iter_unpack(memoryview(frame)[records_offset:])
+    ]
+    return keyframe, removed_bus_indexes, records
+
+
+def pack_deflate_frame(message: typing.Union[str, bytes], level: int = 6) -> bytes:
+    """Compress text or binary message to frame with raw deflate data, browser decompresses it by 'deflate-raw'."""
+    is_text = isinstance(message, str)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    data = compressor.compress(message.encode('utf8') if is_text else message) + compressor.flush()
+    return DEFLATE_FRAME_HEADER.pack(FRAME_DEFLATE, is_text) + data
+
+
+def unpack_deflate_frame(frame: bytes) -> typing.Union[str, bytes]:
+    """Decompress message of deflate frame."""
+    if len(frame) < DEFLATE_FRAME_HEADER.size or frame[0] != FRAME_DEFLATE:
+        raise WireFormatError('frame should start with deflate frame header')
+    _, is_text = DEFLATE_FRAME_HEADER.unpack_from(frame)
+    try:
+        message = zlib.decompress(frame[DEFLATE_FRAME_HEADER.size:], -zlib.MAX_WBITS)
+    except zlib.error as e:
+        raise WireFormatError(f'can not decompress frame: {e}') from e
+    return message.decode('utf8') if is_text else message
+
+
+class FrameWriter:
+    """Encoder of buses to binary frames for one connection, it sends dictionary of new bus ids and routes."""
+
+    def __init__(self):
+        self.bus_ids = Interner()
+        self.routes = Interner()
+
+    def encode(self, buses: typing.Iterable[typing.Dict[str, typing.Any]]) -> typing.List[typing.Union[str, bytes]]:
+        """
+        Encode buses to messages.
+
+        :param buses: dicts with keys busId, route, lat, lng
+        :return: dictionary message if there are new bus ids or routes and frame with buses
+        """
+        known_buses_count = len(self.bus_ids)
+        known_routes_count = len(self.routes)
+        records = [
+            pack_bus_record(self.bus_ids.intern(bus['busId']), self.routes.intern(bus['route']), bus['lat'], bus['lng'])
+            for bus in buses
+        ]
+
+        messages = []
+        if len(self.bus_ids) > known_buses_count or len(self.routes) > known_routes_count:
+            messages.append(build_dictionary_message(
+                enumerate(self.bus_ids.values[known_buses_count:], start=known_buses_count),
+                enumerate(self.routes.values[known_routes_count:], start=known_routes_count),
+            ))
+        messages.append(pack_buses_frame(records))
+        return messages